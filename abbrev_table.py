@@ -0,0 +1,104 @@
+"""
+Compiled table of the abbreviations (macros) of db/abbrev.bibyml.
+
+The bibyml tree is walked once: each macro path is resolved to its values for the four
+abbrev levels (the ones written in db/abbrev{0..3}.bib) together with its validation status.
+The table can be used in memory by the tools that need macro values,
+instead of parsing the generated abbrev?.bib files.
+A macro is the concatenation of the keys of its path, so two paths can give the same macro
+(e.g., "ab" > "c" and "a" > "bc"): if both have a value, this is an error, as a duplicate key in a YAML mapping.
+"""
+
+import collections
+
+#: number of abbrev levels (db/abbrev0.bib to db/abbrev3.bib)
+NB_LEVELS = 4
+
+#: keys of the bibyml tree that are values and not children
+value_keys = ["", "@0", "@1", "@2", "@3"]
+
+#: key to search for value (in the bibyml) depending on the wanted level
+level_keys = {
+    0: ["@0", ""],
+    1: ["@1", "@0", ""],
+    2: ["@2", "@0", ""],
+    3: ["@3", "@2", "@1", ""],
+}
+
+
+def get_value(d, short=0):
+    """ Return the value of the node `d` for the abbrev level `short`, or None if there is no value """
+    for k in level_keys[short]:
+        if k in d:
+            if k == "":
+                return d[k]
+            else:
+                return d[k][""]
+    return None
+
+
+def check_values(values):
+    """
+    Return None if the values of a macro for all levels are valid, or an error message otherwise.
+    If non-abbrev0 values are not empty, the abbrev0 value must not be empty.
+    """
+    if any(values[i] is not None and values[i] != "" for i in range(1, NB_LEVELS)):
+        if values[0] is None or values[0] == "":
+            return "is non-empty for one non-abbrev0 file but is empty in abbrev0"
+    return None
+
+
+class AbbrevTable(object):
+    """
+    Ordered table macro -> (values, error) of the nodes of the bibyml tree with a value
+    where values is the tuple of the values for the abbrev levels 0 to 3 (None if no value)
+    and error is None if the macro is valid, or an error message otherwise.
+    The order is the order of the bibyml tree (the one of the generated abbrev?.bib files).
+    """
+
+    def __init__(self, abbrev):
+        """ Compile the bibyml tree `abbrev`; raise a ValueError if two paths give the same macro """
+        self.table = collections.OrderedDict()
+        paths = {}
+
+        stack = [(abbrev, "", ())]
+        while stack:
+            (d, key, path) = stack.pop()
+            children = [(v, key + k, path + (k,)) for (k, v) in d.items() if k not in value_keys]
+            stack.extend(reversed(children))
+
+            values = tuple(get_value(d, short=short) for short in range(NB_LEVELS))
+            # only the nodes with a value define a macro: an intermediate node may have the name of a macro
+            if all(value is None for value in values):
+                continue
+            if key in paths:
+                raise ValueError("macro '{}' is defined twice: {} and {}".format(
+                    key, " > ".join(paths[key]), " > ".join(path)))
+            paths[key] = path
+            self.table[key] = (values, check_values(values))
+
+    @classmethod
+    def from_file(cls, filename="db/abbrev.bibyml"):
+        import bibyml
+
+        with open(filename) as f:
+            return cls(bibyml.parse(f))
+
+    def errors(self):
+        """ Return the list of (macro, error message) of invalid macros """
+        return [(key, error) for (key, (values, error)) in self.table.items() if error is not None]
+
+    def check(self):
+        """ Raise an AssertionError for the first invalid macro """
+        for (key, error) in self.errors():
+            assert False, "field '{}' {}".format(key, error)
+
+    def items(self, short=0):
+        """ Yield (macro, value) for the abbrev level `short`, skipping macros without value """
+        for (key, (values, error)) in self.table.items():
+            if values[short] is not None:
+                yield key, values[short]
+
+    def macros(self, short=0):
+        """ Return a dictionary macro -> value for the abbrev level `short` """
+        return dict(self.items(short))
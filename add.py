@@ -11,55 +11,140 @@ scriptdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(scriptdir, "..", "lib"))
 sys.path.append(os.path.join(scriptdir, "..", "db"))
 
-import mybibtex.parser
-import mybibtex.generator
-import confs_years
-
+import collections
 import logging
-import shutil
 import argparse
-import time
-
-import config
-from config import *
-
-mybibtex.generator.config = config
-logging.basicConfig(level=logging.DEBUG)
-
-
-def add(filenames: list[str]):
-    parser = mybibtex.parser.Parser()
-    parser.parse_file("db/abbrev0.bib")
-    parser.parse_file("db/crypto_db.bib")
-    db = parser.parse_file("db/crypto_conf_list.bib")
 
-    for filename in filenames:
-        db = parser.parse_file(filename)
-
-    conf_years = confs_years.get_confs_years_inter(db, confs_missing_years)
-
-    with open("db/crypto_db.bib", "w") as out:
-        out.write("% FILE GENERATED by add.py\n")
-        out.write("% DO NOT MODIFY MANUALLY\n")
-        out.write("\n")
-        out.write("\n")
-        for conf in sorted(conf_years.keys()):
-            (start, end) = conf_years[conf]
-            out.write("%    {}:{}{} - {}\n".format(conf, " "*(16-len(conf)-1), start, end))
-        out.write("\n")
-        out.write("\n")
-    
-        mybibtex.generator.bibtex_gen(out, db)
+import confs_index
+import db_cache
+import profiling
+
+
+def precedes(sorter, a, b):
+    """ Return True if the (key, entry) `a` comes before `b`, or is equal to it, in the order of `sorter` (a stable sort) """
+    return next(iter(sorter.sort(iter([a, b]))))[0] == a[0]
+
+
+def get_position(sorter, papers, item):
+    """ Return the number of papers of `papers` (sorted by `sorter`) that come before `item` or are equal to it """
+    lo = 0
+    hi = len(papers)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if precedes(sorter, papers[mid], item):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def merge_sorted(papers, imports):
+    """
+    Return the merge of the list of (key, entry) `imports` (in any order) into the list `papers` (in the SortConfYearPage order),
+    equal to a stable sort of papers + imports.
+    The sort key of each import is computed once: its position in `papers`, found with a binary search,
+    so the merge costs O(m log n) comparisons and O(n + m) copies for n papers and m imports.
+    The imports at the same position are sorted together, in a single stable sort.
+    """
+    import mybibtex.generator
+
+    sorter = mybibtex.generator.SortConfYearPage()
+    gaps = collections.defaultdict(list)
+    for item in imports:
+        gaps[get_position(sorter, papers, item)].append(item)
+
+    merged = []
+    start = 0
+    for position in sorted(gaps):
+        merged.extend(papers[start:position])
+        merged.extend(sorter.sort(iter(gaps[position])))
+        start = position
+    merged.extend(papers[start:])
+    return merged
+
+
+def get_conflicts(files_entries, db):
+    """ Return the keys of the entries of `files_entries` already in `db` or in an earlier file (or earlier in the same file) """
+    conflicts = []
+    seen = set()
+    for entries in files_entries:
+        for (key, entry) in entries:
+            if key in db.entries or key in seen:
+                conflicts.append(key)
+            seen.add(key)
+    return conflicts
+
+
+def add(filenames: list[str], db=None):
+    """
+    Add the entries of `filenames` to the database `db` (loaded from db/ if None),
+    write db/crypto_db.bib and return the updated database.
+
+    If crypto_db.bib was written by add.py (and friends), its papers are already sorted:
+    the imported papers are merged into the papers of the database (see merge_sorted),
+    without sorting the database again. Otherwise, the whole database is sorted by bibtex_gen.
+    Raise a ValueError if some imported entries are already in the database or imported twice (nothing is written).
+    """
+    import mybibtex.generator
+
+    if db is None:
+        db = db_cache.load_db(abbrev_level=0)
+    index = confs_index.get_index(db)
+    files_entries = db_cache.parse_files(filenames, abbrev_level=0)
+
+    conflicts = get_conflicts(files_entries, db)
+    if conflicts:
+        raise ValueError("entries already in the database or imported twice: {}".format(", ".join(str(key) for key in conflicts)))
+
+    # imported papers, in the order of the files
+    imports = [
+        (key, entry)
+        for entries in files_entries
+        for (key, entry) in mybibtex.generator.FilterPaper().filter(collections.OrderedDict(entries))
+    ]
+
+    merged = None
+    if index.sorted_db:
+        with profiling.phase("merge") as p:
+            papers = list(mybibtex.generator.FilterPaper().filter(db.entries))
+            merged = merge_sorted(papers, imports)
+            p["entries"] = len(merged)
+    else:
+        logging.info("add: crypto_db.bib was not written by add.py, the whole database is sorted again")
+
+    # non-paper entries are not merged (and nothing is merged if the database is sorted again)
+    for entries in files_entries:
+        for (key, entry) in entries:
+            db.add_entry(key, entry)
+    for (key, entry) in imports:
+        index.add(key, entry)
+
+    confs_index.write_crypto_db(db, index, entries=merged)
+
+    return db
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("filenames", metavar="file.bib", type=str, help="list of bib files to add to crypto_db.bib", nargs="*")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
-
-    shutil.copy("db/crypto_db.bib", "db/crypto_db.bib.{:0>12d}".format(int(time.time())))
-
-    add(args.filenames)
+    profiling.setup(args, "add.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
+    import backup_store
+
+    with profiling.phase("backup"):
+        backup_store.backup("db/crypto_db.bib")
+
+    try:
+        add(args.filenames)
+    except ValueError as e:
+        logging.error("Error: {}".format(e))
+        sys.exit(1)
     
 
 if __name__=="__main__":
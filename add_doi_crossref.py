@@ -11,31 +11,57 @@ scriptdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(scriptdir, "..", "lib"))
 sys.path.append(os.path.join(scriptdir, "..", "db"))
 
-import mybibtex.parser
-import mybibtex.database
-import mybibtex.generator
-import confs_years
+import confs_index
+import db_cache
+import expand_cache
+import profiling
+from expand_cache import expand
+import title_similarity
 
 import logging
-import shutil
 import argparse
 import time
-import urllib.request, urllib.parse, urllib.error
-import urllib.request, urllib.error, urllib.parse
 import json
 
-import config
-from config import *
-
-mybibtex.generator.config = config
-logging.basicConfig(level=logging.DEBUG)
-
 color_texts = {
     "Error": "\x1b[6;30;41mError\x1b[0m",
     "Warning": "\x1b[6;30;43mWarning\x1b[0m",
     "Success": "\x1b[6;30;42mSuccess\x1b[0m",
 }
 
+#: default URL of the Crossref works API (can be changed to a local server for testing)
+crossref_base_url = "https://api.crossref.org/works"
+
+#: HTTP status codes for which a request is retried
+retry_http_codes = [429, 500, 502, 503, 504]
+
+#: timeout of a request in seconds
+request_timeout = 30
+
+
+class RateLimiter(object):
+    """ Limit the number of requests per second, globally across threads """
+
+    def __init__(self, rps):
+        import threading
+
+        self.interval = 1.0 / rps if rps > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def delay(self, seconds):
+        """ Delay all the next requests by `seconds` (e.g., after a 429 response) """
+        with self.lock:
+            self.next_time = max(self.next_time, time.monotonic() + seconds)
+
 
 # From https://stackoverflow.com/a/32558749
 def levenshtein_distance(s1, s2):
@@ -74,65 +100,163 @@ def format_name(person):
     return s
 
 
-def get_first_author(entry):
+def get_authors(entry, fields_cache=None):
+    """ Return the list of the names of the authors of `entry` (from its author field) """
+    from pybtex.bibtex.utils import split_name_list
+
+    if "author" not in entry.fields:
+        return []
+    # split on the " and " separating the names only, not inside a name (e.g., "Alexander")
+    return split_name_list(expand(entry, "author", fields_cache))
+
+
+def get_first_author(entry, fields_cache=None):
     if "author" in entry.persons:
         return format_name(entry.persons["author"][0])
-    elif "author" in entry.fields:
-        return entry.fields["author"].expand().split("and")[0].strip()
-    else:
-        return ""
+    authors = get_authors(entry, fields_cache)
+    return authors[0] if authors else ""
 
 
-def get_number_authors(entry):
+def get_number_authors(entry, fields_cache=None):
     if "author" in entry.persons:
         return len(entry.persons["author"])
-    elif "author" in entry.fields:
-        return len(entry.fields["author"].expand().split("and"))
-    else:
-        return 0
+    return len(get_authors(entry, fields_cache))
 
 
-def get_crossref_url(entry):
+def get_crossref_url(entry, fields_cache=None):
+    import urllib.parse
+
     query_conf = []
     if "booktitle" in entry.fields:
-        query_conf = [("query.container-title", entry.fields["booktitle"].expand())]
-    return "https://api.crossref.org/works?" + urllib.parse.urlencode([
-        ("query.author", get_first_author(entry)),
+        query_conf = [("query.container-title", expand(entry, "booktitle", fields_cache))]
+    return crossref_base_url + "?" + urllib.parse.urlencode([
+        ("query.author", get_first_author(entry, fields_cache)),
         # ("query.bibliographic", entry.fields["year"].expand()), # removing it because does not work for all Springer books
-        ("query.title", entry.fields["title"].expand())
+        ("query.title", expand(entry, "title", fields_cache))
     ] + query_conf)
 
 
-def get_matching_doi(entry, j):
+def item_matches(matcher, nb_authors, item):
+    """ Return True if the Crossref work `item` matches the paper with title matcher `matcher` and `nb_authors` authors """
+    # check that number of author identical
+    # and title close enough
+    # similarly to https://github.com/IACR/program-editor/blob/c1de208435c063d3f878d55dd2a6b0e8a4b31c21/scripts/editor.js#L1336
+    return len(item.get("author", [])) == nb_authors and matcher.matches(item.get("title", []))
+
+
+def get_matching_doi(entry, j, fields_cache=None):
+    matcher = title_similarity.TitleMatcher(expand(entry, "title", fields_cache))
+    nb_authors = get_number_authors(entry, fields_cache)
     for item in j["message"]["items"]:
-        # check that number of author identical
-        # and title close enough
-        # similarly to https://github.com/IACR/program-editor/blob/c1de208435c063d3f878d55dd2a6b0e8a4b31c21/scripts/editor.js#L1336
-        if len(item["author"]) == get_number_authors(entry) and \
-                min(levenshtein_distance(title, entry.fields["title"].expand()) for title in item["title"]) <= 4:
+        if item_matches(matcher, nb_authors, item):
             return item["DOI"]
 
     return None
 
 
-def get_doi_entry(entry):
-    url = get_crossref_url(entry)
-    f = urllib.request.urlopen(url)
-    j = json.load(f)
-    return get_matching_doi(entry, j)
+def get_retry_after(e):
+    """ Return the delay in seconds requested by the Retry-After header of the HTTPError `e`, or None """
+    retry_after = e.headers.get("Retry-After") if e.headers is not None else None
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        return None  # HTTP-date format, not supported
+
+
+def fetch_json(url, rate_limiter=None, max_retries=5, backoff=1.0, cache=None, timeout=None):
+    """
+    Fetch and decode the JSON at `url`, using the CrossrefCache `cache` if not None.
+    Requests are throttled by `rate_limiter` (if not None), time out after `timeout` seconds (`request_timeout` if None),
+    and are retried with exponential backoff on network errors, timeouts and HTTP codes in `retry_http_codes`,
+    honoring the Retry-After header if any.
+    """
+    import socket
+    import urllib.error
+    import urllib.request
+
+    if timeout is None:
+        timeout = request_timeout
+
+    if cache is not None:
+        body = cache.get(url)
+        if body is not None:
+            return json.loads(body)
+
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as f:
+                body = f.read().decode("utf-8")
+            j = json.loads(body)
+            if cache is not None:
+                cache.put(url, body)
+            return j
+        except urllib.error.HTTPError as e:
+            if e.code not in retry_http_codes or attempt == max_retries:
+                raise
+            delay = get_retry_after(e)
+            if delay is None:
+                delay = backoff * 2 ** attempt
+            logging.info("HTTP {} for {}, retrying in {:.1f}s".format(e.code, url, delay))
+            if rate_limiter is not None:
+                rate_limiter.delay(delay)
+            else:
+                time.sleep(delay)
+        except (urllib.error.URLError, socket.timeout) as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2 ** attempt
+            logging.info("{} for {}, retrying in {:.1f}s".format(getattr(e, "reason", e), url, delay))
+            time.sleep(delay)
+
+
+def get_doi_entry(entry, rate_limiter=None, cache=None, fields_cache=None):
+    url = get_crossref_url(entry, fields_cache)
+    j = fetch_json(url, rate_limiter, cache=cache)
+    doi = get_matching_doi(entry, j, fields_cache)
+    if doi is None and cache is not None:
+        cache.set_negative(url)
+    return doi
+
+
+def apply_doi(key, entry, doi, fields_cache=None):
+    """ Print the result of the search of the DOI of `entry` and add the DOI to `entry` if it is new """
+    if doi == None:
+        print(("    {}: cannot find DOI for {}".format(color_texts["Warning"], key)))
+        print(("    tried: {}".format(get_crossref_url(entry, fields_cache))))
+        return
+
+    if doi != None and "doi" in entry.fields and doi != expand(entry, "doi", fields_cache):
+        print(("    {}: expected {} but got {}".format(color_texts["Error"], expand(entry, "doi", fields_cache), doi)))
+        return
+
+    print(("    {}: found DOI {}".format(color_texts["Success"], doi)))
+
+    if "doi" in entry.fields:
+        print("    (matched known DOI)")
+    else:
+        import mybibtex.database
+        entry.fields["doi"] = mybibtex.database.Value([mybibtex.database.ValuePartQuote(doi)])
 
 
-def add_doi(check_known_doi=False, filter_conf=None):
-    parser = mybibtex.parser.Parser()
-    parser.parse_file("db/abbrev3.bib")
-    parser.parse_file("db/crypto_db_c85.bib")
-    db = parser.parse_file("db/crypto_conf_list.bib")
+def add_doi(check_known_doi=False, filter_conf=None, workers=1, rps=5.0, cache=None, fields_cache=None):
+    import mybibtex.generator
+
+    db = db_cache.load_db(abbrev_level=3, db_filenames=["crypto_db_c85.bib", "crypto_conf_list.bib"])
 
     myfilter = mybibtex.generator.FilterPaper()
     if filter_conf:
         myfilter = mybibtex.generator.FilterConf(filter_conf, myfilter)
     entries = dict(myfilter.filter(db.entries))
-    for (keybib, entry) in entries.items():
+
+    todo = []
+    with profiling.phase("sort") as p:
+        sorted_entries = list(mybibtex.generator.SortConfYearPage().sort(iter(entries.items())))
+        p["entries"] = len(sorted_entries)
+    for (keybib, entry) in sorted_entries:
         key = str(keybib)
 
         if key.startswith("EPRINT"):
@@ -141,51 +265,79 @@ def add_doi(check_known_doi=False, filter_conf=None):
         if "doi" in entry.fields and not check_known_doi:
            continue # doi already there
 
-        print(("Searching DOI for {}".format(key)))
+        todo.append((key, entry))
 
-        doi = get_doi_entry(entry)
-
-        if doi == None:
-            print(("    {}: cannot find DOI for {}".format(color_texts["Warning"], key)))
-            print(("    tried: {}".format(get_crossref_url(entry))))
-            continue
-
-        if doi != None and "doi" in entry.fields and doi != entry.fields["doi"].expand():
-            print(("    {}: expected {} but got {}".format(color_texts["Error"], entry.fields["doi"].expand(), doi)))
-            continue
+    import concurrent.futures
 
-        print(("    {}: found DOI {}".format(color_texts["Success"], doi)))
+    rate_limiter = RateLimiter(rps)
 
-        if "doi" in entry.fields:
-            print("    (matched known DOI)")
-        else:
-            entry.fields["doi"] = mybibtex.database.Value([mybibtex.database.ValuePartQuote(doi)])
+    with profiling.phase("network") as p, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        p["entries"] = len(todo)
+        # lookups run concurrently, but results are applied in the SortConfYearPage order
+        futures = [executor.submit(get_doi_entry, entry, rate_limiter, cache, fields_cache) for (key, entry) in todo]
+        for ((key, entry), future) in zip(todo, futures):
+            print(("Searching DOI for {}".format(key)))
+            try:
+                doi = future.result()
+            except Exception as e:
+                # a failed lookup (network error, unexpected response...) must not abort the other entries
+                print(("    {}: request failed for {} ({})".format(color_texts["Error"], key, e)))
+                continue
+            apply_doi(key, entry, doi, fields_cache)
 
-    conf_years = confs_years.get_confs_years_inter(db, confs_missing_years)
-
-    with open("db/crypto_db.bib", "w") as out:
-        out.write("% FILE GENERATED by add.py\n")
-        out.write("% DO NOT MODIFY MANUALLY\n")
-        out.write("\n")
-        out.write("\n")
-        for conf in sorted(conf_years.keys()):
-            (start, end) = conf_years[conf]
-            out.write("%    {}:{}{} - {}\n".format(conf, " " * (16 - len(conf) - 1), start, end))
-        out.write("\n")
-        out.write("\n")
-
-        mybibtex.generator.bibtex_gen(out, db)
+    # the database is not read from crypto_db.bib: the stored index cannot be used
+    with profiling.phase("confs_years"):
+        index = confs_index.ConfsIndex.build(db)
+    confs_index.write_crypto_db(db, index)
 
 
 def main():
+    global crossref_base_url, request_timeout
+
     parser = argparse.ArgumentParser("Automatically get the missing DOI from crossrefs. WARNING: does not seem to match paper very well...")
     parser.add_argument("-c", action="store_true", help="check known DOI too")
     parser.add_argument("--filter", help="filter a specific conference")
+    parser.add_argument("--workers", type=int, default=1, help="number of concurrent requests (default: 1)")
+    parser.add_argument("--rps", type=float, default=5.0, help="maximum number of requests per second (default: 5)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the Crossref response cache")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="ignore cached Crossref responses but store the new ones")
+    parser.add_argument("--expand-cache", action="store_true", help="memoize the expansion of the fields")
+    parser.add_argument("--timeout", type=float, default=request_timeout,
+                        help="timeout of a request in seconds (default: {})".format(request_timeout))
+    parser.add_argument("--base-url", default=crossref_base_url,
+                        help="URL of the Crossref works API (default: {})".format(crossref_base_url))
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiling.setup(args, "add_doi_crossref.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
+    import backup_store
+    import crossref_cache
+
+    crossref_base_url = args.base_url
+    request_timeout = args.timeout
+
+    with profiling.phase("backup"):
+        backup_store.backup("db/crypto_db.bib")
+
+    cache = None
+    if not args.no_cache:
+        cache = crossref_cache.CrossrefCache(refresh=args.refresh_cache)
+
+    fields_cache = expand_cache.ExpandCache() if args.expand_cache else None
 
-    shutil.copy("db/crypto_db.bib", "db/crypto_db.bib.{:0>12d}".format(int(time.time())))
+    add_doi(args.c, args.filter, args.workers, args.rps, cache, fields_cache)
 
-    add_doi(args.c, args.filter)
+    if cache is not None:
+        logging.info("crossref cache: {}".format(cache.get_stats()))
+        cache.close()
+    if fields_cache is not None:
+        logging.info("expand cache: {}".format(fields_cache.get_stats()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Content-addressed store of the backups of db/crypto_db.bib.
+
+Each snapshot is stored once, compressed with gzip at `compress_level`, under the SHA-256 of its content,
+and is only recorded when the content changed since the previous snapshot of the same file.
+Old snapshots are removed according to a retention policy:
+the `keep_last` most recent snapshots are kept, plus the most recent snapshot of each of the last `keep_daily` days.
+
+Usage (in the root folder containing the folder "db"):
+  backup_store.py list
+  backup_store.py backup [file]
+  backup_store.py restore [snapshot] [--output file]
+  backup_store.py prune
+"""
+
+import argparse
+import datetime
+import hashlib
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+
+import profiling
+
+#: default folder of the store
+default_store_dir = "db/crypto_db.bib.backups"
+
+#: gzip level of the snapshots: the backup runs at the start of every script modifying crypto_db.bib,
+# so it has to stay fast (xz at its default preset took about 20 s on a 16 MB file, level 1 of gzip about 0.4 s)
+compress_level = 1
+
+#: default retention policy
+default_keep_last = 20
+default_keep_daily = 30
+
+
+class BackupStore(object):
+    def __init__(self, store_dir=default_store_dir, keep_last=default_keep_last, keep_daily=default_keep_daily):
+        self.store_dir = store_dir
+        self.objects_dir = os.path.join(store_dir, "objects")
+        self.index_filename = os.path.join(store_dir, "index.json")
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+
+    def read_index(self):
+        """ Return the list of snapshots {"time", "name", "sha256", "size"}, oldest first """
+        try:
+            with open(self.index_filename) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def write_index(self, index):
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_filename = self.index_filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_filename, self.index_filename)
+
+    def get_object_filename(self, sha256):
+        return os.path.join(self.objects_dir, sha256 + ".gz")
+
+    def backup(self, filename):
+        """
+        Record a snapshot of `filename` if its content changed since its last snapshot.
+        Return the snapshot, or None if nothing was recorded.
+        """
+        with open(filename, "rb") as f:
+            content = f.read()
+        sha256 = hashlib.sha256(content).hexdigest()
+        name = os.path.basename(filename)
+
+        index = self.read_index()
+        previous = [s for s in index if s["name"] == name]
+        if previous and previous[-1]["sha256"] == sha256:
+            logging.info("backup_store: {} unchanged since last snapshot, no backup".format(filename))
+            return None
+
+        object_filename = self.get_object_filename(sha256)
+        if not os.path.exists(object_filename):
+            os.makedirs(self.objects_dir, exist_ok=True)
+            tmp_filename = object_filename + ".tmp"
+            with gzip.open(tmp_filename, "wb", compresslevel=compress_level) as f:
+                f.write(content)
+            os.replace(tmp_filename, object_filename)
+
+        snapshot = {"time": int(time.time()), "name": name, "sha256": sha256, "size": len(content)}
+        index.append(snapshot)
+        index = self.apply_retention(index)
+        self.write_index(index)
+        self.remove_unreferenced_objects(index)
+        logging.info("backup_store: {} backed up as {}".format(filename, sha256[:12]))
+        return snapshot
+
+    def apply_retention(self, index):
+        """ Return the snapshots of `index` to keep according to the retention policy """
+        kept = []
+        for name in sorted(set(s["name"] for s in index)):
+            snapshots = [s for s in index if s["name"] == name]
+            keep = set(id(s) for s in snapshots[-self.keep_last:]) if self.keep_last > 0 else set()
+            today = datetime.date.today()
+            days = set()
+            for s in reversed(snapshots):
+                day = datetime.date.fromtimestamp(s["time"])
+                if (today - day).days < self.keep_daily and day not in days:
+                    days.add(day)
+                    keep.add(id(s))
+            kept.extend(s for s in snapshots if id(s) in keep)
+        return sorted(kept, key=lambda s: s["time"])
+
+    def remove_unreferenced_objects(self, index):
+        referenced = set(s["sha256"] for s in index)
+        if not os.path.isdir(self.objects_dir):
+            return
+        for filename in os.listdir(self.objects_dir):
+            if filename.endswith(".gz") and filename[:-len(".gz")] not in referenced:
+                os.remove(os.path.join(self.objects_dir, filename))
+
+    def prune(self):
+        """ Apply the retention policy, return the number of removed snapshots """
+        index = self.read_index()
+        kept = self.apply_retention(index)
+        self.write_index(kept)
+        self.remove_unreferenced_objects(kept)
+        return len(index) - len(kept)
+
+    def find(self, snapshot_id=None, name="crypto_db.bib"):
+        """
+        Return the snapshot of `name` identified by `snapshot_id`:
+        a prefix of its SHA-256, its time, or None for the latest one
+        """
+        snapshots = [s for s in self.read_index() if s["name"] == name]
+        if snapshot_id is None:
+            return snapshots[-1] if snapshots else None
+        for s in reversed(snapshots):
+            if s["sha256"].startswith(snapshot_id) or str(s["time"]) == snapshot_id:
+                return s
+        return None
+
+    def read(self, snapshot):
+        """ Return the content of `snapshot` """
+        with gzip.open(self.get_object_filename(snapshot["sha256"]), "rb") as f:
+            return f.read()
+
+
+def backup(filename="db/crypto_db.bib"):
+    """ Back up `filename` in the default store """
+    return BackupStore().backup(filename)
+
+
+def main():
+    parser = argparse.ArgumentParser("Manage the backups of db/crypto_db.bib")
+    parser.add_argument("--store", default=default_store_dir, help="folder of the store (default: {})".format(default_store_dir))
+    parser.add_argument("--keep-last", type=int, default=default_keep_last,
+                        help="number of most recent snapshots to keep (default: {})".format(default_keep_last))
+    parser.add_argument("--keep-daily", type=int, default=default_keep_daily,
+                        help="number of days for which the last snapshot of the day is kept (default: {})".format(default_keep_daily))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list the snapshots")
+    parser_backup = subparsers.add_parser("backup", help="back up a file if it changed")
+    parser_backup.add_argument("filename", nargs="?", default="db/crypto_db.bib")
+    parser_restore = subparsers.add_parser("restore", help="restore a snapshot (the current file is backed up first)")
+    parser_restore.add_argument("snapshot", nargs="?", help="SHA-256 prefix or time of the snapshot (default: latest)")
+    parser_restore.add_argument("--name", default="crypto_db.bib", help="name of the backed up file (default: crypto_db.bib)")
+    parser_restore.add_argument("--output", help="file to restore to (default: db/<name>)")
+    subparsers.add_parser("prune", help="apply the retention policy")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "backup_store.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    store = BackupStore(args.store, args.keep_last, args.keep_daily)
+
+    if args.command == "list":
+        for s in store.read_index():
+            print("{}  {}  {:<19} {:>10d} bytes  {}".format(
+                s["sha256"][:12], s["time"],
+                datetime.datetime.fromtimestamp(s["time"]).strftime("%Y-%m-%d %H:%M:%S"),
+                s["size"], s["name"]
+            ))
+    elif args.command == "backup":
+        with profiling.phase("backup"):
+            store.backup(args.filename)
+    elif args.command == "restore":
+        snapshot = store.find(args.snapshot, args.name)
+        if snapshot is None:
+            logging.error("Error: no such snapshot")
+            sys.exit(1)
+        output = args.output if args.output is not None else os.path.join("db", args.name)
+        # read the snapshot first: backing up the current file applies the retention policy,
+        # which may remove the object of the snapshot
+        with profiling.phase("restore"):
+            content = store.read(snapshot)
+            if os.path.exists(output):
+                store.backup(output)
+            with open(output, "wb") as f:
+                f.write(content)
+        print("restored {} ({}) to {}".format(snapshot["sha256"][:12], snapshot["time"], output))
+    elif args.command == "prune":
+        with profiling.phase("prune"):
+            nb = store.prune()
+        print("{} snapshots removed".format(nb))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark find_duplicates.get_candidate_pairs (prefix-filtering index) against the comparison of all pairs.
+
+Titles (words of a vocabulary with a Zipf distribution, as in real titles) and author lists
+are generated randomly, with `--duplicates` papers entered a second time
+with a small modification (a typo, a word added or removed, a different case or TeX markup).
+The index is run on the full synthetic database, the comparison of all pairs on a subset of `--naive-size`
+papers only (and extrapolated), and the pairs found by both on this subset are checked to be identical.
+The subset contains injected duplicate pairs (up to a quarter of its papers), completed by the first papers.
+
+This script needs to be run in the root folder containing the
+folders "lib" and "db"
+"""
+
+import sys
+import os
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(scriptdir, ".."))
+sys.path.append(os.path.join(scriptdir, "..", "..", "lib"))
+sys.path.append(os.path.join(scriptdir, "..", "..", "db"))
+
+import argparse
+import random
+import string
+import time
+
+import find_duplicates
+import title_similarity
+
+#: words frequent in titles
+common_words = "on the of for and a in with from to".split()
+
+
+def gen_vocabulary(size, rng):
+    """ Return `size` random words and their cumulative Zipf weights, as the words of real titles """
+    words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 11))) for _ in range(size)]
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, size + 1):
+        total += 1.0 / rank
+        cum_weights.append(total)
+    return (words, cum_weights)
+
+
+def gen_title(vocabulary, rng):
+    (words, cum_weights) = vocabulary
+    title = rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 12))
+    for _ in range(rng.randint(0, 4)):
+        title.insert(rng.randrange(len(title) + 1), rng.choice(common_words))
+    return " ".join(title).capitalize()
+
+
+def modify_title(title, rng):
+    words = title.split()
+    r = rng.randrange(4)
+    if r == 0:
+        i = rng.randrange(len(words))
+        w = words[i]
+        j = rng.randrange(len(w))
+        words[i] = w[:j] + rng.choice(string.ascii_lowercase) + w[j+1:]
+    elif r == 1:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(common_words))
+    elif r == 2 and len(words) > 4:
+        del words[rng.randrange(len(words))]
+    else:
+        words = ["{" + w.upper() + "}" if rng.random() < 0.2 else w for w in words]
+    return " ".join(words)
+
+
+def gen_records(size, nb_duplicates, rng):
+    """ Return the records and the set of the pairs (i, j) of injected duplicates """
+    vocabulary = gen_vocabulary(max(1000, size // 2), rng)
+    records = []
+    for i in range(size - nb_duplicates):
+        authors = frozenset("author{}".format(rng.randrange(size // 3)) for _ in range(rng.randint(1, 5)))
+        title = gen_title(vocabulary, rng)
+        records.append(("K{}".format(i), title, title_similarity.title_words(title), authors))
+    duplicates = set()
+    for i in rng.sample(range(len(records)), nb_duplicates):
+        (key, title, words, authors) = records[i]
+        title = modify_title(title, rng)
+        duplicates.add((i, len(records)))
+        records.append((key + "dup", title, title_similarity.title_words(title), authors))
+    return (records, duplicates)
+
+
+def get_naive_subset(size, duplicates, n):
+    """ Return the indices of `n` of the `size` papers, including both papers of some pairs of `duplicates` """
+    subset = []
+    for (i, j) in sorted(duplicates)[:n // 4]:
+        subset += [i, j]
+    chosen = set(subset)
+    for i in range(size):
+        if len(subset) >= n:
+            break
+        if i not in chosen:
+            subset.append(i)
+    return subset
+
+
+def naive_pairs(word_sets, threshold):
+    return [
+        (i, j, s)
+        for i in range(len(word_sets))
+        for j in range(i + 1, len(word_sets))
+        for s in [find_duplicates.jaccard(word_sets[i], word_sets[j])]
+        if s >= threshold
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark the duplicate detection of find_duplicates.py")
+    parser.add_argument("--size", type=int, default=30000, help="number of papers (default: 30000)")
+    parser.add_argument("--duplicates", type=int, default=300, help="number of injected duplicates (default: 300)")
+    parser.add_argument("--naive-size", type=int, default=2000, help="number of papers compared pairwise (default: 2000)")
+    parser.add_argument("--threshold", type=float, default=find_duplicates.default_threshold)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    (records, duplicates) = gen_records(args.size, args.duplicates, rng)
+    word_sets = [r[2] for r in records]
+
+    start = time.perf_counter()
+    pairs = find_duplicates.get_candidate_pairs(word_sets, args.threshold)
+    index_time = time.perf_counter() - start
+    found = set((i, j) for (i, j, s) in pairs)
+    recall = len(duplicates & found) / len(duplicates) if duplicates else 1.0
+    print("index:  {:8.2f} s for {} papers, {} pairs, recall of the injected duplicates {:.3f}".format(
+        index_time, len(records), len(pairs), recall))
+
+    n = min(args.naive_size, len(records))
+    subset = get_naive_subset(len(records), duplicates, n)
+    subset_word_sets = [word_sets[i] for i in subset]
+    start = time.perf_counter()
+    expected = set((i, j) for (i, j, s) in naive_pairs(subset_word_sets, args.threshold))
+    naive_time = time.perf_counter() - start
+    print("naive:  {:8.2f} s for {} papers, extrapolated to {:.0f} s for {} papers".format(
+        naive_time, n, naive_time * (len(records) / n) ** 2, len(records)))
+
+    got = set((i, j) for (i, j, s) in find_duplicates.get_candidate_pairs(subset_word_sets, args.threshold))
+    if got != expected:
+        print("ERROR: the index and the naive comparison differ on {} pairs".format(len(got ^ expected)))
+        sys.exit(1)
+    # pairs of the subset, as indices of the full database
+    in_subset = set(subset)
+    subset_duplicates = set((i, j) for (i, j) in duplicates if i in in_subset and j in in_subset)
+    found_duplicates = set(
+        (min(subset[i], subset[j]), max(subset[i], subset[j])) for (i, j) in expected
+    ) & subset_duplicates
+    print("index and naive comparison agree on {} papers ({} pairs, {} / {} injected duplicates)".format(
+        n, len(expected), len(found_duplicates), len(subset_duplicates)))
+
+
+if __name__ == "__main__":
+    main()
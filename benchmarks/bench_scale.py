@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Benchmark how the phases used by the scripts scale with the size of the database.
+
+For each size, a synthetic but realistic database is generated in a temporary folder
+(proceedings in the style of crypto_conf_list.bib for the conferences of config.confs,
+multi-author papers with pages and DOI crossref-ing them, macros of db/abbrev0.bib),
+then the following phases are timed (and memory-profiled with --memory):
+  parse         mybibtex.parser.Parser.parse_file
+  filter_paper  FilterPaper
+  filter_conf   FilterConf (first conference of config.confs)
+  sort          SortConfYearPage.sort
+  gen_expand    bibtex_gen with expand_crossrefs=True
+  gen_crossref  bibtex_gen with expand_crossrefs=False
+  confs_years   get_confs_years_inter
+  merge_doi     merge_doi.merge_doi_db on an import of 1% of the papers (half of them with a modified key)
+
+Results are written as JSON so that runs can be compared across commits.
+
+This script needs to be run in the root folder containing the
+folders "lib" and "db"
+"""
+
+import sys
+import os
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(scriptdir, ".."))
+sys.path.append(os.path.join(scriptdir, "..", "..", "lib"))
+sys.path.append(os.path.join(scriptdir, "..", "..", "db"))
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import re
+import string
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import mybibtex.parser
+import mybibtex.generator
+import confs_years
+import merge_doi
+
+import config
+from config import *
+
+mybibtex.generator.config = config
+
+_re_macro = re.compile(r"^@string\{\s*([^\s=]+)\s*=", re.IGNORECASE | re.MULTILINE)
+
+#: words used to generate titles
+title_words = (
+    "secure efficient practical threshold adaptive lattice-based post-quantum zero-knowledge "
+    "succinct non-interactive arguments signatures encryption identity-based attribute-based "
+    "homomorphic multiparty computation oblivious transfer commitments proofs attacks cryptanalysis "
+    "block ciphers hash functions side-channel leakage-resilient protocols key exchange "
+    "pairings isogenies codes learning with errors random oracles indistinguishability obfuscation"
+).split()
+
+first_names = "Alice Bob Carol Dan Eve Frank Grace Hugo Ines Jun Kiran Lena Marc Nadia Omar Petra Quentin Rosa Sam Tara".split()
+last_names = "Abdalla Boneh Canetti Damgard Ergun Fischlin Goldwasser Halevi Ishai Joux Katz Lindell Micali Naor Ostrovsky Pass Quisquater Rogaway Shamir Tessaro Unruh Vaikuntanathan Waters Yung Zhandry".split()
+
+#: years of the synthetic database
+years = list(range(1990, 2025))
+
+
+def get_macros(db_dir):
+    """ Return the list of macro names of abbrev0.bib (empty if not available) """
+    try:
+        with open(os.path.join(db_dir, "abbrev0.bib")) as f:
+            return _re_macro.findall(f.read())
+    except FileNotFoundError:
+        return []
+
+
+def gen_db(folder, size, macros, rng):
+    """
+    Generate folder/abbrev0.bib, folder/crypto_conf_list.bib, folder/crypto_db.bib with `size` papers
+    and folder/import.bib (DOI import of 1% of the papers).
+    Return the number of papers and the number of imported papers.
+    """
+    confs = sorted(config.confs.keys())
+    nb_blocks = len(confs) * len(years)
+    per_block = max(1, -(-size // nb_blocks))
+    publishers = [m for m in macros if "springer" in m.lower()] or ["\"Springer\""]
+    addresses = [m for m in macros if m.startswith("mar:") or ":" in m] or ["\"Somewhere\""]
+
+    with open(os.path.join(folder, "abbrev0.bib"), "w") as f:
+        try:
+            with open(os.path.join("db", "abbrev0.bib")) as fin:
+                f.write(fin.read())
+        except FileNotFoundError:
+            pass
+
+    with open(os.path.join(folder, "crypto_conf_list.bib"), "w") as f:
+        for conf in confs:
+            for year in years:
+                f.write(
+                    "@Proceedings{{{conf}:{year},\n"
+                    "  editor =       \"{editor}\",\n"
+                    "  title =        \"{{{conf}}}~{year}\",\n"
+                    "  booktitle =    \"{{{conf}}}~{year}\",\n"
+                    "  series =       \"{{LNCS}}\",\n"
+                    "  volume =       {volume},\n"
+                    "  address =      {address},\n"
+                    "  publisher =    {publisher},\n"
+                    "  year =         {year},\n"
+                    "}}\n\n".format(
+                        conf=conf, year=year, editor=rng.choice(first_names) + " " + rng.choice(last_names),
+                        volume=rng.randint(1000, 15000), address=rng.choice(addresses),
+                        publisher=rng.choice(publishers)
+                    )
+                )
+
+    nb = 0
+    imported = []
+    with open(os.path.join(folder, "crypto_db.bib"), "w") as f:
+        for conf in confs:
+            for year in years:
+                page = 1
+                used = set()
+                for i in range(per_block):
+                    if nb >= size:
+                        break
+                    nb += 1
+                    authors = [
+                        (rng.choice(first_names), rng.choice(last_names))
+                        for _ in range(min(12, 1 + int(rng.expovariate(0.4))))
+                    ]
+                    auth = "".join(last[:3] if len(authors) <= 3 else last[0] for (first, last) in authors[:6])
+                    key = "{}:{}{:02d}".format(conf, auth, year % 100)
+                    dis = ""
+                    while key + dis in used:
+                        dis = rng.choice(string.ascii_lowercase)
+                    used.add(key + dis)
+                    key = key + dis
+                    nb_pages = rng.randint(10, 30)
+                    words = [rng.choice(title_words) for _ in range(rng.randint(4, 12))]
+                    words[0] = words[0].capitalize()
+                    j = rng.randrange(len(words))
+                    words[j] = "{" + words[j].upper() + "}"
+                    paper = {
+                        "key": key,
+                        "author": " and\n                  ".join("{} {}".format(a, b) for (a, b) in authors),
+                        "title": " ".join(words),
+                        "pages": "{}--{}".format(page, page + nb_pages - 1),
+                        "doi": "10.1007/978-3-540-{:05d}-{}_{}".format(rng.randint(0, 99999), rng.randint(0, 9), i + 1),
+                        "crossref": "{}:{}".format(conf, year),
+                    }
+                    page += nb_pages
+                    f.write(format_paper(paper))
+                    if rng.random() < 0.01:
+                        imported.append(paper)
+
+    with open(os.path.join(folder, "import.bib"), "w") as f:
+        for (i, paper) in enumerate(imported):
+            if i % 2 == 1:
+                # modified key: exercises the fallback matching of merge_doi
+                paper = dict(paper, key=paper["key"].replace(":", ":Xyz", 1))
+            f.write(format_paper(paper))
+
+    return nb, len(imported)
+
+
+def format_paper(paper):
+    return (
+        "@InProceedings{{{key},\n"
+        "  author =       \"{author}\",\n"
+        "  title =        \"{title}\",\n"
+        "  pages =        \"{pages}\",\n"
+        "  doi =          \"{doi}\",\n"
+        "  crossref =     \"{crossref}\",\n"
+        "}}\n\n".format(**paper)
+    )
+
+
+class Runner(object):
+    """ Run and measure phases, storing the results """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.results = []
+
+    def run(self, size, phase, fn, count=None):
+        """ Run `fn()`, record its measurements and return its result (None if it failed) """
+        if self.memory:
+            tracemalloc.start()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        error = None
+        res = None
+        try:
+            res = fn()
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        peak = None
+        if self.memory:
+            (current, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        result = {"size": size, "phase": phase, "wall": wall, "cpu": cpu, "peak_mem": peak}
+        if count is not None:
+            result["entries"] = count(res) if res is not None else None
+        if error is not None:
+            result["error"] = error
+        self.results.append(result)
+        print("{:>7d} {:<14} {:9.3f}s wall {:9.3f}s cpu{}{}".format(
+            size, phase, wall, cpu,
+            " {:9.1f} MiB".format(peak / 1024 / 1024) if peak is not None else "",
+            "  ERROR {}".format(error) if error is not None else ""
+        ))
+        return res
+
+
+def bench_size(runner, size, macros, seed):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as folder:
+        (nb_papers, nb_imported) = gen_db(folder, size, macros, rng)
+
+        def parse():
+            parser = mybibtex.parser.Parser()
+            parser.parse_file(os.path.join(folder, "abbrev0.bib"))
+            parser.parse_file(os.path.join(folder, "crypto_db.bib"))
+            return parser.parse_file(os.path.join(folder, "crypto_conf_list.bib"))
+        db = runner.run(size, "parse", parse, count=lambda db: len(db.entries))
+        if db is None:
+            return
+
+        entries = runner.run(size, "filter_paper", lambda: dict(mybibtex.generator.FilterPaper().filter(db.entries)),
+                             count=len)
+        if entries is None:
+            return
+        conf = sorted(config.confs.keys())[0]
+        runner.run(size, "filter_conf", lambda: dict(
+            mybibtex.generator.FilterConf(conf, mybibtex.generator.FilterPaper()).filter(db.entries)
+        ), count=len)
+
+        runner.run(size, "sort", lambda: list(mybibtex.generator.SortConfYearPage().sort(iter(entries.items()))),
+                   count=len)
+
+        def gen(expand_crossrefs):
+            out = io.StringIO()
+            mybibtex.generator.bibtex_gen(out, db, expand_crossrefs=expand_crossrefs,
+                                          include_crossrefs=not expand_crossrefs, remove_empty_fields=True)
+            return out.getvalue()
+        runner.run(size, "gen_expand", lambda: gen(True), count=lambda s: s.count("\n@"))
+        runner.run(size, "gen_crossref", lambda: gen(False), count=lambda s: s.count("\n@"))
+
+        runner.run(size, "confs_years", lambda: confs_years.get_confs_years_inter(db, confs_missing_years),
+                   count=len)
+
+        def merge():
+            parser_doi = mybibtex.parser.Parser()
+            parser_doi.parse_file(os.path.join(folder, "abbrev0.bib"))
+            parser_doi.parse_file(os.path.join(folder, "crypto_conf_list.bib"))
+            db_doi = parser_doi.parse_file(os.path.join(folder, "import.bib"))
+            with contextlib.redirect_stdout(io.StringIO()):
+                merge_doi.merge_doi_db(db, db_doi)
+            return nb_imported
+        runner.run(size, "merge_doi", merge, count=lambda n: n)
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=scriptdir, stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark parse, filter, sort and generate on synthetic databases")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000, 500000],
+                        help="numbers of papers of the synthetic databases (default: 10000 50000 100000 500000)")
+    parser.add_argument("--memory", action="store_true",
+                        help="measure the peak memory of each phase with tracemalloc (slows down the phases)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_scale.json", help="JSON output file (default: bench_scale.json)")
+    args = parser.parse_args()
+
+    macros = get_macros("db")
+    runner = Runner(args.memory)
+    for size in args.sizes:
+        bench_size(runner, size, macros, args.seed)
+
+    with open(args.output, "w") as out:
+        json.dump({
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "memory": args.memory,
+            "results": runner.results,
+        }, out, indent=2)
+        out.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark the startup time of cryptobib.py: each command line is run `--runs` times
+in a fresh interpreter and the median wall time is reported.
+
+The light command lines must stay under `--max-ms`: the script exits with status 1 otherwise,
+so that it can be used in CI. They import the module of every command and parse its arguments,
+and run the commands that do not need the database (`check --list`, `backup list`):
+mybibtex, the database configuration and web2py must only be imported by the commands that use them.
+The heavy command lines run read-only commands on the database and are only reported.
+
+This script needs to be run in the root folder containing the
+folders "lib" and "db"
+"""
+
+import sys
+import os
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+
+import argparse
+import json
+import statistics
+import subprocess
+import time
+
+cryptobib_script = os.path.join(scriptdir, "..", "cryptobib.py")
+
+sys.path.append(os.path.join(scriptdir, ".."))
+
+import cryptobib
+
+#: command lines that must start fast
+light = [
+    ["--help"],
+    ["unknown-command"],
+] + [[command, "--help"] for (command, _) in cryptobib.commands] + [
+    ["check", "--list"],
+    ["backup", "list"],
+]
+
+#: command lines that are only measured (they load the database)
+heavy = [
+    ["confs-index"],
+    ["check", "--check", "crossref", "--output", os.devnull],
+    ["check-doi"],
+    ["find-duplicates", "--json"],
+]
+
+
+def measure(args, runs):
+    """ Return the median wall time, in ms, of `cryptobib.py args` """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, cryptobib_script] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark the startup time of cryptobib.py")
+    parser.add_argument("--runs", type=int, default=10, help="number of runs per command line (default: 10)")
+    parser.add_argument("--max-ms", type=float, default=100, help="maximal median time of the light command lines (default: 100)")
+    parser.add_argument("--heavy", action="store_true", help="also measure the heavy command lines")
+    parser.add_argument("--json", help="write the results in this JSON file")
+    args = parser.parse_args()
+
+    # baseline: the startup of the interpreter itself
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        subprocess.run([sys.executable, "-c", "pass"])
+    baseline = (time.perf_counter() - start) * 1000 / args.runs
+    print("{:<60} {:8.1f} ms".format("python -c pass (mean)", baseline))
+
+    results = {"baseline_ms": baseline, "light": {}, "heavy": {}}
+    failed = False
+    for (kind, command_lines) in [("light", light), ("heavy", heavy if args.heavy else [])]:
+        for command_line in command_lines:
+            ms = measure(command_line, args.runs)
+            results[kind][" ".join(command_line)] = ms
+            status = ""
+            if kind == "light" and ms > args.max_ms:
+                status = "  > {} ms".format(args.max_ms)
+                failed = True
+            print("{:<60} {:8.1f} ms{}".format("cryptobib.py " + " ".join(command_line), ms, status))
+
+    if args.json is not None:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
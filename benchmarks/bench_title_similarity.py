@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark the title matching of add_doi_crossref.get_matching_doi:
+full levenshtein_distance vs title_similarity.TitleMatcher.
+
+Each title of the database is compared, as in a Crossref response,
+with a slightly modified version of itself and with `--candidates` other titles of the database.
+
+This script needs to be run in the root folder containing the
+folders "lib" and "db"
+"""
+
+import sys
+import os
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(scriptdir, ".."))
+sys.path.append(os.path.join(scriptdir, "..", "..", "lib"))
+sys.path.append(os.path.join(scriptdir, "..", "..", "db"))
+
+import argparse
+import random
+import time
+
+import mybibtex.generator
+import add_doi_crossref
+import db_cache
+import title_similarity
+
+
+def get_titles(nb):
+    db = db_cache.load_db(abbrev_level=3)
+    titles = [
+        entry.fields["title"].expand()
+        for (key, entry) in mybibtex.generator.FilterPaper().filter(db.entries)
+        if "title" in entry.fields
+    ]
+    random.shuffle(titles)
+    return titles[:nb]
+
+
+def crossref_like(title):
+    """ Return a version of `title` similar to what Crossref returns: no braces, one typo """
+    title = title.replace("{", "").replace("}", "")
+    if len(title) > 10:
+        i = random.randrange(len(title))
+        title = title[:i] + title[i + 1:]
+    return title
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark title matching")
+    parser.add_argument("--titles", type=int, default=500, help="number of titles (default: 500)")
+    parser.add_argument("--candidates", type=int, default=19, help="number of other candidates per title (default: 19)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    titles = get_titles(args.titles)
+    pairs = [
+        (title, [crossref_like(title)] + random.sample(titles, min(args.candidates, len(titles))))
+        for title in titles
+    ]
+    nb_pairs = sum(len(candidates) for (title, candidates) in pairs)
+
+    start = time.perf_counter()
+    res_old = [
+        min(add_doi_crossref.levenshtein_distance(candidate, title) for candidate in candidates) <= 4
+        for (title, candidates) in pairs
+    ]
+    time_old = time.perf_counter() - start
+
+    title_similarity.normalize_title.cache_clear()
+    start = time.perf_counter()
+    res_new = [
+        title_similarity.TitleMatcher(title).matches(candidates)
+        for (title, candidates) in pairs
+    ]
+    time_new = time.perf_counter() - start
+
+    print("{} titles, {} title pairs".format(len(pairs), nb_pairs))
+    print("levenshtein_distance: {:8.3f}s".format(time_old))
+    print("TitleMatcher:         {:8.3f}s".format(time_new))
+    print("speedup:              {:8.1f}x".format(time_old / time_new if time_new > 0 else float("inf")))
+    print("matches: {} (levenshtein_distance) vs {} (TitleMatcher)".format(sum(res_old), sum(res_new)))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ folders "lib" and "db"
 """
 
 import collections
+import concurrent.futures
 import sys
 import os
 
@@ -12,24 +13,12 @@ scriptdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(scriptdir, "..", "lib"))
 sys.path.append(os.path.join(scriptdir, "..", "db"))
 
-import mybibtex.parser
-import mybibtex.database
-import mybibtex.generator
-import confs_years
+import db_cache
+import profiling
 
 import argparse
 import logging
 import re
-import shutil
-import time
-
-from pybtex.bibtex.utils import split_name_list
-
-import config
-from config import *
-
-mybibtex.generator.config = config
-logging.basicConfig(level=logging.DEBUG)
 
 color_texts = {
     "Error": "\x1b[6;30;41mError\x1b[0m",
@@ -41,6 +30,70 @@ color_texts = {
 re_author_part_key = re.compile(r"^[a-zA-Z0-9]+:([a-zA-Z]+)[0-9]{2}[a-z]?$")
 
 
+def analyze_partition(papers):
+    """
+    Analyze the papers `papers`, a list of (key, author field expanded)
+
+    Return a dictionary with:
+      "less", "equal", "more": dictionaries key -> authors of the papers with >6 authors and <6, =6, >6 initials in key
+      "nb_papers": number of papers with >6 authors
+      "errors": list of the keys of the papers with >6 authors that cannot be parsed
+    """
+    from pybtex.bibtex.utils import split_name_list
+
+    res = {"less": {}, "equal": {}, "more": {}, "nb_papers": 0, "errors": []}
+
+    for key, author in papers:
+        authors = split_name_list(author)
+        if len(authors) <= 6:
+            continue
+
+        res["nb_papers"] += 1
+
+        # Get the author part of the key (between the ":" and the year)
+        author_part_key_match = re_author_part_key.match(key)
+        if author_part_key_match is None:
+            res["errors"].append(key)
+            continue
+        author_part_key = author_part_key_match.group(1)
+
+        if len(author_part_key) < 6:
+            res["less"][key] = authors
+        elif len(author_part_key) == 6:
+            res["equal"][key] = authors
+        elif len(author_part_key) > 6:
+            res["more"][key] = authors
+
+    return res
+
+
+def get_partitions(db, filter_confs):
+    """
+    Return an ordered dictionary conference -> list of (key, author field expanded) of its papers,
+    in the SortConfYearPage order, restricted to the conferences `filter_confs` (if not empty).
+    The author fields are expanded here, in the main process: Value.expand resolves the macros of the
+    parsed database, which the worker processes of analyze_partition do not have. The workers only
+    split the names and parse the keys.
+    """
+    import mybibtex.generator
+
+    if filter_confs:
+        entries = dict()
+        for filter_conf in filter_confs:
+            entries.update(mybibtex.generator.FilterConf(filter_conf, mybibtex.generator.FilterPaper()).filter(db.entries))
+    else:
+        entries = dict(mybibtex.generator.FilterPaper().filter(db.entries))
+
+    partitions = collections.OrderedDict()
+    for keybib, entry in mybibtex.generator.SortConfYearPage().sort(iter(entries.items())):
+        if "author" not in entry.fields:
+            continue
+        if keybib.confkey not in partitions:
+            partitions[keybib.confkey] = []
+        partitions[keybib.confkey].append((str(keybib), entry.fields["author"].expand()))
+    return partitions
+
+
 def check_more_6_authors(args):
     """
     Analyze papers with more than 6 authors
@@ -48,16 +101,20 @@ def check_more_6_authors(args):
 
     because original rule of cryptobib is to have at most 6 initials in key
     """
-    parser = mybibtex.parser.Parser()
-    parser.parse_file("db/abbrev3.bib")
-    parser.parse_file("db/crypto_db.bib")
-    db = parser.parse_file("db/crypto_conf_list.bib")
+    db = db_cache.load_db(abbrev_level=3)
+
+    with profiling.phase("partition") as p:
+        partitions = get_partitions(db, args.filter)
+        p["entries"] = sum(len(papers) for papers in partitions.values())
 
-    my_filter = mybibtex.generator.FilterPaper()
-    filter_conf = args.filter
-    if filter_conf:
-        my_filter = mybibtex.generator.FilterConf(filter_conf, my_filter)
-    entries = dict(my_filter.filter(db.entries))
+    # the conferences are analyzed separately, in parallel if jobs > 1
+    with profiling.phase("analyze"):
+        if args.jobs > 1 and len(partitions) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+                results = list(executor.map(analyze_partition, partitions.values()))
+        else:
+            results = [analyze_partition(papers) for papers in partitions.values()]
+    results_per_conf = collections.OrderedDict(zip(partitions.keys(), results))
 
     # dictionaries of the keys of the papers with >6 authors: split by number of authors in the key
     keys_more_6_initials = {}
@@ -67,27 +124,14 @@ def check_more_6_authors(args):
     # number of papers with more than 6 authors
     nb_papers = 0
 
-    for keybib, entry in mybibtex.generator.SortConfYearPage().sort(iter(entries.items())):
-        key = str(keybib)
-        authors = split_name_list(entry.fields["author"].expand())
-        if len(authors) <= 6:
-            continue
-
-        nb_papers += 1
+    errors = []
 
-        # Get the author part of the key (between the ":" and the year)
-        author_part_key_match = re_author_part_key.match(key)
-        if author_part_key_match is None:
-            print(f"{color_texts['Error']}: key {key} cannot be parsed")
-            return
-        author_part_key = author_part_key_match.group(1)
-
-        if len(author_part_key) < 6:
-            keys_less_6_initials[key] = authors
-        elif len(author_part_key) == 6:
-            keys_equal_6_initials[key] = authors
-        elif len(author_part_key) > 6:
-            keys_more_6_initials[key] = authors
+    for res in results:
+        keys_less_6_initials.update(res["less"])
+        keys_equal_6_initials.update(res["equal"])
+        keys_more_6_initials.update(res["more"])
+        nb_papers += res["nb_papers"]
+        errors += res["errors"]
 
     if args.verbose:
         print("Papers with >6 authors and <6 initials in key:")
@@ -103,16 +147,41 @@ def check_more_6_authors(args):
             print(f"    {key:20s}: {authors}")
         print()
 
+    if args.per_conf:
+        print("Papers with >6 authors per conference (<6 / =6 / >6 initials in key):")
+        for conf, res in results_per_conf.items():
+            if res["nb_papers"] == 0:
+                continue
+            print(f"    {conf:16s}: {len(res['less']):4d} / {len(res['equal']):4d} / {len(res['more']):4d}"
+                  f" out of {res['nb_papers']:4d}")
+        print()
+
+    for key in errors:
+        print(f"{color_texts['Error']}: key {key} cannot be parsed")
+
     print(f"{len(keys_less_6_initials):4d} / {nb_papers:4d} papers with >6 authors have <6 initials in key")
     print(f"{len(keys_equal_6_initials):4d} / {nb_papers:4d} papers with >6 authors have =6 initials in key")
     print(f"{len(keys_more_6_initials):4d} / {nb_papers:4d} papers with >6 authors have >6 initials in key")
+    if errors:
+        print(f"{len(errors):4d} / {nb_papers:4d} papers with >6 authors have a key that cannot be parsed")
 
 
 def main():
     parser = argparse.ArgumentParser("Analyze papers with >6 authors: count how many use key with >6 initials")
-    parser.add_argument("--filter", help="filter a specific conference")
+    parser.add_argument("--filter", action="append", default=[],
+                        help="filter a specific conference (can be repeated)")
     parser.add_argument("--verbose", action="store_true", help="display all the papers with >6 authors")
+    parser.add_argument("--per-conf", action="store_true", help="display the counts per conference")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of processes analyzing the conferences (default: number of CPUs)")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiling.setup(args, "check_many_authors_keys.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
 
     check_more_6_authors(args)
 
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Sanity checks of the database, run in a single pass.
+
+Each check is a plugin registered with `register`: a subclass of Check implementing
+check_paper (called on each paper) and/or check_book (called on each book with its papers).
+The papers are walked once in the SortConfYearPage order (the one of crossref_index.CrossrefIndex),
+the fields the checks need are expanded once, and the papers are grouped per conference and per book.
+The conferences are checked in parallel when there are many papers.
+
+The results are printed as colored text, or written as JSON or JUnit XML (e.g., for a CI).
+The exit status is 1 if a check reports an error.
+
+This script needs to be run in the root folder containing the
+folders "lib" and "db"
+"""
+
+import sys
+import os
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(scriptdir, "..", "lib"))
+sys.path.append(os.path.join(scriptdir, "..", "db"))
+
+import argparse
+import collections
+import functools
+import json
+import logging
+import re
+import xml.etree.ElementTree as ET
+
+import crossref_index
+import db_cache
+import expand_cache
+import profiling
+from check_many_authors_keys import re_author_part_key
+from expand_cache import expand
+from sanity_checks_doi import check_all_elements_equal
+
+color_texts = {
+    "Error": "\x1b[6;30;41mError\x1b[0m",
+    "Warning": "\x1b[6;30;43mWarning\x1b[0m",
+    "Success": "\x1b[6;30;42mSuccess\x1b[0m",
+}
+
+levels = ["Error", "Warning", "Success"]
+
+#: below this number of papers, the conferences are checked in the main process
+min_papers_parallel = 20000
+
+# level: one of `levels`, check: name of the check, key: key of the paper or book
+Result = collections.namedtuple("Result", ["level", "check", "key", "message"])
+
+# fields: dictionary field -> expanded value (only for the fields needed by the checks)
+# book: key of the book of the paper (None if it has no crossref or a dangling one)
+Paper = collections.namedtuple("Paper", ["key", "fields", "book"])
+Book = collections.namedtuple("Book", ["key", "fields", "papers"])
+Partition = collections.namedtuple("Partition", ["conf", "papers", "books"])
+
+
+#: name of the check -> class of the check
+registry = collections.OrderedDict()
+
+
+def register(cls):
+    """ Class decorator registering the check `cls` """
+    registry[cls.name] = cls
+    return cls
+
+
+class Check(object):
+    """
+    Base class of the checks:
+      name         name of the check (used in --check and in the results)
+      description  one-line description
+      paper_fields fields of the papers used by the check
+      book_fields  fields of the books used by the check
+    check_paper and check_book return (or yield) Result
+    """
+    name = None
+    description = None
+    paper_fields = []
+    book_fields = []
+
+    def result(self, level, key, message):
+        return Result(level, self.name, key, message)
+
+    def check_paper(self, paper):
+        return []
+
+    def check_book(self, book):
+        return []
+
+
+@register
+class DanglingCrossrefCheck(Check):
+    name = "crossref"
+    description = "the crossref of each paper is an entry of the database"
+    paper_fields = ["crossref"]
+
+    def check_paper(self, paper):
+        if "crossref" in paper.fields and paper.book is None:
+            yield self.result("Error", paper.key, "dangling crossref {}".format(paper.fields["crossref"]))
+
+
+@register
+class SpringerDoiPrefixCheck(Check):
+    name = "springer-doi-prefix"
+    description = "the DOI of the papers of a Springer (LNCS) book have the same prefix"
+    paper_fields = ["doi"]
+    book_fields = ["series"]
+
+    #: DOI with a prefix different from the other papers of its book
+    exceptions = ["10.1007/10931455_18"]  # CHES:CheJoyPai03
+
+    def check_book(self, book):
+        if book.fields.get("series") != "{LNCS}":
+            return
+        doi_prefix = [
+            "_".join(paper.fields["doi"].split("_")[:-1])
+            for paper in book.papers
+            if "doi" in paper.fields and paper.fields["doi"] not in self.exceptions
+        ]
+        if not doi_prefix:
+            return
+        if check_all_elements_equal(doi_prefix):
+            yield self.result("Success", book.key, "prefix {} for {} papers with DOI".format(doi_prefix[0], len(doi_prefix)))
+        else:
+            yield self.result("Error", book.key, "prefixes {} for {} papers with DOI".format(
+                " ".join(sorted(set(doi_prefix))), len(doi_prefix)))
+
+
+@register
+class DoiCoverageCheck(Check):
+    name = "doi-coverage"
+    description = "all the papers of a book have a DOI"
+    paper_fields = ["doi"]
+
+    def check_book(self, book):
+        nb_doi = len([paper for paper in book.papers if "doi" in paper.fields])
+        if nb_doi != len(book.papers):
+            yield self.result("Warning", book.key, "only {} papers with DOI out of {}".format(nb_doi, len(book.papers)))
+        else:
+            yield self.result("Success", book.key, "all {} papers with DOI".format(nb_doi))
+
+
+@register
+class ManyAuthorsKeyCheck(Check):
+    name = "many-authors-key"
+    description = "the key of a paper with more than 6 authors has at most 6 initials"
+    paper_fields = ["author"]
+
+    def check_paper(self, paper):
+        from pybtex.bibtex.utils import split_name_list
+
+        if "author" not in paper.fields:
+            return
+        nb_authors = len(split_name_list(paper.fields["author"]))
+        if nb_authors <= 6:
+            return
+        m = re_author_part_key.match(paper.key)
+        if m is None:
+            yield self.result("Error", paper.key, "key of a paper with {} authors cannot be parsed".format(nb_authors))
+        elif len(m.group(1)) > 6:
+            yield self.result("Warning", paper.key, "{} initials in the key for {} authors".format(len(m.group(1)), nb_authors))
+        else:
+            yield self.result("Success", paper.key, "{} initials in the key for {} authors".format(len(m.group(1)), nb_authors))
+
+
+@register
+class PagesFormatCheck(Check):
+    name = "pages"
+    description = "the pages are \"first--last\" (or a single page) with first <= last"
+    paper_fields = ["pages"]
+
+    re_pages = re.compile(r"^([0-9]+)(?:--([0-9]+))?$")
+    re_single_dash = re.compile(r"^[0-9]+\s*(-|–)\s*[0-9]+$")
+
+    def check_paper(self, paper):
+        if "pages" not in paper.fields:
+            return
+        pages = paper.fields["pages"]
+        m = self.re_pages.match(pages)
+        if m is None:
+            if self.re_single_dash.match(pages):
+                yield self.result("Error", paper.key, "pages {} should be separated by --".format(pages))
+            else:
+                yield self.result("Warning", paper.key, "pages {} are not in the format first--last".format(pages))
+        elif m.group(2) is not None and int(m.group(1)) > int(m.group(2)):
+            yield self.result("Error", paper.key, "pages {}: first page after last page".format(pages))
+
+
+def get_fields(entry, fields, cache=None):
+    """ Return the dictionary field -> expanded value of the `fields` of `entry` """
+    return {field: expand(entry, field, cache) for field in fields if field in entry.fields}
+
+
+def get_partitions(db, keys, check_classes, cache=None):
+    """
+    Return an ordered dictionary conference -> Partition of the papers `keys` of `db`,
+    in the SortConfYearPage order, with the fields needed by `check_classes` expanded
+    """
+    paper_fields = sorted(set(field for cls in check_classes for field in cls.paper_fields))
+    book_fields = sorted(set(field for cls in check_classes for field in cls.book_fields))
+
+    index = crossref_index.CrossrefIndex(db, cache)
+    partitions = collections.OrderedDict()
+    for key in index.papers:
+        if key not in keys:
+            continue
+        book_key = index.book_of.get(key)
+        paper = Paper(str(key), get_fields(db.entries[key], paper_fields, cache), str(book_key) if book_key is not None else None)
+
+        if key.confkey not in partitions:
+            partitions[key.confkey] = Partition(key.confkey, [], collections.OrderedDict())
+        partition = partitions[key.confkey]
+        partition.papers.append(paper)
+        if book_key is not None:
+            if paper.book not in partition.books:
+                partition.books[paper.book] = Book(paper.book, get_fields(db.entries[book_key], book_fields, cache), [])
+            partition.books[paper.book].papers.append(paper)
+    return partitions
+
+
+def check_partition(check_names, partition):
+    """ Run the checks `check_names` on `partition` and return the list of Result """
+    checks = [registry[name]() for name in check_names]
+    results = []
+    for paper in partition.papers:
+        for check in checks:
+            results.extend(check.check_paper(paper))
+    for book in partition.books.values():
+        for check in checks:
+            results.extend(check.check_book(book))
+    return results
+
+
+def run_checks(partitions, check_names, jobs=1):
+    """ Run the checks `check_names` on `partitions`, in parallel if jobs > 1 and there are many papers """
+    nb_papers = sum(len(partition.papers) for partition in partitions.values())
+    run = functools.partial(check_partition, check_names)
+    if jobs > 1 and len(partitions) > 1 and nb_papers >= min_papers_parallel:
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            results_per_conf = list(executor.map(run, partitions.values()))
+    else:
+        results_per_conf = [run(partition) for partition in partitions.values()]
+    return [result for results in results_per_conf for result in results]
+
+
+def get_counts(results, check_names):
+    """ Return an ordered dictionary check name -> level -> number of results """
+    counts = collections.OrderedDict((name, collections.OrderedDict((level, 0) for level in levels)) for name in check_names)
+    for result in results:
+        counts[result.check][result.level] += 1
+    return counts
+
+
+def write_text(out, results, check_names, verbose=False):
+    for result in results:
+        if result.level == "Success" and not verbose:
+            continue
+        out.write("{}: [{}] {}: {}\n".format(color_texts[result.level], result.check, result.key, result.message))
+    out.write("\n")
+    for (name, counts) in get_counts(results, check_names).items():
+        out.write("{:<20} {:5d} errors {:5d} warnings {:5d} successes\n".format(name, counts["Error"], counts["Warning"], counts["Success"]))
+
+
+def write_json(out, results, check_names, verbose=False):
+    data = {
+        "counts": get_counts(results, check_names),
+        "results": [result._asdict() for result in results if verbose or result.level != "Success"],
+    }
+    json.dump(data, out, indent=1)
+    out.write("\n")
+
+
+def write_junit(out, results, check_names, verbose=False):
+    """ One test suite per check and one test case per result: errors are failures, warnings are in system-out """
+    testsuites = ET.Element("testsuites", name="cryptobib")
+    results_per_check = collections.OrderedDict((name, []) for name in check_names)
+    for result in results:
+        results_per_check[result.check].append(result)
+    for (name, check_results) in results_per_check.items():
+        testsuite = ET.SubElement(testsuites, "testsuite", name=name, tests=str(len(check_results)),
+                                  failures=str(len([r for r in check_results if r.level == "Error"])))
+        for result in check_results:
+            testcase = ET.SubElement(testsuite, "testcase", classname="cryptobib.{}".format(name), name=result.key)
+            if result.level == "Error":
+                ET.SubElement(testcase, "failure", message=result.message, type=result.level)
+            elif result.level == "Warning":
+                ET.SubElement(testcase, "system-out").text = "Warning: {}".format(result.message)
+    out.write(ET.tostring(testsuites, encoding="unicode"))
+    out.write("\n")
+
+
+writers = collections.OrderedDict([
+    ("text", write_text),
+    ("json", write_json),
+    ("junit", write_junit),
+])
+
+
+def main():
+    parser = argparse.ArgumentParser("Run the sanity checks of the database in a single pass")
+    parser.add_argument("--filter", action="append", default=[], help="filter a specific conference (can be repeated)")
+    parser.add_argument("--check", action="append", choices=list(registry.keys()),
+                        help="run only this check (can be repeated, default: all)")
+    parser.add_argument("--list", action="store_true", help="list the checks and exit")
+    parser.add_argument("--format", choices=list(writers.keys()), default="text", help="output format (default: text)")
+    parser.add_argument("--output", metavar="file", help="write the results in this file instead of the standard output")
+    parser.add_argument("--verbose", action="store_true", help="report also successful checks (always in JUnit)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of processes checking the conferences (default: number of CPUs)")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "checks.py")
+    logging.basicConfig(level=logging.DEBUG)
+
+    if args.list:
+        for (name, cls) in registry.items():
+            print("{:<20} {}".format(name, cls.description))
+        return
+
+    check_names = args.check if args.check else list(registry.keys())
+
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
+    db = db_cache.load_db(abbrev_level=3)
+
+    if args.filter:
+        keys = set()
+        for filter_conf in args.filter:
+            keys.update(key for (key, entry) in mybibtex.generator.FilterConf(filter_conf, mybibtex.generator.FilterPaper()).filter(db.entries))
+    else:
+        keys = set(key for (key, entry) in mybibtex.generator.FilterPaper().filter(db.entries))
+
+    cache = expand_cache.ExpandCache()
+    with profiling.phase("partition") as p:
+        partitions = get_partitions(db, keys, [registry[name] for name in check_names], cache)
+        p["entries"] = sum(len(partition.papers) for partition in partitions.values())
+    logging.info("expand cache: {}".format(cache.get_stats()))
+
+    with profiling.phase("check") as p:
+        results = run_checks(partitions, check_names, args.jobs)
+        p["entries"] = len(results)
+
+    writer = writers[args.format]
+    verbose = args.verbose or args.format == "junit"
+    if args.output is not None:
+        with open(args.output, "w") as out:
+            writer(out, results, check_names, verbose)
+    else:
+        writer(sys.stdout, results, check_names, verbose)
+
+    sys.exit(1 if any(result.level == "Error" for result in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
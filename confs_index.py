@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Persisted index of the conferences of the database:
+  counts       confkey -> year -> number of papers
+  confs_years  confkey -> (start year, end year), as returned by confs_years.get_confs_years_inter
+
+The index is stored in .cache/confs_index.json together with a fingerprint of the files it was computed from
+(db/crypto_db.bib, db/crypto_conf_list.bib and the configuration). When the fingerprint matches, the
+header of crypto_db.bib, of crypto.bib and the conf table of the web server are obtained without scanning
+the database. The scripts modifying crypto_db.bib update the index incrementally (`add`, `remove`) and
+write crypto_db.bib with `write_crypto_db`, which also saves the index with the new fingerprint.
+
+Usage (in the root folder containing the folders "lib" and "db"):
+  confs_index.py           print the index (rebuilt if stale)
+  confs_index.py --verify  check the index against a full recompute
+"""
+
+import sys
+import os
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(scriptdir, "..", "lib"))
+sys.path.append(os.path.join(scriptdir, "..", "db"))
+
+import argparse
+import collections
+import logging
+
+import db_cache
+import profiling
+
+#: file storing the index
+index_filename = os.path.join(db_cache.cache_dir, "confs_index.json")
+
+#: bump this when the format or the content of the index changes
+INDEX_VERSION = 1
+
+#: files the index depends on, relatively to the db folder
+db_filenames = ["crypto_db.bib", "crypto_conf_list.bib"]
+
+
+def get_fingerprint(db_dir="db"):
+    """ Return the fingerprint of the files the index depends on """
+    import hashlib
+    import config
+
+    h = hashlib.sha256("v{}".format(INDEX_VERSION).encode())
+    for filename in [os.path.join(db_dir, f) for f in db_filenames] + [config.__file__]:
+        with open(filename, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def get_year(key):
+    from mybibtex import tools
+    return int(tools.short_to_full_year(key.year))
+
+
+def get_new_conf_years(key, entry):
+    """
+    Return the (start year, end year) of a conference whose only paper is `key` (with entry `entry`),
+    computed as by a full build (config.confs_missing_years included), or None if it has no range
+    """
+    import config
+    import confs_years
+    from mybibtex.database import BibliographyData
+
+    db = BibliographyData()
+    db.add_entry(key, entry)
+    years = confs_years.get_confs_years_inter(db, config.confs_missing_years)
+    return tuple(years[key.confkey]) if key.confkey in years else None
+
+
+class ConfsIndex(object):
+    def __init__(self, counts, confs_years, fingerprint=None, sorted_db=False):
+        self.counts = counts
+        self.confs_years = confs_years
+        self.fingerprint = fingerprint
+        # True if crypto_db.bib was written by write_crypto_db: its papers are in the SortConfYearPage order
+        self.sorted_db = sorted_db
+        # set when a removal may have shrunk a year range: confs_years has to be recomputed
+        self.stale_years = False
+
+    @classmethod
+    def build(cls, db):
+        """ Build the index of `db` with a full scan """
+        import config
+        import confs_years
+        import mybibtex.generator
+
+        counts = collections.defaultdict(collections.Counter)
+        for (key, entry) in mybibtex.generator.FilterPaper().filter(db.entries):
+            counts[key.confkey][get_year(key)] += 1
+        years = confs_years.get_confs_years_inter(db, config.confs_missing_years)
+        return cls(counts, {conf: tuple(r) for (conf, r) in years.items()})
+
+    @classmethod
+    def read(cls, filename=index_filename):
+        """ Return the stored index, or None if there is none or it is corrupt """
+        import json
+
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+            if data["version"] != INDEX_VERSION:
+                return None
+            counts = collections.defaultdict(collections.Counter)
+            for (conf, years) in data["counts"].items():
+                counts[conf] = collections.Counter({int(year): nb for (year, nb) in years.items()})
+            return cls(counts, {conf: tuple(r) for (conf, r) in data["confs_years"].items()}, data["fingerprint"],
+                       data.get("sorted_db", False))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning("confs_index: corrupt index {} ({}), ignoring it".format(filename, e))
+            return None
+
+    def save(self, db_dir="db", filename=index_filename):
+        """ Save the index, for the current content of the files it depends on """
+        import json
+
+        self.fingerprint = get_fingerprint(db_dir)
+        data = {
+            "version": INDEX_VERSION,
+            "fingerprint": self.fingerprint,
+            "sorted_db": self.sorted_db,
+            "counts": {conf: {str(year): nb for (year, nb) in sorted(years.items())} for (conf, years) in sorted(self.counts.items())},
+            "confs_years": {conf: list(r) for (conf, r) in sorted(self.confs_years.items())},
+        }
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_filename, filename)
+
+    def add(self, key, entry):
+        """ Record the new paper `key` (with entry `entry`) """
+        year = get_year(key)
+        self.counts[key.confkey][year] += 1
+        if key.confkey in self.confs_years:
+            (start, end) = self.confs_years[key.confkey]
+            self.confs_years[key.confkey] = (min(int(start), year), max(int(end), year))
+        else:
+            # first paper of a conference: its range only depends on this paper and config.confs_missing_years
+            years = get_new_conf_years(key, entry)
+            if years is not None:
+                self.confs_years[key.confkey] = years
+
+    def remove(self, key):
+        """ Record the removal (or the renaming) of the paper `key` """
+        year = get_year(key)
+        years = self.counts[key.confkey]
+        years[year] -= 1
+        if years[year] <= 0:
+            del years[year]
+            if key.confkey in self.confs_years and year in [int(y) for y in self.confs_years[key.confkey]]:
+                self.stale_years = True
+
+    def get_confs_years(self, db=None):
+        """ Return confkey -> (start year, end year); `db` is only used if a removal made the ranges stale """
+        if self.stale_years:
+            if db is None:
+                raise ValueError("confs_index: the year ranges are stale and no database was given")
+            import config
+            import confs_years
+            years = confs_years.get_confs_years_inter(db, config.confs_missing_years)
+            self.confs_years = {conf: tuple(r) for (conf, r) in years.items()}
+            self.stale_years = False
+        return self.confs_years
+
+    def get_counts(self):
+        """ Return confkey -> number of papers """
+        return {conf: sum(years.values()) for (conf, years) in self.counts.items()}
+
+    def verify(self, db):
+        """ Return the list of differences between the index and a full recompute on `db` """
+        full = ConfsIndex.build(db)
+        errors = []
+        mine = {conf: tuple(int(y) for y in r) for (conf, r) in self.get_confs_years(db).items()}
+        theirs = {conf: tuple(int(y) for y in r) for (conf, r) in full.confs_years.items()}
+        for conf in sorted(set(mine) | set(theirs)):
+            if mine.get(conf) != theirs.get(conf):
+                errors.append("{}: years {} in the index, {} recomputed".format(
+                    conf, self.confs_years.get(conf), full.confs_years.get(conf)))
+        for conf in sorted(set(self.counts) | set(full.counts)):
+            mine = dict(self.counts.get(conf, {}))
+            theirs = dict(full.counts.get(conf, {}))
+            if mine != theirs:
+                errors.append("{}: counts {} in the index, {} recomputed".format(conf, sorted(mine.items()), sorted(theirs.items())))
+        return errors
+
+
+def get_index(db, db_dir="db"):
+    """
+    Return the index for the current files of `db_dir`, read from the disk if up to date,
+    built from `db` (which must correspond to these files) and saved otherwise
+    """
+    with profiling.phase("confs_index") as p:
+        index = ConfsIndex.read()
+        if index is not None and index.fingerprint == get_fingerprint(db_dir):
+            p["cached"] = True
+            return index
+        logging.info("confs_index: index missing or stale, rebuilding it")
+        index = ConfsIndex.build(db)
+        index.save(db_dir)
+        p["cached"] = False
+        return index
+
+
+def write_crypto_db(db, index, filename="db/crypto_db.bib", entries=None):
+    """
+    Write the papers of `db` in `filename` with the header of the years of `index`, and save `index`.
+    If `entries` is given, it is the list of (key, entry) of the papers of `db` already in the SortConfYearPage order,
+    written as is instead of being sorted again by bibtex_gen.
+    """
+    import mybibtex.generator
+
+    conf_years = index.get_confs_years(db)
+
+    with profiling.phase("write"), open(filename, "w") as out:
+        out.write("% FILE GENERATED by add.py\n")
+        out.write("% DO NOT MODIFY MANUALLY\n")
+        out.write("\n")
+        out.write("\n")
+        for conf in sorted(conf_years.keys()):
+            (start, end) = conf_years[conf]
+            out.write("%    {}:{}{} - {}\n".format(conf, " " * (16 - len(conf) - 1), start, end))
+        out.write("\n")
+        out.write("\n")
+
+        if entries is None:
+            mybibtex.generator.bibtex_gen(out, db)
+        else:
+            for (key, entry) in entries:
+                out.write(mybibtex.generator.bibtex_entry_format(db, key, entry))
+
+    index.sorted_db = True
+    index.save()
+
+
+def main():
+    parser = argparse.ArgumentParser("Print or verify the index of the years and number of papers of each conference")
+    parser.add_argument("--verify", action="store_true", help="check the stored index against a full recompute")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "confs_index.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
+
+    db = db_cache.load_db(abbrev_level=0)
+
+    if args.verify:
+        index = ConfsIndex.read()
+        if index is None:
+            logging.error("Error: no index")
+            sys.exit(1)
+        if index.fingerprint != get_fingerprint():
+            print("index is stale: the database changed since it was saved")
+            sys.exit(1)
+        with profiling.phase("verify"):
+            errors = index.verify(db)
+        for error in errors:
+            print(error)
+        print("{} differences".format(len(errors)))
+        sys.exit(1 if errors else 0)
+
+    index = get_index(db)
+    counts = index.get_counts()
+    for (conf, (start, end)) in sorted(index.get_confs_years(db).items()):
+        print("{:<16} {} - {} {:6d} papers".format(conf, start, end, counts.get(conf, 0)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+On-disk cache of the Crossref API responses used by add_doi_crossref.py.
+
+Responses are stored as raw JSON in a SQLite file, keyed by the normalized query URL.
+Entries expire after a TTL. Negative results (queries for which no matching DOI was found)
+have their own, shorter, TTL so that they are retried more often.
+The cache size is capped and the least recently used responses are evicted first.
+The access times of the hits are kept in memory and written in batches (at the latest when a response is stored
+or the cache is closed), and the total size is maintained incrementally, so that a hit costs a single SELECT.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+
+#: default cache file
+default_cache_filename = os.path.join(scriptdir, ".cache", "crossref.sqlite")
+
+
+def normalize_url(url):
+    """ Normalize a query URL: sorted query parameters, normalized whitespace in values """
+    parts = urllib.parse.urlsplit(url)
+    query = sorted(
+        (k, " ".join(v.split()))
+        for (k, v) in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    )
+    return urllib.parse.urlunsplit((
+        parts.scheme.lower(), parts.netloc.lower(), parts.path, urllib.parse.urlencode(query), ""
+    ))
+
+
+class CrossrefCache(object):
+    """
+    Thread-safe cache of raw JSON responses.
+
+    `ttl` and `negative_ttl` are in seconds, `max_size` is the maximum total size of the stored responses in bytes.
+    If `refresh` is True, cached responses are never returned but new responses are stored.
+    The access times of at most `batch_size` hits are pending before being written.
+    """
+
+    def __init__(self, filename=default_cache_filename, ttl=30 * 24 * 3600, negative_ttl=7 * 24 * 3600,
+                 max_size=512 * 1024 * 1024, refresh=False, batch_size=1000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.refresh = refresh
+        self.batch_size = batch_size
+
+        #: normalized URL -> last access time not written yet
+        self.accessed = {}
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS response (
+                url TEXT PRIMARY KEY,
+                body TEXT NOT NULL,
+                negative INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS response_accessed ON response (accessed)")
+        self.conn.commit()
+        (self.total_size,) = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM response").fetchone()
+
+    def get(self, url):
+        """ Return the cached raw JSON response for `url`, or None if missing or expired """
+        key = normalize_url(url)
+        now = time.time()
+        with self.lock:
+            if self.refresh:
+                self.misses += 1
+                return None
+            row = self.conn.execute("SELECT body, negative, created, size FROM response WHERE url = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            (body, negative, created, size) = row
+            ttl = self.negative_ttl if negative else self.ttl
+            if now - created > ttl:
+                self.conn.execute("DELETE FROM response WHERE url = ?", (key,))
+                self.accessed.pop(key, None)
+                self.total_size -= size
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.accessed[key] = now
+            if len(self.accessed) >= self.batch_size:
+                self.flush()
+            self.hits += 1
+            if negative:
+                self.negative_hits += 1
+            return body
+
+    def put(self, url, body):
+        """ Store the raw JSON response `body` for `url` """
+        key = normalize_url(url)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM response WHERE url = ?", (key,)).fetchone()
+            if row is not None:
+                self.total_size -= row[0]
+            self.accessed.pop(key, None)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response (url, body, negative, created, accessed, size) VALUES (?, ?, 0, ?, ?, ?)",
+                (key, body, now, now, len(body))
+            )
+            self.total_size += len(body)
+            # the eviction order depends on the pending access times
+            self.write_accessed()
+            self.evict()
+            self.conn.commit()
+
+    def set_negative(self, url, negative=True):
+        """ Mark the response for `url` as a negative result (no matching DOI) """
+        with self.lock:
+            self.conn.execute("UPDATE response SET negative = ? WHERE url = ?", (int(negative), normalize_url(url)))
+            self.conn.commit()
+
+    def write_accessed(self):
+        """ Write the pending access times, without committing """
+        if self.accessed:
+            self.conn.executemany("UPDATE response SET accessed = ? WHERE url = ?",
+                                  [(t, url) for (url, t) in self.accessed.items()])
+            self.accessed = {}
+
+    def flush(self):
+        """ Write the pending access times and commit, in a single transaction """
+        self.write_accessed()
+        self.conn.commit()
+
+    def evict(self):
+        """ Evict the least recently used responses until the total size is at most max_size """
+        if self.total_size <= self.max_size:
+            return
+        for (url, size) in self.conn.execute("SELECT url, size FROM response ORDER BY accessed").fetchall():
+            if self.total_size <= self.max_size:
+                break
+            self.conn.execute("DELETE FROM response WHERE url = ?", (url,))
+            self.total_size -= size
+            self.evicted += 1
+
+    def get_stats(self):
+        """ Return a string describing the cache statistics """
+        with self.lock:
+            (nb,) = self.conn.execute("SELECT COUNT(*) FROM response").fetchone()
+            size = self.total_size
+        lookups = self.hits + self.misses
+        return "{} hits ({} negative) / {} lookups ({:.1f}%), {} expired, {} evicted, {} responses ({:.1f} MiB) stored".format(
+            self.hits, self.negative_hits, lookups, 100.0 * self.hits / lookups if lookups else 0.0,
+            self.expired, self.evicted, nb, size / 1024 / 1024
+        )
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.conn.close()
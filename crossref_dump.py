@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Add the missing DOI from a local dump of the Crossref metadata, without any request to the Crossref API.
+
+The dump is a JSONL file (optionally gzipped) with one Crossref work per line,
+as in the Crossref metadata snapshots (a line {"items": [...]} or an API response {"message": {"items": [...]}}
+is also accepted, so that a filtered subset can be saved with any tool).
+
+The papers without DOI are indexed by the last name of their first author and by the words of their title.
+The dump is then streamed once: the candidate papers of each work are looked up in the index,
+and matched with the same rules as add_doi_crossref.get_matching_doi (same number of authors and close titles),
+the authors of the papers being read by the functions of add_doi_crossref.
+When several works match a paper, the one whose container title is the closest to the booktitle/journal
+of the paper is chosen; if there is still a tie, the paper is reported as ambiguous and left unchanged.
+
+This script needs to be run in the root folder containing the
+folders "lib" and "db"
+"""
+
+import sys
+import os
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(scriptdir, "..", "lib"))
+sys.path.append(os.path.join(scriptdir, "..", "db"))
+
+import argparse
+import collections
+import gzip
+import json
+import logging
+
+import confs_index
+import db_cache
+import expand_cache
+import profiling
+from add_doi_crossref import get_first_author, get_number_authors, item_matches
+from expand_cache import expand
+from find_duplicates import get_last_name
+from title_similarity import TitleMatcher, normalize_title, title_words
+
+color_texts = {
+    "Error": "\x1b[6;30;41mError\x1b[0m",
+    "Warning": "\x1b[6;30;43mWarning\x1b[0m",
+    "Success": "\x1b[6;30;42mSuccess\x1b[0m",
+}
+
+#: number of the rarest title words of a work used to find candidate papers when its first author is not indexed
+nb_lookup_words = 2
+
+
+def get_first_author_last_name(entry, fields_cache=None):
+    """ Return the normalized last name (with its "von" part) of the first author of `entry` ("" if none) """
+    return get_last_name(get_first_author(entry, fields_cache))
+
+
+def get_container(entry, fields_cache=None):
+    """ Return the words of the booktitle or journal of `entry` """
+    for field in ["booktitle", "journal"]:
+        if field in entry.fields:
+            return title_words(expand(entry, field, fields_cache))
+    return frozenset()
+
+
+class PaperIndex(object):
+    """
+    Inverted index of the papers to match:
+      by_author  normalized last name of the first author -> list of paper numbers
+      by_word    word of the title -> list of paper numbers
+    For each paper, `papers` stores (key, entry, TitleMatcher, number of authors, words of the container title).
+    """
+
+    def __init__(self, entries, fields_cache=None):
+        self.papers = []
+        self.by_author = collections.defaultdict(list)
+        self.by_word = collections.defaultdict(list)
+        for (key, entry) in entries:
+            if "title" not in entry.fields:
+                continue
+            title = expand(entry, "title", fields_cache)
+            i = len(self.papers)
+            self.papers.append((
+                key, entry, TitleMatcher(title), get_number_authors(entry, fields_cache), get_container(entry, fields_cache)
+            ))
+            self.by_author[get_first_author_last_name(entry, fields_cache)].append(i)
+            for word in title_words(title):
+                self.by_word[word].append(i)
+
+    def get_candidates(self, item):
+        """ Return the numbers of the papers that may match the Crossref work `item` """
+        authors = item.get("author", [])
+        if authors:
+            family = normalize_title(authors[0].get("family", ""))
+            if family in self.by_author:
+                return self.by_author[family]
+        # the first author is written differently (or missing): look up the rarest words of the title
+        words = set()
+        for title in item.get("title", []):
+            words |= title_words(title)
+        postings = sorted((self.by_word[word] for word in words if word in self.by_word), key=len)
+        candidates = set()
+        for posting in postings[:nb_lookup_words]:
+            candidates.update(posting)
+        return candidates
+
+
+def read_items(filename):
+    """ Yield the Crossref works of the JSONL dump `filename` (gzipped if it ends with .gz) """
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt", encoding="utf-8") as f:
+        for (lineno, line) in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                j = json.loads(line)
+            except ValueError as e:
+                logging.warning("{}:{}: invalid JSON ({}), skipped".format(filename, lineno, e))
+                continue
+            if "message" in j:
+                j = j["message"]
+            if "items" in j:
+                yield from j["items"]
+            else:
+                yield j
+
+
+def container_similarity(container, item):
+    words = set()
+    for title in item.get("container-title", []):
+        words |= title_words(title)
+    if not container or not words:
+        return 0.0
+    return len(container & words) / len(container | words)
+
+
+def match_dump(index, filenames, doi_prefixes=None):
+    """
+    Stream the dumps `filenames` and return (matches, nb_items) where matches is a dictionary
+    paper number -> list of (DOI, container similarity) of the works matching the paper
+    (the DOI are written as in the dump)
+    """
+    matches = collections.defaultdict(list)
+    nb_items = 0
+    for filename in filenames:
+        for item in read_items(filename):
+            nb_items += 1
+            doi = item.get("DOI")
+            if doi is None or "title" not in item:
+                continue
+            if doi_prefixes and not any(doi.startswith(prefix) for prefix in doi_prefixes):
+                continue
+            for i in index.get_candidates(item):
+                (key, entry, matcher, nb_authors, container) = index.papers[i]
+                if item_matches(matcher, nb_authors, item):
+                    matches[i].append((doi, container_similarity(container, item)))
+    return (matches, nb_items)
+
+
+def choose_doi(candidates):
+    """
+    Return the DOI of the best of `candidates` (list of (DOI, container similarity)), or None if ambiguous.
+    DOI are case-insensitive: the same DOI written with different cases counts once, as first written.
+    """
+    best = {}
+    for (doi, similarity) in candidates:
+        (first_doi, best_similarity) = best.get(doi.lower(), (doi, 0.0))
+        best[doi.lower()] = (first_doi, max(best_similarity, similarity))
+    ranked = sorted(best.values(), key=lambda d_s: -d_s[1])
+    if len(ranked) > 1 and ranked[0][1] == ranked[1][1]:
+        return None
+    return ranked[0][0]
+
+
+def main():
+    parser = argparse.ArgumentParser("Add the missing DOI from a local JSONL dump of the Crossref metadata")
+    parser.add_argument("dumps", metavar="dump.jsonl[.gz]", nargs="+", help="Crossref dump files")
+    parser.add_argument("--filter", help="only add DOI to a specific conference")
+    parser.add_argument("--doi-prefix", action="append", help="only consider the works with this DOI prefix (e.g., 10.1007/)")
+    parser.add_argument("--dry-run", action="store_true", help="report the DOI found without writing crypto_db.bib")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "crossref_dump.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.database
+    import mybibtex.generator
+    mybibtex.generator.config = config
+
+    db = db_cache.load_db(abbrev_level=0)
+    fields_cache = expand_cache.ExpandCache()
+
+    myfilter = mybibtex.generator.FilterPaper()
+    if args.filter:
+        myfilter = mybibtex.generator.FilterConf(args.filter, myfilter)
+
+    with profiling.phase("index") as p:
+        entries = [
+            (key, entry) for (key, entry) in myfilter.filter(db.entries)
+            if "doi" not in entry.fields and not str(key).startswith("EPRINT")
+        ]
+        index = PaperIndex(mybibtex.generator.SortConfYearPage().sort(iter(entries)), fields_cache)
+        p["entries"] = len(index.papers)
+
+    with profiling.phase("match") as p:
+        (matches, nb_items) = match_dump(index, args.dumps, args.doi_prefix)
+        p["entries"] = nb_items
+    logging.info("expand cache: {}".format(fields_cache.get_stats()))
+
+    nb_found = 0
+    nb_ambiguous = 0
+    for (i, (key, entry, matcher, nb_authors, container)) in enumerate(index.papers):
+        if i not in matches:
+            continue
+        doi = choose_doi(matches[i])
+        if doi is None:
+            nb_ambiguous += 1
+            print("{}: {} matches several DOI: {}".format(
+                color_texts["Warning"], key, ", ".join(sorted({d.lower(): d for (d, s) in matches[i]}.values()))))
+            continue
+        nb_found += 1
+        print("{}: {} -> {}".format(color_texts["Success"], key, doi))
+        entry.fields["doi"] = mybibtex.database.Value([mybibtex.database.ValuePartQuote(doi)])
+
+    print("")
+    print("{} works read, {} papers without DOI, {} DOI found, {} ambiguous".format(
+        nb_items, len(index.papers), nb_found, nb_ambiguous))
+
+    if args.dry_run or nb_found == 0:
+        return
+
+    import backup_store
+
+    with profiling.phase("backup"):
+        backup_store.backup("db/crypto_db.bib")
+    # only DOI fields are modified: the index does not change
+    confs_index.write_crypto_db(db, confs_index.get_index(db))
+
+
+if __name__ == "__main__":
+    main()
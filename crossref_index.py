@@ -0,0 +1,74 @@
+"""
+Index of the crossref links of a loaded database.
+
+The crossref field of each paper is resolved once to the key of its proceedings entry (book),
+so that per-book processing and crossref expansion become direct lookups.
+"""
+
+import collections
+
+from expand_cache import expand
+
+
+class CrossrefIndex(object):
+    """
+    Crossref links of the papers of a database:
+      papers    list of the keys of all the papers, in the SortConfYearPage order
+      book_of   paper key -> key of the book of the paper
+      papers_of book key -> list of the keys of its papers, in the SortConfYearPage order
+      dangling  list of (paper key, crossref) for crossrefs that do not correspond to any entry
+    `cache` is an optional ExpandCache used to expand the crossref fields.
+    `papers` is the list of (key, entry) of the papers of `db` already in the SortConfYearPage order,
+    if the caller sorted them; otherwise the papers are filtered and sorted here.
+    """
+
+    def __init__(self, db, cache=None, papers=None):
+        import mybibtex.generator
+        from mybibtex.database import EntryKey
+
+        self.db = db
+        self.papers = []
+        self.book_of = dict()
+        self.papers_of = collections.OrderedDict()
+        self.dangling = []
+
+        if papers is None:
+            papers = mybibtex.generator.SortConfYearPage().sort(iter(mybibtex.generator.FilterPaper().filter(db.entries)))
+        for (key, entry) in papers:
+            self.papers.append(key)
+            if "crossref" not in entry.fields:
+                continue
+            crossref = expand(entry, "crossref", cache)
+            book = EntryKey.from_string(crossref)
+            if book not in db.entries:
+                self.dangling.append((key, crossref))
+                continue
+            self.book_of[key] = book
+            if book not in self.papers_of:
+                self.papers_of[book] = [key]
+            else:
+                self.papers_of[book].append(key)
+
+    def get_book(self, key):
+        """ Return the book entry of the paper `key`, or None if it has no (valid) crossref """
+        book = self.book_of.get(key)
+        if book is None:
+            return None
+        return self.db.entries[book]
+
+    def get_papers(self, book):
+        """ Return the list of (key, entry) of the papers of the book `book`, in the SortConfYearPage order """
+        return [(key, self.db.entries[key]) for key in self.papers_of.get(book, [])]
+
+    def get_books(self, keys=None):
+        """
+        Return the list of (key, entry) of the books referenced by the papers `keys` (all the papers if None),
+        in the SortConfYearPage order
+        """
+        import mybibtex.generator
+
+        if keys is None:
+            books = self.papers_of.keys()
+        else:
+            books = collections.OrderedDict((self.book_of[key], None) for key in keys if key in self.book_of)
+        return list(mybibtex.generator.SortConfYearPage().sort(iter((book, self.db.entries[book]) for book in books)))
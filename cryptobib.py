@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Single entry point for the db_tools scripts:
+
+  cryptobib.py <command> [arguments of the command]
+
+e.g., `cryptobib.py gen --full` runs `gen.py --full`.
+The module of a command is only imported when the command is selected,
+so that `cryptobib.py --help` and light commands start fast.
+The modules of the commands follow the same rule: mybibtex, the database configuration
+and web2py are imported, and logging is configured, in main() or in the functions using them,
+never at import time. So are the modules only needed to do the work (network, threads, backups,
+hashing, pickle, sqlite3...): `cryptobib.py <command> --help` must stay under 100 ms
+(see benchmarks/bench_startup.py).
+
+This script needs to be run in the root folder containing the
+folders "lib" and "db"
+"""
+
+import importlib
+import sys
+
+#: command -> (module, description), in the order of the help
+commands = [
+    ("gen", ("gen", "generate db/crypto.bib and db/crypto_crossref.bib")),
+    ("gen-abbrev", ("gen_abbrev", "generate db/abbrev?.bib from db/abbrev.bibyml")),
+    ("add", ("add", "add imported bib files to db/crypto_db.bib")),
+    ("merge-doi", ("merge_doi", "merge the DOI of imported bib files into db/crypto_db.bib")),
+    ("add-doi", ("add_doi_crossref", "get the missing DOI from Crossref")),
+    ("match-doi-dump", ("crossref_dump", "get the missing DOI from a local Crossref metadata dump")),
+    ("check", ("checks", "run the sanity checks in a single pass (text, JSON or JUnit output)")),
+    ("check-doi", ("sanity_checks_doi", "sanity checks of the DOI")),
+    ("check-authors", ("check_many_authors_keys", "analyze the keys of papers with more than 6 authors")),
+    ("find-duplicates", ("find_duplicates", "find papers entered twice under different keys")),
+    ("rekey", ("rekey", "rename papers of db/crypto_db.bib in bulk")),
+    ("confs-index", ("confs_index", "print or verify the index of the years of the conferences")),
+    ("update-webapp", ("update_webapp_db", "update the database of the web server (with web2py)")),
+    ("export-webapp", ("export_webapp_sqlite", "export the database of the web server (without web2py)")),
+    ("backup", ("backup_store", "manage the backups of db/crypto_db.bib")),
+    ("pipeline", ("pipeline", "run the release steps, skipping the up-to-date ones")),
+]
+
+
+def get_usage():
+    lines = [
+        "usage: cryptobib.py <command> [arguments]",
+        "",
+        "commands:",
+    ]
+    width = max(len(command) for (command, _) in commands)
+    for (command, (module, description)) in commands:
+        lines.append("  {}  {}".format(command.ljust(width), description))
+    lines.append("")
+    lines.append("Run `cryptobib.py <command> --help` for the arguments of a command.")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if not argv or argv[0] in ["-h", "--help"]:
+        print(get_usage())
+        return 0
+
+    command = argv[0]
+    modules = dict(commands)
+    if command not in modules:
+        print("cryptobib.py: unknown command '{}'".format(command), file=sys.stderr)
+        print(get_usage(), file=sys.stderr)
+        return 2
+
+    (module_name, description) = modules[command]
+    # the command sees the same arguments as if its script were run directly
+    sys.argv = ["{}.py".format(module_name)] + argv[1:]
+    module = importlib.import_module(module_name)
+    return module.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
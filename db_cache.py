@@ -0,0 +1,205 @@
+"""
+Load the parsed database (db/abbrev?.bib, db/crypto_db.bib and db/crypto_conf_list.bib)
+through a binary snapshot cache.
+
+Parsing the full database with mybibtex.parser.Parser is the dominant cost of
+most scripts. The resulting BibliographyData is pickled in a snapshot keyed by
+the content hashes of the parsed files, the abbrev level and the sources of the
+libraries producing it (`library_packages`), and reloaded instead of reparsing
+when none of these changed.
+
+The scripts using this module are responsible for putting "lib" in sys.path
+before using it. mybibtex is only imported when a file has to be parsed,
+so that importing this module is cheap; so are hashlib and pickle, only used when a database is loaded.
+"""
+
+import importlib.util
+import logging
+import os
+
+import profiling
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+
+#: folder where the snapshots are stored
+cache_dir = os.path.join(scriptdir, ".cache")
+
+#: bump this when the snapshot format changes, to invalidate all existing snapshots
+SNAPSHOT_VERSION = 1
+
+#: files parsed after the abbrev file, relatively to the db folder
+DB_FILENAMES = ["crypto_db.bib", "crypto_conf_list.bib"]
+
+#: packages whose code parses the files and defines the pickled classes
+library_packages = ["mybibtex", "pybtex"]
+
+
+def get_source_files(name):
+    """
+    Return the sorted list of the source files of the module or package `name` (with its subpackages),
+    found without importing it; [] if it cannot be found
+    """
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return []
+    if spec.submodule_search_locations is None:
+        return [spec.origin] if spec.origin is not None and os.path.isfile(spec.origin) else []
+    filenames = []
+    for folder in spec.submodule_search_locations:
+        for (dirpath, dirnames, files) in os.walk(folder):
+            dirnames[:] = [d for d in dirnames if d != "__pycache__"]
+            filenames.extend(os.path.join(dirpath, f) for f in files if f.endswith(".py"))
+    return sorted(filenames)
+
+
+def get_snapshot_key(filenames, abbrev_level):
+    """
+    Return the hash identifying the content of `filenames` parsed with abbrev level `abbrev_level`
+    by the current sources of `library_packages`
+    """
+    import hashlib
+
+    h = hashlib.sha256()
+    h.update("v{}:abbrev{}\n".format(SNAPSHOT_VERSION, abbrev_level).encode())
+    for package in library_packages:
+        h.update("{}:\n".format(package).encode())
+        for filename in get_source_files(package):
+            with open(filename, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+    h.update(b"files:\n")
+    for filename in filenames:
+        with open(filename, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def get_snapshot_filename(abbrev_level, db_filenames):
+    """ Return the snapshot file name: one snapshot per abbrev level and list of files """
+    name = "_".join(os.path.splitext(os.path.basename(f))[0] for f in db_filenames)
+    return os.path.join(cache_dir, "db_abbrev{}_{}.pickle".format(abbrev_level, name))
+
+
+def parse_db(filenames):
+    """ Parse `filenames` in this order and return the resulting BibliographyData """
+    import mybibtex.parser
+    parser = mybibtex.parser.Parser()
+    db = None
+    for filename in filenames:
+        db = parser.parse_file(filename)
+    return db
+
+
+def read_snapshot(snapshot_filename, key):
+    """ Return the database stored in the snapshot if it exists and matches `key`, None otherwise """
+    import pickle
+
+    try:
+        with open(snapshot_filename, "rb") as f:
+            (snapshot_key, db) = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning("db_cache: corrupt snapshot {} ({}), ignoring it".format(snapshot_filename, e))
+        return None
+
+    if snapshot_key != key:
+        return None
+    return db
+
+
+def write_snapshot(snapshot_filename, key, db):
+    """ Atomically write the snapshot, failing silently (apart from a warning) """
+    import pickle
+
+    tmp_filename = "{}.{}.tmp".format(snapshot_filename, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(snapshot_filename), exist_ok=True)
+        with open(tmp_filename, "wb") as f:
+            pickle.dump((key, db), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, snapshot_filename)
+    except Exception as e:
+        logging.warning("db_cache: cannot write snapshot {} ({})".format(snapshot_filename, e))
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def load_db(abbrev_level=0, db_dir="db", db_filenames=None, use_cache=True):
+    """
+    Return the BibliographyData obtained by parsing
+      db_dir/abbrev<abbrev_level>.bib
+    followed by the files `db_filenames` (relative to `db_dir`, default: `DB_FILENAMES`).
+
+    The result is read from the snapshot cache when the content of all these files is unchanged.
+    A missing, stale or corrupt snapshot falls back to a normal parse (and refreshes the snapshot).
+    """
+    if db_filenames is None:
+        db_filenames = DB_FILENAMES
+
+    filenames = [os.path.join(db_dir, "abbrev{}.bib".format(abbrev_level))] + \
+        [os.path.join(db_dir, f) for f in db_filenames]
+
+    with profiling.phase("load_db") as p:
+        db = load_db_aux(filenames, abbrev_level, db_filenames, use_cache)
+        p["entries"] = len(db.entries)
+    return db
+
+
+def load_db_aux(filenames, abbrev_level, db_filenames, use_cache):
+    if not use_cache:
+        with profiling.phase("parse"):
+            return parse_db(filenames)
+
+    key = get_snapshot_key(filenames, abbrev_level)
+    snapshot_filename = get_snapshot_filename(abbrev_level, db_filenames)
+
+    with profiling.phase("read_snapshot"):
+        db = read_snapshot(snapshot_filename, key)
+    if db is not None:
+        logging.info("db_cache: hit for {} (abbrev{})".format(", ".join(db_filenames), abbrev_level))
+        return db
+
+    logging.info("db_cache: miss for {} (abbrev{}), parsing".format(", ".join(db_filenames), abbrev_level))
+    with profiling.phase("parse"):
+        db = parse_db(filenames)
+    with profiling.phase("write_snapshot"):
+        write_snapshot(snapshot_filename, key, db)
+    return db
+
+
+def parse_files(filenames, abbrev_level=0, db_dir="db"):
+    """
+    Parse the bib files `filenames` (e.g., imported files) with the macros of db_dir/abbrev<abbrev_level>.bib.
+    Return, for each file, the list of its (key, entry), in the order of the file.
+    """
+    import mybibtex.parser
+    files_entries = []
+    with profiling.phase("parse_files") as p:
+        parser = mybibtex.parser.Parser()
+        parser.parse_file(os.path.join(db_dir, "abbrev{}.bib".format(abbrev_level)))
+        nb = 0
+        for filename in filenames:
+            new_db = parser.parse_file(filename)
+            # the parser accumulates the entries of all the files
+            files_entries.append(list(new_db.entries.items())[nb:])
+            nb = len(new_db.entries)
+        p["entries"] = nb
+    return files_entries
+
+
+def add_files(db, filenames, abbrev_level=0, db_dir="db"):
+    """
+    Parse the bib files `filenames` (e.g., imported files) and add their entries to `db`,
+    which is typically a database returned by `load_db`.
+    The macros of db_dir/abbrev<abbrev_level>.bib are available when parsing the files.
+
+    Return the list of the keys of the added entries.
+    Raise a ValueError if one of the entries is already in `db`.
+    """
+    added = []
+    for entries in parse_files(filenames, abbrev_level, db_dir):
+        for key, entry in entries:
+            if key in db.entries:
+                raise ValueError("entry {} is already in the database".format(key))
+            db.add_entry(key, entry)
+            added.append(key)
+    return added
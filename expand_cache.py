@@ -0,0 +1,61 @@
+"""
+Opt-in memoization of the expansion of the fields of loaded entries.
+
+Value.expand() resolves the macros of a field each time it is called.
+An ExpandCache stores the expanded value of each (entry, field) together with the Value object it comes from:
+assigning a field (e.g., entry.fields["doi"] = ...) replaces the Value object,
+which invalidates the cached expansion.
+An ExpandCache can be shared by threads (e.g., the workers of add_doi_crossref.py): the counters are updated under a lock.
+The statistics are reported by the scripts with logging.info("expand cache: ...").
+"""
+
+import threading
+
+
+class ExpandCache(object):
+    """ Memoize the expanded fields of entries and count hits and misses """
+
+    def __init__(self):
+        #: (id(entry), field) -> (entry, value, expanded value)
+        # the entry is kept to make sure its id is not reused
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def expand(self, entry, field):
+        """ Return entry.fields[field].expand(), memoized """
+        value = entry.fields[field]
+        k = (id(entry), field)
+        c = self.cache.get(k)
+        if c is not None and c[1] is value:
+            with self.lock:
+                self.hits += 1
+            return c[2]
+        with self.lock:
+            self.misses += 1
+        expanded = value.expand()
+        self.cache[k] = (entry, value, expanded)
+        return expanded
+
+    def invalidate(self, entry, field=None):
+        """ Forget the expansion of `field` of `entry` (all fields if None), e.g., after modifying a Value in place """
+        if field is not None:
+            self.cache.pop((id(entry), field), None)
+            return
+        for k in [k for k in self.cache if k[0] == id(entry)]:
+            del self.cache[k]
+
+    def get_stats(self):
+        """ Return a string describing the hit rate """
+        lookups = self.hits + self.misses
+        return "{} hits / {} lookups ({:.1f}%), {} expanded fields cached".format(
+            self.hits, lookups, 100.0 * self.hits / lookups if lookups else 0.0, len(self.cache)
+        )
+
+
+def expand(entry, field, cache=None):
+    """ Return entry.fields[field].expand(), memoized by the ExpandCache `cache` if not None """
+    if cache is None:
+        return entry.fields[field].expand()
+    return cache.expand(entry, field)
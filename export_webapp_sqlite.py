@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+This script exports the tables "change", "conf" and "entry" of the web server database
+(storage.sqlite) directly with sqlite3, without starting web2py, from
+  db/abbrev0.bib
+  db/crypto_db.bib
+  db/crypto_conf_list.bib
+  db/changes.txt
+
+The rows are the same as the ones written by update_webapp_db.py.
+The schema (tables and indexes) is the one of the current storage.sqlite, created by web2py:
+the current file is copied, the three tables are refilled in the copy with pragmas tuned for bulk loading,
+and the copy atomically replaces storage.sqlite.
+As with the truncate of the web2py DAL, the AUTOINCREMENT counters are reset, so that the ids are the same.
+The columns missing from a row get the default of the schema (web2py only stores the default of the
+"notnull" fields in the schema; the other fields without value are NULL, as with DAL when they have no default).
+`--compare` checks that the result is identical to a storage.sqlite written by update_webapp_db.py.
+Readers of storage.sqlite therefore see either the old or the new database, never a partially filled one.
+
+WARNING: THIS SCRIPT NEEDS TO BE EXECUTED in the ROOT folder of the cryptobib project,
+   and storage.sqlite needs to have been created by web2py at least once.
+
+In addition, it may be necessary to clear the cache of the web server or to restart it, after updating storage.sqlite.
+"""
+
+import sys
+import os
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(scriptdir, "..", "lib"))
+sys.path.append(os.path.join(scriptdir, "..", "db"))
+
+import confs_index
+import db_cache
+import profiling
+from webapp_rows import get_changes_rows, get_confs_rows, get_entries_rows
+
+import argparse
+import logging
+
+#: default location of the web server database
+default_storage = "web2py/applications/cryptobib/databases/storage.sqlite"
+
+#: tables written by this script
+tables = ["change", "conf", "entry"]
+
+#: tables of the sync state of update_webapp_db.py --incremental (see webapp_sync.py)
+sync_tables = ["sync_meta", "sync_row"]
+
+
+def get_columns(conn, tablename):
+    """ Return the columns of the table `tablename`, except the primary key "id" """
+    return [row[1] for row in conn.execute('PRAGMA table_info("{}")'.format(tablename)) if row[1] != "id"]
+
+
+def get_defaults(conn, tablename):
+    """ Return column -> value of the DEFAULT of the columns of the table `tablename` that have one """
+    defaults = {}
+    for row in conn.execute('PRAGMA table_info("{}")'.format(tablename)).fetchall():
+        (name, default) = (row[1], row[4])
+        if default is not None and name != "id":
+            (defaults[name],) = conn.execute("SELECT {}".format(default)).fetchone()
+    return defaults
+
+
+def drop_indexes(execute, tablename):
+    """
+    Drop the indexes of the SQLite table `tablename` and return the SQL statements to recreate them.
+    `execute(sql, params)` runs a query and returns its rows: it is shared by this script (sqlite3)
+    and update_webapp_db.py (web2py DAL).
+    """
+    indexes = execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (tablename,)
+    )
+    for (name, sql) in indexes:
+        execute('DROP INDEX "{}"'.format(name), ())
+    return [sql for (name, sql) in indexes]
+
+
+def get_execute(conn):
+    """ Return the `execute` function of drop_indexes for the sqlite3 connection `conn` """
+    return lambda sql, params: conn.execute(sql, params).fetchall()
+
+
+def truncate(conn, tablename):
+    """ Empty the table `tablename` and reset its AUTOINCREMENT counter, as the truncate of the web2py DAL """
+    conn.execute('DELETE FROM "{}"'.format(tablename))
+    if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'").fetchone():
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (tablename,))
+
+
+def write_table(conn, tablename, rows, batch_size=5000):
+    """
+    Replace the content of the table `tablename` by `rows` (iterable of (row_key, row)), with executemany
+    by batches of `batch_size` rows. Columns missing from a row get their default (NULL if none).
+    Raise a ValueError if a row has a field that is not a column of the table.
+    Return the number of rows written.
+    """
+    columns = get_columns(conn, tablename)
+    columns_set = set(columns)
+    defaults = get_defaults(conn, tablename)
+    sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+        tablename,
+        ", ".join('"{}"'.format(c) for c in columns),
+        ", ".join("?" for c in columns)
+    )
+
+    truncate(conn, tablename)
+    indexes = drop_indexes(get_execute(conn), tablename)
+
+    nb = 0
+    batch = []
+    for (row_key, row) in rows:
+        unknown = set(row.keys()) - columns_set
+        if unknown:
+            raise ValueError("row {} of table {} has unknown fields: {}".format(row_key, tablename, ", ".join(sorted(unknown))))
+        batch.append(tuple(row[c] if c in row else defaults.get(c) for c in columns))
+        if len(batch) >= batch_size:
+            conn.executemany(sql, batch)
+            nb += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+        nb += len(batch)
+
+    for sql_index in indexes:
+        conn.execute(sql_index)
+    return nb
+
+
+def reset_sync_state(conn, tablename):
+    """ Forget the sync state of `tablename` (as webapp_sync.reset_state), if the sync tables exist """
+    existing = set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+    for sync_table in sync_tables:
+        if sync_table in existing:
+            conn.execute('DELETE FROM "{}" WHERE table_name = ?'.format(sync_table), (tablename,))
+
+
+def copy_db(storage, tmp_filename):
+    """ Copy the database `storage` to `tmp_filename` with the sqlite3 backup API (consistent even if in use) """
+    import sqlite3
+
+    if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+    src = sqlite3.connect(storage)
+    dst = sqlite3.connect(tmp_filename)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def export(storage, cryptodb, confs_years, batch_size=5000):
+    """ Write the tables of `tables` in a copy of `storage` and atomically replace `storage` by the copy """
+    import sqlite3
+
+    if not os.path.exists(storage):
+        logging.error("Error: {} does not exist, run web2py (or update_webapp_db.py) once to create it".format(storage))
+        sys.exit(1)
+
+    tmp_filename = "{}.{}.tmp".format(storage, os.getpid())
+    try:
+        with profiling.phase("copy"):
+            copy_db(storage, tmp_filename)
+
+        conn = sqlite3.connect(tmp_filename, isolation_level=None)
+        try:
+            # the copy is thrown away on failure, so there is no need for a journal nor for syncs
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("PRAGMA temp_store = MEMORY")
+            conn.execute("PRAGMA cache_size = -200000")
+
+            conn.execute("BEGIN")
+            for (tablename, rows) in [
+                ("change", get_changes_rows()),
+                ("conf", get_confs_rows(confs_years)),
+                ("entry", get_entries_rows(cryptodb)),
+            ]:
+                with profiling.phase("write_{}".format(tablename)) as p:
+                    nb = write_table(conn, tablename, rows, batch_size)
+                    reset_sync_state(conn, tablename)
+                    p["entries"] = nb
+                print("* {:<7} {} rows written".format(tablename, nb))
+            conn.execute("COMMIT")
+
+            # back to the default journal mode of web2py, before the file is used by the web server
+            conn.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            conn.close()
+
+        with profiling.phase("swap"):
+            os.replace(tmp_filename, storage)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def compare(storage, reference, tablenames=tables, max_differences=10):
+    """
+    Compare the tables `tablenames` (columns, rows with their ids and AUTOINCREMENT counters) of the databases
+    `storage` and `reference`, e.g., written by this script and by update_webapp_db.py.
+    Return the list of the differences (at most `max_differences` rows reported per table).
+    """
+    import sqlite3
+
+    differences = []
+    conns = [sqlite3.connect(storage), sqlite3.connect(reference)]
+    try:
+        for tablename in tablenames:
+            (columns, columns_ref) = [["id"] + get_columns(conn, tablename) for conn in conns]
+            if sorted(columns) != sorted(columns_ref):
+                differences.append("{}: columns {} vs {}".format(tablename, columns, columns_ref))
+                continue
+            select = 'SELECT {} FROM "{}" ORDER BY id'.format(", ".join('"{}"'.format(c) for c in columns), tablename)
+            (rows, rows_ref) = [conn.execute(select).fetchall() for conn in conns]
+            if len(rows) != len(rows_ref):
+                differences.append("{}: {} rows vs {}".format(tablename, len(rows), len(rows_ref)))
+            nb = 0
+            for (row, row_ref) in zip(rows, rows_ref):
+                if row != row_ref and nb < max_differences:
+                    nb += 1
+                    differences.append("{}: row {} vs {}".format(
+                        tablename, dict(zip(columns, row)), dict(zip(columns, row_ref))))
+            (sequence, sequence_ref) = [
+                conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (tablename,)).fetchall()
+                if conn.execute("SELECT name FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone() else []
+                for conn in conns
+            ]
+            if sequence != sequence_ref:
+                differences.append("{}: AUTOINCREMENT counter {} vs {}".format(tablename, sequence, sequence_ref))
+    finally:
+        for conn in conns:
+            conn.close()
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser("Export the tables of the web server database without web2py")
+    parser.add_argument("--storage", default=default_storage,
+                        help="SQLite database of the web server (default: {})".format(default_storage))
+    parser.add_argument("--batch-size", type=int, default=5000, help="number of rows per executemany (default: 5000)")
+    parser.add_argument("--compare", metavar="reference.sqlite",
+                        help="after the export, compare the tables with this database (e.g., a copy of storage.sqlite "
+                             "written by update_webapp_db.py) and exit with status 1 if they differ")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "export_webapp_sqlite.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
+
+    print("* read crypto_db.bib")
+    cryptodb = db_cache.load_db(abbrev_level=0)
+    confs_years = confs_index.get_index(cryptodb).get_confs_years(cryptodb)
+
+    export(args.storage, cryptodb, confs_years, args.batch_size)
+    print("{} updated".format(args.storage))
+
+    if args.compare is not None:
+        differences = compare(args.storage, args.compare)
+        for difference in differences:
+            print(difference)
+        if differences:
+            logging.error("Error: {} differs from {}".format(args.storage, args.compare))
+            sys.exit(1)
+        print("{} and {} are identical".format(args.storage, args.compare))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Find papers that are probably entered twice under different keys.
+
+Each paper is represented by the set of words of its normalized title and the set of normalized last names
+of its authors. Candidate pairs are the papers whose titles have a Jaccard similarity at least `threshold`:
+they are found with a prefix-filtering index (each title only indexes its rarest words, enough for two
+titles above the threshold to share one of them) instead of comparing all pairs.
+Candidates are then scored with the title and author similarities.
+
+This script needs to be run in the root folder containing the
+folders "lib" and "db"
+"""
+
+import sys
+import os
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(scriptdir, "..", "lib"))
+sys.path.append(os.path.join(scriptdir, "..", "db"))
+
+import argparse
+import collections
+import json
+import logging
+import math
+
+import db_cache
+import expand_cache
+import profiling
+from expand_cache import expand
+from title_similarity import normalize_title, title_words
+
+#: default minimal Jaccard similarity of the titles of a candidate pair
+default_threshold = 0.7
+
+
+def get_last_name(author):
+    """ Return the normalized last name of the bibtex name `author` ("Last, First" or "First Last") """
+    if "," in author:
+        last = author.split(",")[0]
+    else:
+        last = author.split()[-1] if author.split() else ""
+    return normalize_title(last)
+
+
+def get_last_names(authors):
+    """ Return the set of normalized last names of the bibtex author list `authors` """
+    from pybtex.bibtex.utils import split_name_list
+
+    last_names = set()
+    for author in split_name_list(authors):
+        last = get_last_name(author)
+        if last:
+            last_names.add(last)
+    return frozenset(last_names)
+
+
+def jaccard(s1, s2):
+    if not s1 and not s2:
+        return 1.0
+    return len(s1 & s2) / len(s1 | s2)
+
+
+def get_records(entries, cache=None):
+    """ Return the list of (key, title, title words, last names) of the papers `entries` (iterable of (key, entry)) with a title """
+    records = []
+    for (key, entry) in entries:
+        if "title" not in entry.fields:
+            continue
+        title = expand(entry, "title", cache)
+        words = title_words(title)
+        if not words:
+            continue
+        authors = get_last_names(expand(entry, "author", cache)) if "author" in entry.fields else frozenset()
+        records.append((key, title, words, authors))
+    return records
+
+
+def ceil(x):
+    """ Return the ceiling of `x`, ignoring floating-point errors (0.7 * 10 is 7.000000000000001) """
+    return int(math.ceil(x - 1e-9))
+
+
+def get_candidate_pairs(word_sets, threshold=default_threshold):
+    """
+    Return the list of (i, j, jaccard) with i < j such that jaccard(word_sets[i], word_sets[j]) >= threshold.
+
+    The words of each set are ordered from the rarest to the most frequent. Two sets x, y with
+    jaccard(x, y) >= threshold share at least one of the first |x| - ceil(threshold * |x|) + 1 words of x
+    (its prefix), so only the prefixes are indexed. Sets are processed by increasing size.
+    A pair is only verified if it passes the size filter (|y| >= threshold * |x|) and the positional filter:
+    the words shared so far in the prefixes plus the words left after the current positions must reach
+    the overlap ceil(threshold / (1 + threshold) * (|x| + |y|)) required by the threshold.
+    """
+    frequency = collections.Counter(word for words in word_sets for word in words)
+    ordered = [sorted(words, key=lambda w: (frequency[w], w)) for words in word_sets]
+
+    # word -> list of (set number, position of the word in the set)
+    index = collections.defaultdict(list)
+    ratio = threshold / (1 + threshold)
+    pairs = []
+    for i in sorted(range(len(ordered)), key=lambda i: len(ordered[i])):
+        words = ordered[i]
+        size = len(words)
+        min_size = threshold * size
+        prefix = size - ceil(threshold * size) + 1
+
+        # set number -> number of words shared in the prefixes, or -1 if pruned
+        overlaps = {}
+        for (pos, word) in enumerate(words[:prefix]):
+            for (j, pos_j) in index[word]:
+                size_j = len(ordered[j])
+                if size_j < min_size:
+                    continue
+                overlap = overlaps.get(j, 0)
+                if overlap < 0:
+                    continue
+                required = ceil(ratio * (size + size_j))
+                if overlap + 1 + min(size - pos - 1, size_j - pos_j - 1) >= required:
+                    overlaps[j] = overlap + 1
+                else:
+                    overlaps[j] = -1
+        for (j, overlap) in overlaps.items():
+            if overlap > 0:
+                similarity = jaccard(word_sets[i], word_sets[j])
+                if similarity >= threshold:
+                    pairs.append((min(i, j), max(i, j), similarity))
+
+        for (pos, word) in enumerate(words[:prefix]):
+            index[word].append((i, pos))
+    return pairs
+
+
+def find_duplicates(records, threshold=default_threshold):
+    """
+    Return the candidate duplicates of `records` (see get_records), best first, as a list of dictionaries
+      score, title, authors, key1, key2, title1, title2
+    where title and authors are the Jaccard similarities of the titles and of the last names,
+    and score is their mean (the title similarity alone if one of the papers has no author)
+    """
+    duplicates = []
+    for (i, j, title_similarity) in get_candidate_pairs([r[2] for r in records], threshold):
+        (key1, title1, words1, authors1) = records[i]
+        (key2, title2, words2, authors2) = records[j]
+        if authors1 and authors2:
+            authors_similarity = jaccard(authors1, authors2)
+            score = (title_similarity + authors_similarity) / 2
+        else:
+            authors_similarity = None
+            score = title_similarity
+        if str(key1) > str(key2):
+            (key1, title1, key2, title2) = (key2, title2, key1, title1)
+        duplicates.append({
+            "score": score,
+            "title": title_similarity,
+            "authors": authors_similarity,
+            "key1": str(key1),
+            "key2": str(key2),
+            "title1": title1,
+            "title2": title2,
+        })
+    duplicates.sort(key=lambda d: (-d["score"], d["key1"], d["key2"]))
+    return duplicates
+
+
+def parse_years(years):
+    """ Parse "2010" or "2010-2015" into (start, end) """
+    a = years.split("-")
+    if len(a) == 1:
+        return (int(a[0]), int(a[0]))
+    return (int(a[0]), int(a[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser("Find papers that are probably entered twice under different keys")
+    parser.add_argument("--filter", help="only consider a specific conference")
+    parser.add_argument("--years", help="only consider papers of these years (e.g., 2010 or 2010-2015)")
+    parser.add_argument("--threshold", type=float, default=default_threshold,
+                        help="minimal Jaccard similarity of the words of the titles (default: {})".format(default_threshold))
+    parser.add_argument("--min-score", type=float, default=0.0, help="only report the pairs with at least this score")
+    parser.add_argument("--json", action="store_true", help="output the pairs as JSON")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "find_duplicates.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    from mybibtex import tools
+    mybibtex.generator.config = config
+
+    db = db_cache.load_db(abbrev_level=3)
+
+    myfilter = mybibtex.generator.FilterPaper()
+    if args.filter:
+        myfilter = mybibtex.generator.FilterConf(args.filter, myfilter)
+    entries = myfilter.filter(db.entries)
+    if args.years:
+        (start, end) = parse_years(args.years)
+        entries = [
+            (key, entry) for (key, entry) in entries
+            if start <= int(tools.short_to_full_year(key.year)) <= end
+        ]
+
+    cache = expand_cache.ExpandCache()
+    with profiling.phase("records") as p:
+        records = get_records(entries, cache)
+        p["entries"] = len(records)
+    logging.info("expand cache: {}".format(cache.get_stats()))
+
+    with profiling.phase("pairs") as p:
+        duplicates = [d for d in find_duplicates(records, args.threshold) if d["score"] >= args.min_score]
+        p["entries"] = len(duplicates)
+
+    if args.json:
+        json.dump(duplicates, sys.stdout, indent=2)
+        print("")
+        return
+
+    for d in duplicates:
+        print("{:.2f} (title {:.2f}, authors {}) {} {}".format(
+            d["score"], d["title"], "{:.2f}".format(d["authors"]) if d["authors"] is not None else "-", d["key1"], d["key2"]
+        ))
+        print("    {}".format(d["title1"]))
+        print("    {}".format(d["title2"]))
+    print("")
+    print("{} candidate pairs among {} papers".format(len(duplicates), len(records)))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,19 +17,54 @@ scriptdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(scriptdir, "..", "lib"))
 sys.path.append(os.path.join(scriptdir, "..", "db"))
 
-from config import *
-import config
-import header
+import argparse
+import collections
+import itertools
 import logging
-from confs_years import *
-import mybibtex.generator
-import mybibtex.parser
+import confs_index
+import crossref_index
+import db_cache
+import profiling
 
-mybibtex.generator.config = config
-logging.basicConfig(level=logging.DEBUG)
+
+#: file caching the formatted conference-year blocks (see gen_crypto_bibs)
+blocks_cache_filename = os.path.join(db_cache.cache_dir, "gen_blocks.pickle")
+
+#: bump this when the format of the blocks cache or the formatting changes, to invalidate the cache
+BLOCKS_CACHE_VERSION = 1
+
+#: output files: name -> expand_crossrefs
+outputs = collections.OrderedDict([
+    ("db/crypto.bib", True),
+    ("db/crypto_crossref.bib", False),
+])
+
+
+def format_entry(db, key, entry, expand_crossrefs):
+    """ Format `entry` exactly as mybibtex.generator.bibtex_gen does for the output `expand_crossrefs` """
+    import mybibtex.generator
+    return mybibtex.generator.bibtex_entry_format(db, key, entry, expand_crossrefs=expand_crossrefs,
+                                                  remove_empty_fields=True)
+
+
+def get_crossrefs(db, entries):
+    """
+    Return the sorted list of (key, entry) of the books referenced by the crossref fields of `entries`,
+    the papers of `db` in the SortConfYearPage order
+    """
+    index = crossref_index.CrossrefIndex(db, papers=entries)
+    if index.dangling:
+        raise KeyError("dangling crossrefs: {}".format(
+            ", ".join("{} -> {}".format(key, crossref) for (key, crossref) in index.dangling)
+        ))
+    return index.get_books()
 
 
 def gen_crypto_bib(db, confs_years, expand_crossrefs: bool):
+    import config
+    import header
+    import mybibtex.generator
+
     if expand_crossrefs == False:
         outname = "db/crypto_crossref.bib"
     else:
@@ -49,19 +84,186 @@ def gen_crypto_bib(db, confs_years, expand_crossrefs: bool):
                 out.write(line)
 
 
+def get_blocks(entries):
+    """ Group the sorted list of (key, entry) `entries` in blocks of consecutive entries of the same conference and year """
+    return [
+        (block_id, list(block_entries))
+        for (block_id, block_entries) in itertools.groupby(entries, key=lambda k_e: (k_e[0].confkey, k_e[0].year))
+    ]
+
+
+def get_global_fingerprint():
+    """
+    Return the fingerprint of everything but the entries of crypto_db.bib that can change the formatting:
+    macros, crossrefs (books), configuration and all the modules of mybibtex
+    """
+    import hashlib
+    import config
+    h = hashlib.sha256("v{}".format(BLOCKS_CACHE_VERSION).encode())
+    for filename in ["db/abbrev0.bib", "db/crypto_conf_list.bib", config.__file__] + db_cache.get_source_files("mybibtex"):
+        with open(filename, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def get_block_fingerprint(block_entries):
+    """ Return the fingerprint of the source of the entries of a block """
+    import hashlib
+    h = hashlib.sha256()
+    for (key, entry) in block_entries:
+        h.update(repr((
+            str(key),
+            entry.type,
+            sorted((k, v.to_bib(expand=False)) for (k, v) in entry.fields.items())
+        )).encode())
+    return h.hexdigest()
+
+
+def format_papers_block(db, block_entries):
+    """ Return a dictionary outname -> text of the papers `block_entries` for each of the `outputs` """
+    texts = {outname: [] for outname in outputs}
+    for (key, entry) in block_entries:
+        if "crossref" not in entry.fields:
+            # expand_crossrefs has no effect on this entry: format it once for all outputs
+            text = format_entry(db, key, entry, False)
+            for outname in outputs:
+                texts[outname].append(text)
+            continue
+        for outname, expand_crossrefs in outputs.items():
+            texts[outname].append(format_entry(db, key, entry, expand_crossrefs))
+    return {outname: "".join(t) for (outname, t) in texts.items()}
+
+
+def format_crossrefs_block(db, block_entries):
+    """ Return a dictionary outname -> text of the crossrefs `block_entries`: only the non-expanded outputs include them """
+    return {
+        outname: "" if expand_crossrefs else "".join(
+            format_entry(db, key, entry, expand_crossrefs) for (key, entry) in block_entries
+        )
+        for (outname, expand_crossrefs) in outputs.items()
+    }
+
+
+def read_blocks_cache(global_fingerprint):
+    """ Return the cached blocks if the cache is valid for `global_fingerprint`, {} otherwise """
+    import pickle
+    try:
+        with open(blocks_cache_filename, "rb") as f:
+            cache = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.warning("gen: corrupt blocks cache ({}), ignoring it".format(e))
+        return {}
+    if cache.get("global") != global_fingerprint:
+        return {}
+    return cache["blocks"]
+
+
+def write_blocks_cache(global_fingerprint, blocks):
+    import pickle
+    tmp_filename = blocks_cache_filename + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(blocks_cache_filename), exist_ok=True)
+        with open(tmp_filename, "wb") as f:
+            pickle.dump({"global": global_fingerprint, "blocks": blocks}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, blocks_cache_filename)
+    except Exception as e:
+        logging.warning("gen: cannot write blocks cache ({})".format(e))
+
+
+def gen_crypto_bibs(db, confs_years, full=False):
+    """
+    Generate all the `outputs` in one pass over the database, with output byte-identical to gen_crypto_bib.
+    Filtering, sorting and crossref collection are done once,
+    and each entry is formatted for every output as soon as it is reached.
+
+    The formatted text of each conference-year block is cached together with the fingerprint of its entries:
+    unless `full` is True, only the blocks whose fingerprint changed are formatted again.
+    """
+    import config
+    import header
+    import mybibtex.generator
+
+    with profiling.phase("filter_sort") as p:
+        entries = list(mybibtex.generator.SortConfYearPage().sort(
+            iter(mybibtex.generator.FilterPaper().filter(db.entries))
+        ))
+        p["entries"] = len(entries)
+    with profiling.phase("crossrefs") as p:
+        crossrefs = get_crossrefs(db, entries)
+        p["entries"] = len(crossrefs)
+
+    global_fingerprint = get_global_fingerprint()
+    cached_blocks = {} if full else read_blocks_cache(global_fingerprint)
+    new_blocks = {}
+    nb_reused = 0
+
+    texts = []
+    with profiling.phase("format") as p:
+        for (section, section_entries, format_block) in [
+            ("papers", entries, format_papers_block),
+            ("crossrefs", crossrefs, format_crossrefs_block),
+        ]:
+            for (block_id, block_entries) in get_blocks(section_entries):
+                cache_key = (section,) + block_id
+                fingerprint = get_block_fingerprint(block_entries)
+                if cache_key in cached_blocks and cached_blocks[cache_key][0] == fingerprint:
+                    block_texts = cached_blocks[cache_key][1]
+                    nb_reused += 1
+                else:
+                    block_texts = format_block(db, block_entries)
+                new_blocks[cache_key] = (fingerprint, block_texts)
+                texts.append(block_texts)
+        p["entries"] = len(entries) + len(crossrefs)
+
+    logging.info("gen: {} blocks reused, {} blocks formatted".format(nb_reused, len(new_blocks) - nb_reused))
+
+    with open("db/crypto_misc.bib") as fin:
+        misc = fin.read()
+
+    text_header = header.get_header(config, "gen.py", confs_years)
+    with profiling.phase("write"):
+        for outname in outputs:
+            with open(outname, "w") as out:
+                out.write(text_header)
+                for block_texts in texts:
+                    out.write(block_texts[outname])
+                out.write("\n")
+                out.write("\n")
+                out.write(misc)
+
+    write_blocks_cache(global_fingerprint, new_blocks)
+
+
 def main():
-    parser = mybibtex.parser.Parser()
+    parser = argparse.ArgumentParser("Generate db/crypto.bib and db/crypto_crossref.bib")
+    parser.add_argument("--two-pass", action="store_true",
+                        help="generate each file with a separate call to bibtex_gen (slower, for comparison)")
+    parser.add_argument("--full", action="store_true",
+                        help="format all the entries again instead of reusing the unchanged conference-year blocks")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "gen.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
+
     # It's important to use abbrev0.bib for the parsing
     # otherwise we may be removing fields that are empty for abbrev3.bib but not for abbrev0.bib
     # as we are removing fields that are empty after macro expansion
-    parser.parse_file("db/abbrev0.bib")
-    parser.parse_file("db/crypto_db.bib")
-    db = parser.parse_file("db/crypto_conf_list.bib")
+    db = db_cache.load_db(abbrev_level=0)
 
-    confs_years = get_confs_years_inter(db, confs_missing_years)
+    confs_years = confs_index.get_index(db).get_confs_years(db)
 
-    gen_crypto_bib(db, confs_years, True)
-    gen_crypto_bib(db, confs_years, False)
+    with profiling.phase("gen"):
+        if args.two_pass:
+            gen_crypto_bib(db, confs_years, True)
+            gen_crypto_bib(db, confs_years, False)
+        else:
+            gen_crypto_bibs(db, confs_years, args.full)
 
 
 if __name__ == "__main__":
@@ -11,89 +11,61 @@ scriptdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(scriptdir, "..", "lib"))
 sys.path.append(os.path.join(scriptdir, "..", "db"))
 
-import bibyml
+import argparse
 import logging
+import profiling
 
-import header
-import config
-from config import *
 
-logging.basicConfig(level=logging.DEBUG)
+def gen(outs, table):
+    """ Write the abbrev level `short` of the AbbrevTable `table` in outs[short], for all levels, in a single pass """
+    import config
+    import header
 
+    for out in outs:
+        out.write(header.get_header(config, "gen.py"))
 
-def get_value(d, short=0):
-    #: key to search for value (in the bibyml) depending on the wanted version short
-    keys = {
-        0: ["@0", ""],
-        1: ["@1", "@0", ""],
-        2: ["@2", "@0", ""],
-        3: ["@3", "@2", "@1", ""],
-    }
+    for (key, (values, error)) in table.table.items():
+        for (short, val) in enumerate(values):
+            if val is not None:
+                outs[short].write("@string{{{} = {}{}}}\n".format(
+                    key,
+                    " "*(max(0, 32-len(key)-11)),
+                    val
+                ))
 
-    for k in keys[short]:
-        if k in d:
-            if k == "":
-                return d[k]
-            else:
-                return d[k][""]
-    return None
 
+def gen_abbrev(filename="db/abbrev.bibyml"):
+    """ Compile and check `filename`, and write db/abbrev?.bib """
+    import abbrev_table
 
-def gen(out, abbrev, short=0):
-    # we need to do a recursion in the tree defined by the yaml
-    def write_abbrev(d, path=[]):
-        val = get_value(d, short=short)
-        if val is not None:
-            key = "".join(path)
-            out.write("@string{{{} = {}{}}}\n".format(
-                key, 
-                " "*(max(0, 32-len(key)-11)), 
-                val
-            ))
-        for k,v in d.items():
-            if k in ["", "@0", "@1", "@2", "@3"]:
-                continue
-            write_abbrev(v, path+[k])
+    with profiling.phase("compile") as p:
+        table = abbrev_table.AbbrevTable.from_file(filename)
+        p["entries"] = len(table.table)
 
+    with profiling.phase("check"):
+        table.check()
 
-    out.write(header.get_header(config, "gen.py"))
-
-    write_abbrev(abbrev)
-
-
-def check_abbrev(abbrev):
-    """
-    Sanity check that abbrev file
-    """
-
-    def check_abbrev0_non_empty_field_if_other_non_empty(d, path=[]):
-        """
-        Ensure that if non-abbrev0 fields are not empty,
-        abbrev0 field is not empty
-        """
-        vals = [get_value(d, short=s) for s in [0,1,2,3]]
-
-        if any(vals[i] is not None and vals[i] != "" for i in range(1,4)):
-            assert vals[0] is not None and vals[0] != "", \
-                "field '{}' is non-empty for one non-abbrev0 file but is empty in abbrev0".format("".join(path))
-
-        for k,v in d.items():
-            if k in ["", "@0", "@1", "@2", "@3"]:
-                continue
-            check_abbrev0_non_empty_field_if_other_non_empty(v, path+[k])
-
-
-    check_abbrev0_non_empty_field_if_other_non_empty(abbrev)
+    with profiling.phase("write"):
+        outs = [open("db/abbrev{}.bib".format(short), "w") for short in range(abbrev_table.NB_LEVELS)]
+        try:
+            gen(outs, table)
+        finally:
+            for out in outs:
+                out.close()
 
 
 def main():
-    abbrev = bibyml.parse(open("db/abbrev.bibyml"))
-
-    check_abbrev(abbrev)
-
-    for short in range(4):
-        with open("db/abbrev{}.bib".format(short), "w") as out:
-            gen(out, abbrev, short=short)
+    parser = argparse.ArgumentParser("Generate db/abbrev?.bib from db/abbrev.bibyml")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "gen_abbrev.py")
+    logging.basicConfig(level=logging.DEBUG)
+
+    try:
+        gen_abbrev()
+    except ValueError as e:
+        logging.error("Error: {}".format(e))
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -11,20 +11,16 @@ scriptdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(scriptdir, "..", "lib"))
 sys.path.append(os.path.join(scriptdir, "..", "db"))
 
-import mybibtex.parser
-import mybibtex.generator
-import confs_years
-
+import confs_index
+import db_cache
+import expand_cache
+import profiling
+from expand_cache import expand
+from title_similarity import normalize_title
+
+import collections
 import logging
-import shutil
 import argparse
-import time
-
-import config
-from config import *
-
-mybibtex.generator.config = config
-logging.basicConfig(level=logging.DEBUG)
 
 color_texts = {
     "Error": "\x1b[6;30;41mError\x1b[0m",
@@ -33,38 +29,119 @@ color_texts = {
 }
 
 
-def get_entry_by_pages(db, entry_doi):
-    """ Try to find the entry in db using pages and crossref """
-
-    if "crossref" not in entry_doi.fields:
-        return None, None
-
-    if "pages" not in entry_doi.fields:
-        return None, None
-
-    for (key, entry) in db.entries.items():
-        if "crossref" not in entry.fields or entry.fields["crossref"].expand() != entry_doi.fields["crossref"].expand():
-            continue
-        if "pages" not in entry.fields or entry.fields["pages"].expand() != entry_doi.fields["pages"].expand():
-            continue
-        return key, entry
-
-    return None, None
+def get_first_author_last_name(entry, cache=None):
+    """ Return the normalized last name of the first author of `entry` ("" if no author) """
+    from pybtex.bibtex.utils import split_name_list
+
+    if "author" not in entry.fields:
+        return ""
+    authors = split_name_list(expand(entry, "author", cache))
+    if len(authors) == 0:
+        return ""
+    author = authors[0]
+    if "," in author:
+        last = author.split(",")[0]
+    else:
+        last = author.split()[-1] if author.split() else ""
+    return normalize_title(last)
+
+
+class EntryIndex(object):
+    """
+    Index of the papers of db used to find the entry corresponding to an imported entry
+    whose key is not in db.
+    Lookups are O(1):
+      - by (crossref, pages)
+      - by (normalized title, first author last name), used when the pages differ
+        (e.g., the import has the final pages and db the preliminary ones)
+    """
+
+    def __init__(self, db, cache=None):
+        self.cache = cache
+        self.by_pages = collections.defaultdict(list)
+        self.by_title = collections.defaultdict(list)
+        self.db = db
+
+        for (key, entry) in db.entries.items():
+            k = self.get_pages_key(entry, cache)
+            if k is not None:
+                self.by_pages[k].append(key)
+            k = self.get_title_key(entry, cache)
+            if k is not None:
+                self.by_title[k].append(key)
+
+    @staticmethod
+    def get_pages_key(entry, cache=None):
+        if "crossref" not in entry.fields or "pages" not in entry.fields:
+            return None
+        return (expand(entry, "crossref", cache), expand(entry, "pages", cache))
+
+    @staticmethod
+    def get_title_key(entry, cache=None):
+        if "title" not in entry.fields:
+            return None
+        return (normalize_title(expand(entry, "title", cache)), get_first_author_last_name(entry, cache))
+
+    def lookup(self, entry_doi):
+        """
+        Return (keys, method) where keys is the list of keys of the entries of db matching `entry_doi`
+        (empty if no match, more than one if ambiguous) and method is "pages" or "title"
+        """
+        k = self.get_pages_key(entry_doi, self.cache)
+        if k is not None and k in self.by_pages:
+            return self.by_pages[k], "pages"
+        k = self.get_title_key(entry_doi, self.cache)
+        if k is not None and k in self.by_title:
+            return self.by_title[k], "title"
+        return [], None
+
+
+def get_entry_by_pages(db, entry_doi, index=None):
+    """
+    Try to find the entry in db using pages and crossref, or title and first author otherwise.
+    Return (key, entry, method) where method is "pages" or "title",
+    or (None, None, None) if no match or the match is ambiguous (which is reported).
+    `index` is an EntryIndex of db, built if not provided
+    """
+
+    if index is None:
+        index = EntryIndex(db)
+
+    keys, method = index.lookup(entry_doi)
+    if len(keys) == 0:
+        return None, None, None
+    if len(keys) > 1:
+        print(("    {}: ambiguous match by {}: {}".format(
+            color_texts["Error"], method, " ".join(str(key) for key in keys)
+        )))
+        return None, None, None
+
+    return keys[0], db.entries[keys[0]], method
+
+def merge_doi_db(db, db_doi, cache=None):
+    """
+    Merge the DOI of the papers of db_doi into db.
+    `cache` is an optional ExpandCache used to expand the fields of both databases
+    """
+    import mybibtex.generator
 
-def merge_doi_db(db, db_doi):
     myfilter = mybibtex.generator.FilterPaper()
     entries_doi = dict(myfilter.filter(db_doi.entries))
+    index = None
 
     for (key, entry_doi) in mybibtex.generator.SortConfYearPage().sort(iter(entries_doi.items())):
         key_str = str(key)
+        method = None
 
         if key not in db.entries:
             print(("{}: Key {} not found in DB ".format(color_texts["Warning"], key)))
-            key_db, entry = get_entry_by_pages(db, entry_doi)
+            if index is None:
+                index = EntryIndex(db, cache)
+            key_db, entry, method = get_entry_by_pages(db, entry_doi, index)
             if key_db != None:
-                print(("    {}: Found instead {}:".format(color_texts["Success"], str(key_db))))
-                print(("          import title: {}".format(entry_doi.fields["title"].expand())))
-                print(("          db title:     {}".format(entry.fields["title"].expand())))
+                print(("    {}: Found instead {} (by {}):".format(color_texts["Success"], str(key_db), method)))
+                print(("          import title: {}".format(expand(entry_doi, "title", cache))))
+                print(("          db title:     {}".format(expand(entry, "title", cache))))
             else:
                 print(("    {}: Could not find any match at all.".format(color_texts["Error"])))
                 continue
@@ -89,76 +166,88 @@ def merge_doi_db(db, db_doi):
             )))
             continue
 
-        if "pages" in entry.fields and "pages" in entry_doi.fields and \
-                entry.fields["pages"].expand() != entry_doi.fields["pages"].expand():
-            print(("{}: Key {} has different pages in crypto_db ({}) vs import ({}) => not merged". format(
-                color_texts["Error"], key_str,
-                entry.fields["pages"].expand(),
-                entry_doi.fields["pages"].expand()
-            )))
-            continue
+        if expand(entry, "pages", cache) != expand(entry_doi, "pages", cache):
+            if method == "title":
+                # the title index is only used when the pages differ: the pages of crypto_db are kept
+                print(("{}: Key {} matched by title has different pages in crypto_db ({}) vs import ({}) => pages of crypto_db kept". format(
+                    color_texts["Warning"], key_str,
+                    expand(entry, "pages", cache),
+                    expand(entry_doi, "pages", cache)
+                )))
+            else:
+                print(("{}: Key {} has different pages in crypto_db ({}) vs import ({}) => not merged". format(
+                    color_texts["Error"], key_str,
+                    expand(entry, "pages", cache),
+                    expand(entry_doi, "pages", cache)
+                )))
+                continue
 
-        nb_authors = len(entry.fields["author"].expand().split(" and"))
-        nb_authors_doi = len(entry_doi.fields["author"].expand().split(" and"))
+        nb_authors = len(expand(entry, "author", cache).split(" and"))
+        nb_authors_doi = len(expand(entry_doi, "author", cache).split(" and"))
         if nb_authors != nb_authors_doi:
             print(("{}: Key {} has different number of authors in crypto_db ({}: {}) vs import ({}: {}) => not merged". format(
                 color_texts["Error"], key_str,
-                nb_authors, entry.fields["author"].expand().replace("\n", " "),
-                nb_authors_doi, entry_doi.fields["author"].expand().replace("\n", " ")
+                nb_authors, expand(entry, "author", cache).replace("\n", " "),
+                nb_authors_doi, expand(entry_doi, "author", cache).replace("\n", " ")
             )))
             continue
 
-        if "doi" in entry.fields and entry.fields["doi"].expand() != entry_doi.fields["doi"].expand():
+        if "doi" in entry.fields and expand(entry, "doi", cache) != expand(entry_doi, "doi", cache):
             print(("{}: Key {} has different DOI in crypto_db ({}) vs import ({}) => not merged".format(
                 color_texts["Error"], key_str,
-                entry.fields["doi"].expand(),
-                entry_doi.fields["doi"].expand()
+                expand(entry, "doi", cache),
+                expand(entry_doi, "doi", cache)
             )))
             continue
 
         entry.fields["doi"] = entry_doi.fields["doi"]
 
 
-def merge_doi(filenames):
-    parser_doi = mybibtex.parser.Parser()
-    parser_doi.parse_file("db/abbrev0.bib")
-    db_doi = parser_doi.parse_file("db/crypto_conf_list.bib")
+def merge_doi(filenames, use_expand_cache=False):
+    import mybibtex.parser
 
-    for filename in filenames:
-        db_doi = parser_doi.parse_file(filename)
+    with profiling.phase("parse_import") as p:
+        parser_doi = mybibtex.parser.Parser()
+        parser_doi.parse_file("db/abbrev0.bib")
+        db_doi = parser_doi.parse_file("db/crypto_conf_list.bib")
 
-    parser = mybibtex.parser.Parser()
-    parser.parse_file("db/abbrev0.bib")
-    parser.parse_file("db/crypto_db.bib")
-    db = parser.parse_file("db/crypto_conf_list.bib")
+        for filename in filenames:
+            db_doi = parser_doi.parse_file(filename)
+        p["entries"] = len(db_doi.entries)
 
-    merge_doi_db(db, db_doi)
+    db = db_cache.load_db(abbrev_level=0)
+    index = confs_index.get_index(db)
 
-    conf_years = confs_years.get_confs_years_inter(db, confs_missing_years)
+    cache = expand_cache.ExpandCache() if use_expand_cache else None
+    with profiling.phase("merge") as p:
+        merge_doi_db(db, db_doi, cache)
+        p["entries"] = len(db_doi.entries)
+    if cache is not None:
+        logging.info("expand cache: {}".format(cache.get_stats()))
 
-    with open("db/crypto_db.bib", "w") as out:
-        out.write("% FILE GENERATED by add.py\n")
-        out.write("% DO NOT MODIFY MANUALLY\n")
-        out.write("\n")
-        out.write("\n")
-        for conf in sorted(conf_years.keys()):
-            (start, end) = conf_years[conf]
-            out.write("%    {}:{}{} - {}\n".format(conf, " " * (16 - len(conf) - 1), start, end))
-        out.write("\n")
-        out.write("\n")
-
-        mybibtex.generator.bibtex_gen(out, db)
+    # only DOI fields are modified: the index does not change
+    confs_index.write_crypto_db(db, index)
 
 
 def main():
     parser = argparse.ArgumentParser("Merge the DOI from the filenames imported files (using db_import/import.py). Verify pages and key are identical before merging the DOI. Useful to add DOI to papers already in CryptoBib.")
     parser.add_argument("filenames", metavar="file.bib", type=str, help="list of bib files to add to crypto_db.bib",
                         nargs="*")
+    parser.add_argument("--expand-cache", action="store_true", help="memoize the expansion of the fields")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiling.setup(args, "merge_doi.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
+    import backup_store
 
-    shutil.copy("db/crypto_db.bib", "db/crypto_db.bib.{:0>12d}".format(int(time.time())))
+    with profiling.phase("backup"):
+        backup_store.backup("db/crypto_db.bib")
 
-    merge_doi(args.filenames)
+    merge_doi(args.filenames, args.expand_cache)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+This script runs the release steps in a single process:
+  gen-abbrev     db/abbrev.bibyml -> db/abbrev?.bib                   (gen_abbrev.py)
+  add            imported files (--add) -> db/crypto_db.bib            (add.py)
+  gen            db/crypto_db.bib, ... -> db/crypto.bib, db/crypto_crossref.bib   (gen.py)
+  export-webapp  db/crypto_db.bib, db/changes.txt, ... -> storage.sqlite         (export_webapp_sqlite.py)
+
+Each step declares its input and output files.
+A step is skipped when the fingerprint of its inputs (and of the code implementing it) is the one
+recorded at its last successful run and its outputs were not modified since.
+The steps that run share the parsed database and the years of the conferences,
+which are only recomputed when a step changes them.
+
+This script needs to be run in the root folder containing the
+folders "lib" and "db"
+"""
+
+import sys
+import os
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(scriptdir, "..", "lib"))
+sys.path.append(os.path.join(scriptdir, "..", "db"))
+
+import argparse
+import hashlib
+import json
+import logging
+import time
+
+import confs_index
+import db_cache
+import profiling
+
+color_texts = {
+    "Error": "\x1b[6;30;41mError\x1b[0m",
+    "Warning": "\x1b[6;30;43mWarning\x1b[0m",
+    "Success": "\x1b[6;30;42mSuccess\x1b[0m",
+}
+
+#: file storing the fingerprints of the last successful run of each step
+state_filename = os.path.join(db_cache.cache_dir, "pipeline.json")
+
+#: bump this to force all the steps to run again
+PIPELINE_VERSION = 1
+
+
+def get_files_fingerprint(filenames):
+    """ Return a fingerprint of the content of `filenames` (a missing file has its own fingerprint) """
+    h = hashlib.sha256("v{}".format(PIPELINE_VERSION).encode())
+    for filename in filenames:
+        h.update(filename.encode())
+        try:
+            with open(filename, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        except FileNotFoundError:
+            h.update(b"missing")
+    return h.hexdigest()
+
+
+def read_state():
+    try:
+        with open(state_filename) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.warning("pipeline: corrupt state file {} ({}), ignoring it".format(state_filename, e))
+        return {}
+
+
+def write_state(state):
+    os.makedirs(os.path.dirname(state_filename), exist_ok=True)
+    tmp_filename = state_filename + ".tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_filename, state_filename)
+
+
+class Context(object):
+    """
+    State shared by the steps: the database parsed with abbrev0.bib and the years of the conferences,
+    both loaded on first use
+    """
+
+    def __init__(self):
+        self.db = None
+        self.confs_years = None
+
+    def get_db(self):
+        if self.db is None:
+            self.db = db_cache.load_db(abbrev_level=0)
+        return self.db
+
+    def get_confs_years(self):
+        if self.confs_years is None:
+            self.confs_years = confs_index.get_index(self.get_db()).get_confs_years(self.get_db())
+        return self.confs_years
+
+    def invalidate(self):
+        """ To be called when the files the database is parsed from changed """
+        self.db = None
+        self.confs_years = None
+
+
+class Step(object):
+    """
+    A step of the pipeline:
+      name     name of the step
+      inputs   files read by the step (including the modules implementing it)
+      outputs  files written by the step
+      run      function(ctx) running the step
+    """
+
+    def __init__(self, name, inputs, outputs, run):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+
+
+def run_gen_abbrev(ctx):
+    import gen_abbrev
+    gen_abbrev.gen_abbrev()
+    # the database is parsed with the macros of abbrev0.bib
+    ctx.invalidate()
+
+
+def run_add(filenames):
+    def run(ctx):
+        import add
+        import backup_store
+        backup_store.backup("db/crypto_db.bib")
+        ctx.db = add.add(filenames, ctx.get_db())
+        ctx.confs_years = None
+    return run
+
+
+def run_gen(full):
+    def run(ctx):
+        import gen
+        gen.gen_crypto_bibs(ctx.get_db(), ctx.get_confs_years(), full)
+    return run
+
+
+def run_export_webapp(storage):
+    def run(ctx):
+        import export_webapp_sqlite
+        export_webapp_sqlite.export(storage, ctx.get_db(), ctx.get_confs_years())
+    return run
+
+
+def get_module_file(name):
+    return os.path.join(scriptdir, "{}.py".format(name))
+
+
+def get_steps(args):
+    """ Return the steps of the pipeline, in an order compatible with their inputs and outputs """
+    # code shared by the steps reading the database: the modules of db_tools, of the db folder and all of mybibtex
+    code = [get_module_file(name) for name in ["db_cache", "confs_index", "expand_cache"]] + [
+        filename
+        for name in ["config", "header", "confs_years", "mybibtex"]
+        for filename in db_cache.get_source_files(name)
+    ]
+    db_files = ["db/abbrev0.bib", "db/crypto_db.bib", "db/crypto_conf_list.bib"]
+
+    steps = [
+        Step(
+            "gen-abbrev",
+            ["db/abbrev.bibyml", get_module_file("gen_abbrev"), get_module_file("abbrev_table")],
+            ["db/abbrev{}.bib".format(short) for short in range(4)],
+            run_gen_abbrev
+        ),
+    ]
+    if args.add:
+        steps.append(Step(
+            "add",
+            list(args.add) + db_files + code + [get_module_file("add")],
+            ["db/crypto_db.bib"],
+            run_add(args.add)
+        ))
+    steps.append(Step(
+        "gen",
+        db_files + ["db/crypto_misc.bib"] + code + [get_module_file("gen"), get_module_file("crossref_index")],
+        ["db/crypto.bib", "db/crypto_crossref.bib"],
+        run_gen(args.full)
+    ))
+    if not args.no_webapp:
+        steps.append(Step(
+            "export-webapp",
+            db_files + ["db/changes.txt"] + code + [get_module_file("export_webapp_sqlite"), get_module_file("webapp_rows"), get_module_file("crossref_index")],
+            [args.storage],
+            run_export_webapp(args.storage)
+        ))
+
+    check_order(steps)
+    return steps
+
+
+def check_order(steps):
+    """ Raise a ValueError if a step reads a file written by a later step """
+    for (i, step) in enumerate(steps):
+        for later in steps[i+1:]:
+            common = set(step.inputs) & set(later.outputs)
+            if common:
+                raise ValueError("step {} reads {} written by the later step {}".format(step.name, ", ".join(sorted(common)), later.name))
+
+
+def run_pipeline(steps, force=False):
+    """ Run the steps that are not up to date and return the list of (step name, status, seconds) """
+    state = read_state()
+    ctx = Context()
+    summary = []
+
+    for step in steps:
+        inputs_fingerprint = get_files_fingerprint(step.inputs)
+        previous = state.get(step.name)
+        if not force and previous is not None and \
+                previous["inputs"] == inputs_fingerprint and \
+                previous["outputs"] == get_files_fingerprint(step.outputs):
+            print("* {:<14} up to date, skipped".format(step.name))
+            summary.append((step.name, "skipped", 0.0))
+            continue
+
+        print("* {:<14} running".format(step.name))
+        start = time.perf_counter()
+        with profiling.phase(step.name):
+            step.run(ctx)
+        elapsed = time.perf_counter() - start
+        summary.append((step.name, "ran", elapsed))
+
+        # the inputs are fingerprinted again, as a step can write some of its inputs (e.g., add)
+        state[step.name] = {
+            "inputs": get_files_fingerprint(step.inputs),
+            "outputs": get_files_fingerprint(step.outputs),
+        }
+        write_state(state)
+
+    return summary
+
+
+def print_summary(summary, total):
+    print("")
+    print("{:<16} {:<8} {:>9}".format("step", "status", "time (s)"))
+    for (name, status, elapsed) in summary:
+        print("{:<16} {:<8} {:9.2f}".format(name, status, elapsed))
+    print("{:<16} {:<8} {:9.2f}".format("total", "", total))
+
+
+def main():
+    parser = argparse.ArgumentParser("Run the release steps (gen-abbrev, add, gen, export-webapp) in a single process, skipping the up-to-date ones")
+    parser.add_argument("--add", metavar="file.bib", nargs="+", help="bib files to add to crypto_db.bib (add step)")
+    parser.add_argument("--force", action="store_true", help="run all the steps, even the up-to-date ones")
+    parser.add_argument("--full", action="store_true", help="gen step: format all the entries again (see gen.py --full)")
+    parser.add_argument("--no-webapp", action="store_true", help="do not update the database of the web server")
+    parser.add_argument("--storage", default="web2py/applications/cryptobib/databases/storage.sqlite",
+                        help="SQLite database of the web server")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "pipeline.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
+
+    start = time.perf_counter()
+    try:
+        summary = run_pipeline(get_steps(args), args.force)
+    except ValueError as e:
+        logging.error("Error: {}".format(e))
+        sys.exit(1)
+    print_summary(summary, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
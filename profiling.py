@@ -0,0 +1,154 @@
+"""
+Instrumentation shared by the scripts: --profile records, per named phase,
+the wall time, the CPU time, the peak memory (with tracemalloc) and a number of entries,
+and writes them as a JSON report when the script exits.
+Optionally, one phase can be profiled with cProfile.
+
+Usage in a script:
+
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "gen.py")
+    ...
+    with profiling.phase("sort") as p:
+        entries = ...
+        p["entries"] = len(entries)
+
+Phases can be nested: the name of a nested phase is prefixed by the name of its parent ("gen/format").
+When --profile is not given, phases cost (almost) nothing, and the modules used to measure them
+(tracemalloc, cProfile...) are not imported.
+"""
+
+import atexit
+import contextlib
+import os
+import sys
+import time
+
+
+class Profiler(object):
+    def __init__(self, enabled=False, script=None, output=None, memory=True, cprofile_phase=None, cprofile_output=None):
+        self.enabled = enabled
+        self.script = script
+        self.output = output
+        self.memory = memory
+        self.cprofile_phase = cprofile_phase
+        self.cprofile_output = cprofile_output
+        self.phases = []
+        self.stack = []
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Measure the phase `name`; the yielded dictionary can be used to record e.g. "entries" """
+        record = {}
+        if not self.enabled:
+            yield record
+            return
+
+        import cProfile
+        import tracemalloc
+
+        if self.stack:
+            name = self.stack[-1]["name"] + "/" + name
+        record["name"] = name
+
+        if self.memory:
+            if self.stack:
+                # the peak of the parent so far must not be lost by the reset
+                self.stack[-1]["peak_mem"] = max(self.stack[-1]["peak_mem"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            record["peak_mem"] = 0
+
+        prof = None
+        if name == self.cprofile_phase:
+            prof = cProfile.Profile()
+            prof.enable()
+
+        self.stack.append(record)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        record["start"] = wall - self.start_wall
+        try:
+            yield record
+        finally:
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            if prof is not None:
+                prof.disable()
+                prof.dump_stats(self.cprofile_output)
+            self.stack.pop()
+            if self.memory:
+                record["peak_mem"] = max(record["peak_mem"], tracemalloc.get_traced_memory()[1])
+                if self.stack:
+                    self.stack[-1]["peak_mem"] = max(self.stack[-1]["peak_mem"], record["peak_mem"])
+            self.phases.append(record)
+
+    def get_report(self):
+        import platform
+
+        return {
+            "script": self.script,
+            "argv": sys.argv[1:],
+            "time": int(time.time()),
+            "python": platform.python_version(),
+            "wall": time.perf_counter() - self.start_wall,
+            "cpu": time.process_time() - self.start_cpu,
+            "phases": sorted(self.phases, key=lambda record: record["start"]),
+        }
+
+    def write_report(self):
+        if not self.enabled:
+            return
+        import json
+
+        with open(self.output, "w") as out:
+            json.dump(self.get_report(), out, indent=2)
+            out.write("\n")
+        print("profile written to {}".format(self.output), file=sys.stderr)
+
+
+#: profiler used by `phase`, disabled until `setup` is called with --profile
+profiler = Profiler()
+
+
+def phase(name):
+    """ Measure the phase `name` with the current profiler """
+    return profiler.phase(name)
+
+
+def add_arguments(parser):
+    """ Add the profiling arguments to the argparse parser `parser` """
+    parser.add_argument("--profile", nargs="?", const="", metavar="report.json",
+                        help="record the time, CPU time, peak memory and entries of each phase in a JSON report "
+                             "(default: profile_<script>.json)")
+    parser.add_argument("--profile-no-memory", action="store_true",
+                        help="with --profile, do not measure the peak memory (tracemalloc slows down the run)")
+    parser.add_argument("--profile-phase", metavar="phase",
+                        help="with --profile, also profile the given phase with cProfile")
+    parser.add_argument("--profile-cprofile", metavar="file.prof",
+                        help="output of --profile-phase (default: profile_<script>_<phase>.prof)")
+
+
+def setup(args, script):
+    """ Enable the profiler according to the arguments `args` of the script `script` """
+    global profiler
+
+    if args.profile is None:
+        return
+
+    name = os.path.splitext(os.path.basename(script))[0]
+    output = args.profile if args.profile else "profile_{}.json".format(name)
+    cprofile_output = args.profile_cprofile
+    if args.profile_phase is not None and cprofile_output is None:
+        cprofile_output = "profile_{}_{}.prof".format(name, args.profile_phase.replace("/", "_"))
+
+    profiler = Profiler(
+        enabled=True, script=script, output=output, memory=not args.profile_no_memory,
+        cprofile_phase=args.profile_phase, cprofile_output=cprofile_output
+    )
+    if profiler.memory:
+        import tracemalloc
+        tracemalloc.start()
+    atexit.register(profiler.write_report)
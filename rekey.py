@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Rename keys of db/crypto_db.bib in bulk.
+
+The renames come either from a mapping file (one "old_key new_key" per line, "#" starts a comment)
+or from a regular expression applied to the keys (optionally only for papers whose field contains a string).
+All the renames are applied at once (so that a <-> b swaps are possible).
+Nothing is written if any rename is invalid: unknown key, key that is not a paper of crypto_db.bib,
+invalid new key, or new key colliding with an existing key or with another new key.
+
+Only the papers of crypto_db.bib can be renamed. No entry references a paper (crossref fields reference
+books), so no other entry has to be updated. The books are in crypto_conf_list.bib, which these scripts
+do not write.
+
+This script needs to be run in the root folder containing the
+folders "lib" and "db"
+"""
+
+import sys
+import os
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(scriptdir, "..", "lib"))
+sys.path.append(os.path.join(scriptdir, "..", "db"))
+
+import argparse
+import collections
+import json
+import logging
+import re
+
+import confs_index
+import db_cache
+import profiling
+
+color_texts = {
+    "Error": "\x1b[6;30;41mError\x1b[0m",
+    "Warning": "\x1b[6;30;43mWarning\x1b[0m",
+    "Success": "\x1b[6;30;42mSuccess\x1b[0m",
+}
+
+def read_mapping(filename):
+    """ Return the list of (old key, new key) (as strings) of the mapping file `filename` """
+    mapping = []
+    with open(filename) as f:
+        for (lineno, line) in enumerate(f, 1):
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            a = line.split()
+            if len(a) != 2:
+                raise ValueError("{}:{}: expected \"old_key new_key\"".format(filename, lineno))
+            mapping.append((a[0], a[1]))
+    return mapping
+
+
+def get_pattern_mapping(db, pattern, replacement, condition=None):
+    """
+    Return the list of (old key, new key) (as strings) obtained by replacing `pattern` (a regular expression)
+    by `replacement` in the keys of the papers of `db` for which condition(entry) is true (all if None)
+    """
+    import mybibtex.generator
+
+    regex = re.compile(pattern)
+    mapping = []
+    for (key, entry) in mybibtex.generator.FilterPaper().filter(db.entries):
+        if condition is not None and not condition(entry):
+            continue
+        old = str(key)
+        new = regex.sub(replacement, old)
+        if new != old:
+            mapping.append((old, new))
+    return mapping
+
+
+def get_field_condition(field_contains):
+    """ Return the condition of a "field=substring" argument: `field` of the entry contains `substring` """
+    (field, substring) = field_contains.split("=", 1)
+    return lambda entry: field in entry.fields and substring in entry.fields[field].expand()
+
+
+def check_renames(db, mapping):
+    """
+    Check the list of (old key, new key) `mapping`.
+    Return (renames, errors) where renames is an OrderedDict old EntryKey -> new EntryKey and errors a list of messages.
+    """
+    import mybibtex.generator
+    from mybibtex.database import EntryKey
+
+    papers = set(key for (key, entry) in mybibtex.generator.FilterPaper().filter(db.entries))
+    renames = collections.OrderedDict()
+    errors = []
+    sources = {}
+
+    for (old_s, new_s) in mapping:
+        try:
+            old = EntryKey.from_string(old_s)
+        except Exception:
+            errors.append("invalid key {}".format(old_s))
+            continue
+        try:
+            new = EntryKey.from_string(new_s)
+        except Exception:
+            errors.append("{}: invalid new key {}".format(old_s, new_s))
+            continue
+        if old in renames:
+            errors.append("{} is renamed twice".format(old_s))
+            continue
+        if old not in db.entries:
+            errors.append("{}: no such entry".format(old_s))
+            continue
+        if old not in papers:
+            errors.append("{}: not a paper of crypto_db.bib (books cannot be renamed)".format(old_s))
+            continue
+        if new in sources:
+            errors.append("{} and {} are both renamed to {}".format(sources[new], old_s, new_s))
+            continue
+        sources[new] = old_s
+        renames[old] = new
+
+    # a new key may only be an existing key if that key is renamed too
+    for (old, new) in renames.items():
+        if new != old and new in db.entries and new not in renames:
+            errors.append("{}: new key {} already exists".format(old, new))
+
+    return (renames, errors)
+
+
+def get_report(renames):
+    """ Return the report of `renames`: a list of {"old", "new"} """
+    return [{"old": str(old), "new": str(new)} for (old, new) in renames.items()]
+
+
+def apply_renames(db, renames):
+    """
+    Return (new database, report) where the new database contains the entries of `db`
+    (shared with `db`) with the keys renamed according to `renames`
+    """
+    from mybibtex.database import BibliographyData
+
+    new_db = BibliographyData()
+    for (key, entry) in db.entries.items():
+        new_db.add_entry(renames.get(key, key), entry)
+    return (new_db, get_report(renames))
+
+
+def rekey(db, mapping, dry_run=False):
+    """
+    Apply the renames `mapping` (list of (old key, new key) as strings) to `db` and write db/crypto_db.bib.
+    Return (report, errors): if there are errors or if `dry_run`, nothing is modified nor written.
+    """
+    with profiling.phase("check") as p:
+        (renames, errors) = check_renames(db, mapping)
+        p["entries"] = len(renames)
+    if errors:
+        return ([], errors)
+
+    if dry_run:
+        return (get_report(renames), [])
+    with profiling.phase("rename"):
+        (new_db, report) = apply_renames(db, renames)
+
+    if renames:
+        index = confs_index.get_index(db)
+        for (old, new) in renames.items():
+            # add first: renaming a paper within its conference and year does not empty its year
+            index.add(new, new_db.entries[new])
+            index.remove(old)
+        import backup_store
+
+        with profiling.phase("backup"):
+            backup_store.backup("db/crypto_db.bib")
+        confs_index.write_crypto_db(new_db, index)
+    return (report, [])
+
+
+def main():
+    parser = argparse.ArgumentParser("Rename papers of db/crypto_db.bib in bulk")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--mapping", metavar="file", help="file with one \"old_key new_key\" per line")
+    group.add_argument("--pattern", metavar="regex", help="regular expression replaced in the keys (with --replace)")
+    parser.add_argument("--replace", metavar="replacement", help="replacement of --pattern (re.sub syntax)")
+    parser.add_argument("--if-field", metavar="field=substring",
+                        help="with --pattern, only rename the papers whose field contains substring (e.g., author=shelat)")
+    parser.add_argument("--dry-run", action="store_true", help="check and report the renames without writing anything")
+    parser.add_argument("--report", metavar="report.json", help="write the rename report in this JSON file")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "rekey.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
+
+    if args.pattern is not None and args.replace is None:
+        parser.error("--pattern requires --replace")
+
+    db = db_cache.load_db(abbrev_level=0)
+
+    try:
+        if args.mapping is not None:
+            mapping = read_mapping(args.mapping)
+        else:
+            condition = get_field_condition(args.if_field) if args.if_field is not None else None
+            mapping = get_pattern_mapping(db, args.pattern, args.replace, condition)
+    except ValueError as e:
+        logging.error("Error: {}".format(e))
+        sys.exit(1)
+
+    (report, errors) = rekey(db, mapping, args.dry_run)
+    if errors:
+        for error in errors:
+            print("{}: {}".format(color_texts["Error"], error))
+        print("")
+        print("{} errors, nothing written".format(len(errors)))
+        sys.exit(1)
+
+    for r in report:
+        print("{:<24} -> {}".format(r["old"], r["new"]))
+    print("")
+    print("{} keys renamed{}".format(len(report), " (dry run, nothing written)" if args.dry_run else ""))
+
+    if args.report is not None:
+        with open(args.report, "w") as out:
+            json.dump(report, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,21 +12,14 @@ scriptdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(scriptdir, "..", "lib"))
 sys.path.append(os.path.join(scriptdir, "..", "db"))
 
-import mybibtex.parser
-import mybibtex.database
-import mybibtex.generator
-import confs_years
+import crossref_index
+import db_cache
+import expand_cache
+import profiling
+from expand_cache import expand
 
 import logging
-import shutil
 import argparse
-import time
-
-import config
-from config import *
-
-mybibtex.generator.config = config
-logging.basicConfig(level=logging.DEBUG)
 
 color_texts = {
     "Error": "\x1b[6;30;41mError\x1b[0m",
@@ -45,7 +38,7 @@ def filter_doi(entries):
     return [entry for entry in entries if "doi" in entry.fields]
 
 
-def check_doi_lncs_book(book, entries, verbose=False):
+def check_doi_lncs_book(book, entries, verbose=False, cache=None):
     """ Check the DOI of a Springer book are consistent
      @param entries list of entries of `book` with a DOI """
 
@@ -53,9 +46,9 @@ def check_doi_lncs_book(book, entries, verbose=False):
         return
 
     doi_prefix = [
-        "_".join(entry.fields["doi"].expand().split("_")[:-1])
+        "_".join(expand(entry, "doi", cache).split("_")[:-1])
         for entry in entries
-        if entry.fields["doi"].expand() != "10.1007/10931455_18" # there is an exception for this DOI CHES:CheJoyPai03
+        if expand(entry, "doi", cache) != "10.1007/10931455_18" # there is an exception for this DOI CHES:CheJoyPai03
     ]
 
     ok = check_all_elements_equal(doi_prefix)
@@ -68,26 +61,30 @@ def check_doi_lncs_book(book, entries, verbose=False):
         print("{} (list of prefixes: {} for {} entries with DOI)".format(color_texts["Error"], " ".join(list(set(doi_prefix))), len(entries)))
 
 
-def is_lncs(db, entry):
-    fields = db.entries[mybibtex.database.EntryKey.from_string(entry.fields["crossref"].expand())].fields
-    return "series" in fields and fields["series"].expand() == "{LNCS}"
+def is_lncs_book(book, cache=None):
+    return "series" in book.fields and expand(book, "series", cache) == "{LNCS}"
 
 
 def check_doi(args):
-    parser = mybibtex.parser.Parser()
-    parser.parse_file("db/abbrev3.bib")
-    parser.parse_file("db/crypto_db.bib")
-    db = parser.parse_file("db/crypto_conf_list.bib")
+    import mybibtex.generator
+
+    db = db_cache.load_db(abbrev_level=3)
 
     myfilter = mybibtex.generator.FilterPaper()
     filter_conf = args.filter
     if filter_conf:
         myfilter = mybibtex.generator.FilterConf(filter_conf, myfilter)
     entries = dict(myfilter.filter(db.entries))
+    cache = expand_cache.ExpandCache() if args.expand_cache else None
 
     entries_per_book = collections.OrderedDict()
 
-    for (keybib, entry) in mybibtex.generator.SortConfYearPage().sort(iter(entries.items())):
+    with profiling.phase("sort") as p:
+        sorted_entries = list(mybibtex.generator.SortConfYearPage().sort(iter(entries.items())))
+        p["entries"] = len(sorted_entries)
+    index = crossref_index.CrossrefIndex(db, cache, papers=sorted_entries)
+
+    for (keybib, entry) in sorted_entries:
         key = str(keybib)
 
         if key.startswith("EPRINT"):
@@ -96,7 +93,10 @@ def check_doi(args):
         if "crossref" not in entry.fields:
             continue
 
-        book = entry.fields["crossref"].expand()
+        book = index.book_of.get(keybib)
+        if book is None:
+            print("{}: entry {} has a dangling crossref {}".format(color_texts["Error"], key, expand(entry, "crossref", cache)))
+            continue
         if book not in entries_per_book:
             entries_per_book[book] = [entry]
         else:
@@ -104,29 +104,39 @@ def check_doi(args):
 
     nb = 0
     nb_checked = 0
-    for (book, entries) in entries_per_book.items():
-        nb += 1
-        if is_lncs(db, entries[0]):
-            check_doi_lncs_book(book, filter_doi(entries), args.verbose)
-            nb_checked += 1
-
-        dois = ["doi" in entry.fields for entry in entries]
-        if dois.count(True) != len(dois):
-            print("{}: book {:<10} has only {:2d} entries with DOI out of {}".format(color_texts["Warning"], book, dois.count(True), len(dois)))
-        elif args.verbose:
-            print("{}: book {:<10} has all {:2d} entries with DOI".format(color_texts["Success"], book, len(dois)))
+    with profiling.phase("check") as p:
+        p["entries"] = len(entries_per_book)
+        for (book, entries) in entries_per_book.items():
+            nb += 1
+            if is_lncs_book(db.entries[book], cache):
+                check_doi_lncs_book(str(book), filter_doi(entries), args.verbose, cache)
+                nb_checked += 1
+
+            dois = ["doi" in entry.fields for entry in entries]
+            if dois.count(True) != len(dois):
+                print("{}: book {:<10} has only {:2d} entries with DOI out of {}".format(color_texts["Warning"], str(book), dois.count(True), len(dois)))
+            elif args.verbose:
+                print("{}: book {:<10} has all {:2d} entries with DOI".format(color_texts["Success"], str(book), len(dois)))
 
     print("")
     print("{} out of {} books checked".format(nb_checked, nb))
+    if cache is not None:
+        logging.info("expand cache: {}".format(cache.get_stats()))
 
 
 def main():
     parser = argparse.ArgumentParser("Does some sanity checks for DOI (e.g., that first part of Springer DOI is the same for each book")
     parser.add_argument("--filter", help="filter a specific conference")
     parser.add_argument("--verbose", action="store_true", help="display also successful checks")
+    parser.add_argument("--expand-cache", action="store_true", help="memoize the expansion of the fields")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiling.setup(args, "sanity_checks_doi.py")
 
-    shutil.copy("db/crypto_db.bib", "db/crypto_db.bib.{:0>12d}".format(int(time.time())))
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
 
     check_doi(args)
 
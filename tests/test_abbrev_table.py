@@ -0,0 +1,35 @@
+"""
+Tests of the compilation of the bibyml tree in abbrev_table.py
+"""
+
+import os
+import sys
+
+import pytest
+
+testdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(testdir, ".."))
+
+import abbrev_table
+
+
+def test_levels():
+    table = abbrev_table.AbbrevTable({
+        "C": {"": "CRYPTO", "@3": {"": "Crypto"}},
+        "EC": {"@0": {"": "EUROCRYPT"}, "@1": {"": "EC"}},
+    })
+    assert table.macros(0) == {"C": "CRYPTO", "EC": "EUROCRYPT"}
+    assert table.macros(1) == {"C": "CRYPTO", "EC": "EC"}
+    assert table.macros(3) == {"C": "Crypto", "EC": "EC"}
+    assert table.errors() == []
+
+
+def test_intermediate_node_named_as_macro():
+    # "a" > "bc" has no value: only "abcx" and "abc" are macros
+    table = abbrev_table.AbbrevTable({"a": {"bc": {"x": {"": "X"}}}, "ab": {"c": {"": "Y"}}})
+    assert list(table.items()) == [("abcx", "X"), ("abc", "Y")]
+
+
+def test_duplicate_macro():
+    with pytest.raises(ValueError, match="'abc' is defined twice"):
+        abbrev_table.AbbrevTable({"ab": {"c": {"": "X"}}, "a": {"bc": {"": "Y"}}})
@@ -0,0 +1,63 @@
+"""
+Tests of backup_store.py
+"""
+
+import os
+import sys
+import time
+
+testdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(testdir, ".."))
+
+import backup_store
+
+#: maximal time of the backup of a 16 MB file: it runs at the start of every script modifying crypto_db.bib
+max_backup_seconds = 3.0
+
+
+def write_bib(filename, nb_entries):
+    with open(filename, "w") as f:
+        for i in range(nb_entries):
+            f.write("@InProceedings{{C{}:Aut{}{:02d},\n  author = \"Author {} and Other {}\",\n"
+                    "  title = \"{{Title}} number {} of a synthetic paper about {} things\",\n"
+                    "  pages = \"{}--{}\",\n  crossref = \"C{}\",\n}}\n\n".format(
+                        i % 40, i, i % 100, i * 7 % 1013, i * 13 % 997, i, i * 31 % 4099, i % 500, i % 500 + 20, i % 40))
+
+
+def test_backup_restore(tmp_path):
+    filename = str(tmp_path / "crypto_db.bib")
+    store = backup_store.BackupStore(str(tmp_path / "backups"), keep_last=2, keep_daily=0)
+
+    write_bib(filename, 10)
+    with open(filename, "rb") as f:
+        first = f.read()
+    snapshot = store.backup(filename)
+    assert snapshot is not None
+    # unchanged content: no new snapshot
+    assert store.backup(filename) is None
+
+    for nb_entries in [20, 30]:
+        write_bib(filename, nb_entries)
+        store.backup(filename)
+    # keep_last = 2: the first snapshot and its object are removed
+    assert len(store.read_index()) == 2
+    assert store.find(snapshot["sha256"]) is None
+    assert len(os.listdir(store.objects_dir)) == 2
+
+    latest = store.find()
+    with open(filename, "rb") as f:
+        assert store.read(latest) == f.read()
+    assert len(first) < latest["size"]
+
+
+def test_backup_time(tmp_path):
+    filename = str(tmp_path / "crypto_db.bib")
+    write_bib(filename, 100000)
+    assert os.path.getsize(filename) > 16 * 1024 * 1024
+
+    store = backup_store.BackupStore(str(tmp_path / "backups"))
+    start = time.perf_counter()
+    snapshot = store.backup(filename)
+    elapsed = time.perf_counter() - start
+    assert snapshot is not None
+    assert elapsed < max_backup_seconds, "backup of {} bytes took {:.1f} s".format(snapshot["size"], elapsed)
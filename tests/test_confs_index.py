@@ -0,0 +1,72 @@
+"""
+Tests of the incremental updates of confs_index.ConfsIndex against a full build
+"""
+
+import os
+import sys
+
+import pytest
+
+testdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(testdir, ".."))
+
+import confs_index
+
+
+@pytest.fixture
+def parse(tmp_path):
+    """ Return a function parsing a database made of the papers with the given keys """
+    parser = pytest.importorskip("mybibtex.parser")
+    pytest.importorskip("confs_years")
+    config = pytest.importorskip("config")
+    import mybibtex.generator
+    mybibtex.generator.config = config
+
+    def parse_keys(keys):
+        filename = str(tmp_path / "crypto_db.bib")
+        with open(filename, "w") as f:
+            for key in keys:
+                f.write("@InProceedings{{{},\n  author = \"Alice Smith\",\n  title = \"Paper {}\",\n}}\n\n".format(key, key))
+        return parser.Parser().parse_file(filename)
+
+    return parse_keys
+
+
+def assert_same_years(index, full):
+    assert not index.stale_years
+    mine = {conf: tuple(int(y) for y in r) for (conf, r) in index.get_confs_years().items()}
+    theirs = {conf: tuple(int(y) for y in r) for (conf, r) in full.confs_years.items()}
+    assert mine == theirs
+
+
+def test_add_new_conference(parse):
+    keys = ["C19:Smi19", "C20:Smi20"]
+    index = confs_index.ConfsIndex.build(parse(keys))
+
+    new_keys = ["EC21:Smi21", "C22:Smi22"]
+    db = parse(keys + new_keys)
+    for (key, entry) in db.entries.items():
+        if str(key) in new_keys:
+            index.add(key, entry)
+
+    # the range of the new conference is computed without marking the ranges stale
+    full = confs_index.ConfsIndex.build(db)
+    assert_same_years(index, full)
+    assert index.verify(db) == []
+
+
+def test_remove(parse):
+    keys = ["C19:Smi19", "C20:Smi20", "C20:Jon20", "C21:Smi21"]
+    db = parse(keys)
+    index = confs_index.ConfsIndex.build(db)
+    papers = {str(key): key for key in db.entries}
+
+    # the range does not shrink: still up to date
+    index.remove(papers["C20:Jon20"])
+    assert not index.stale_years
+    # the last paper of the end year: the range shrinks
+    index.remove(papers["C21:Smi21"])
+    assert index.stale_years
+
+    db = parse(["C19:Smi19", "C20:Smi20"])
+    assert index.verify(db) == []
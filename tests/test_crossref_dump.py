@@ -0,0 +1,123 @@
+"""
+Tests of crossref_dump.py on the small dump tests/fixtures/crossref_dump.jsonl,
+and of the functions of add_doi_crossref.py reading the authors that it shares
+"""
+
+import gzip
+import os
+import shutil
+import sys
+
+import pytest
+
+testdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(testdir, ".."))
+
+import add_doi_crossref
+import crossref_dump
+
+dump_filename = os.path.join(testdir, "fixtures", "crossref_dump.jsonl")
+
+
+class Value(object):
+    def __init__(self, s):
+        self.s = s
+
+    def expand(self):
+        return self.s
+
+
+class Person(object):
+    def __init__(self, last):
+        self.last = last
+
+    def get_part_as_text(self, part):
+        return self.last if part == "last" else ""
+
+
+class Entry(object):
+    """ Entry with the fields used by crossref_dump; `persons` is a list of last names (parsed authors) """
+
+    def __init__(self, persons=None, **fields):
+        self.fields = {field: Value(value) for (field, value) in fields.items()}
+        self.persons = {"author": [Person(last) for last in persons]} if persons is not None else {}
+
+
+def test_read_items():
+    dois = [item.get("DOI") for item in crossref_dump.read_items(dump_filename)]
+    # the invalid line and the empty line are skipped, the "items" and "message" lines are flattened
+    assert dois == [
+        "10.1007/978-3-030-56880-1_1",
+        "10.1007/978-3-030-45721-1_2",
+        "10.1007/978-3-030-45721-1_3",
+        "10.1145/3372297.3417000",
+        None,
+    ]
+
+
+def test_read_items_gzip(tmp_path):
+    filename = str(tmp_path / "crossref_dump.jsonl.gz")
+    with open(dump_filename, "rb") as f, gzip.open(filename, "wb") as out:
+        shutil.copyfileobj(f, out)
+    assert list(crossref_dump.read_items(filename)) == list(crossref_dump.read_items(dump_filename))
+
+
+def test_choose_doi():
+    assert crossref_dump.choose_doi([("10.1/a", 0.2), ("10.1/b", 0.8)]) == "10.1/b"
+    # the same DOI found twice counts once, with its best similarity
+    assert crossref_dump.choose_doi([("10.1/a", 0.2), ("10.1/a", 0.9), ("10.1/b", 0.8)]) == "10.1/a"
+    # tie: ambiguous
+    assert crossref_dump.choose_doi([("10.1/a", 0.5), ("10.1/b", 0.5)]) is None
+    # DOI are case-insensitive: the DOI is returned as first written
+    assert crossref_dump.choose_doi([("10.1/ABC", 0.2), ("10.1/abc", 0.9), ("10.1/b", 0.8)]) == "10.1/ABC"
+
+
+def test_match_dump():
+    entries = [
+        ("C20:SmiJon20", Entry(["Smith", "Jones"], title="Lattice Signatures Revisited",
+                               booktitle="Advances in Cryptology - {CRYPTO} 2020")),
+        # first author written differently: found through the words of the title
+        ("CCS20:AndRoe20", Entry(["Andrew", "Roe"], title="Fast Oblivious Transfer", booktitle="ACM CCS 2020")),
+        ("C20:Nobody20", Entry(["Nobody"], title="Nothing Like This", booktitle="Advances in Cryptology - {CRYPTO} 2020")),
+    ]
+    index = crossref_dump.PaperIndex(entries)
+    (matches, nb_items) = crossref_dump.match_dump(index, [dump_filename])
+    assert nb_items == 5
+    assert sorted(matches) == [0, 1]
+    # the CRYPTO and EUROCRYPT works both match the first paper, the container title decides
+    assert crossref_dump.choose_doi(matches[0]) == "10.1007/978-3-030-56880-1_1"
+    assert crossref_dump.choose_doi(matches[1]) == "10.1145/3372297.3417000"
+
+    (matches, nb_items) = crossref_dump.match_dump(index, [dump_filename], doi_prefixes=["10.1145/"])
+    assert sorted(matches) == [1]
+
+
+def test_match_dump_doi_case(tmp_path):
+    filename = str(tmp_path / "crossref_dump.jsonl")
+    with open(filename, "w") as f:
+        f.write('{"DOI": "10.1145/ABC.123", "title": ["Fast Oblivious Transfer"], '
+                '"author": [{"family": "Andrew"}, {"family": "Roe"}], "container-title": ["ACM CCS 2020"]}\n')
+    index = crossref_dump.PaperIndex([("CCS20:AndRoe20", Entry(["Andrew", "Roe"], title="Fast Oblivious Transfer"))])
+    (matches, nb_items) = crossref_dump.match_dump(index, [filename])
+    # the DOI is stored as written in the dump
+    assert crossref_dump.choose_doi(matches[0]) == "10.1145/ABC.123"
+
+
+def test_first_author_last_name():
+    pytest.importorskip("pybtex")
+    entry = Entry(author="Alexander Smith and Bob Jones", title="Lattice Signatures Revisited")
+    assert crossref_dump.get_first_author_last_name(entry) == "smith"
+    assert crossref_dump.get_number_authors(entry) == 2
+    entry = Entry(author="Smith, Alexander and Jones, Bob", title="Lattice Signatures Revisited")
+    assert crossref_dump.get_first_author_last_name(entry) == "smith"
+
+
+def test_first_author():
+    pytest.importorskip("pybtex")
+    # "and" inside a name ("Alexander", "Sandra") does not separate two authors
+    entry = Entry(author="Alexander Smith and Sandra Jones", title="Lattice Signatures Revisited")
+    assert add_doi_crossref.get_first_author(entry) == "Alexander Smith"
+    assert add_doi_crossref.get_number_authors(entry) == 2
+    entry = Entry(title="Lattice Signatures Revisited")
+    assert add_doi_crossref.get_first_author(entry) == ""
+    assert add_doi_crossref.get_number_authors(entry) == 0
@@ -0,0 +1,66 @@
+"""
+Tests of the table writer of export_webapp_sqlite.py on a schema created as web2py does
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+testdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(testdir, ".."))
+
+import export_webapp_sqlite
+
+schema = [
+    'CREATE TABLE "conf"(id INTEGER PRIMARY KEY AUTOINCREMENT, "key" CHAR(512), "name" CHAR(512), '
+    '"start_year" INTEGER, "hidden" CHAR(1) NOT NULL DEFAULT \'F\');',
+    'CREATE INDEX "conf_key" ON "conf" ("key");',
+]
+
+rows = [
+    ("C", {"key": "C", "name": "Crypto", "start_year": 1981}),
+    ("EC", {"key": "EC", "name": "Eurocrypt", "start_year": 1982, "hidden": "T"}),
+]
+
+
+def create_db(filename, nb_rows=0):
+    conn = sqlite3.connect(filename, isolation_level=None)
+    for sql in schema:
+        conn.execute(sql)
+    for i in range(nb_rows):
+        conn.execute('INSERT INTO "conf" ("key", "name") VALUES (?, ?)', ("old{}".format(i), "old"))
+    return conn
+
+
+def test_write_table(tmp_path):
+    conn = create_db(str(tmp_path / "storage.sqlite"), nb_rows=5)
+    assert export_webapp_sqlite.write_table(conn, "conf", rows, batch_size=1) == 2
+
+    # the ids start again at 1, as after the truncate of the web2py DAL
+    assert conn.execute('SELECT id, "key", "hidden" FROM "conf" ORDER BY id').fetchall() == [(1, "C", "F"), (2, "EC", "T")]
+    assert conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'conf'").fetchall() == [(2,)]
+    # the index is recreated
+    assert conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'conf'").fetchall() == [("conf_key",)]
+
+
+def test_write_table_unknown_field(tmp_path):
+    conn = create_db(str(tmp_path / "storage.sqlite"))
+    with pytest.raises(ValueError):
+        export_webapp_sqlite.write_table(conn, "conf", [("C", {"key": "C", "unknown": 1})])
+
+
+def test_compare(tmp_path):
+    filenames = [str(tmp_path / "storage.sqlite"), str(tmp_path / "reference.sqlite")]
+    for (filename, nb_rows) in zip(filenames, [3, 7]):
+        conn = create_db(filename, nb_rows)
+        export_webapp_sqlite.write_table(conn, "conf", rows)
+        conn.close()
+    assert export_webapp_sqlite.compare(filenames[0], filenames[1], ["conf"]) == []
+
+    conn = sqlite3.connect(filenames[1], isolation_level=None)
+    conn.execute('UPDATE "conf" SET "name" = \'CRYPTO\' WHERE "key" = \'C\'')
+    conn.close()
+    differences = export_webapp_sqlite.compare(filenames[0], filenames[1], ["conf"])
+    assert len(differences) == 1 and "CRYPTO" in differences[0]
@@ -0,0 +1,124 @@
+"""
+Title similarity used to match papers with external metadata (e.g., Crossref results).
+
+Two titles are considered similar if the Levenshtein distance between their normalized versions
+is at most a small threshold. As only small distances matter, the distance is computed with a banded
+algorithm that exits as soon as the threshold is exceeded, after a length-difference prefilter.
+"""
+
+import functools
+import re
+import unicodedata
+
+#: default maximum distance for two titles to match
+# similarly to https://github.com/IACR/program-editor/blob/c1de208435c063d3f878d55dd2a6b0e8a4b31c21/scripts/editor.js#L1336
+default_max_distance = 4
+
+_re_tex_command = re.compile(r"\\[a-zA-Z]+\s*|\\.")
+_re_word = re.compile(r"[a-z0-9]+")
+_re_html_tag = re.compile(r"</?[a-zA-Z][^>]*>")
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def normalize_title(title):
+    """
+    Normalize a title for comparison:
+    remove TeX commands, accents, braces and HTML tags, lower case and collapse whitespace
+    """
+    title = _re_html_tag.sub("", title)
+    title = _re_tex_command.sub("", title)
+    title = title.replace("{", "").replace("}", "")
+    title = "".join(
+        c for c in unicodedata.normalize("NFKD", title)
+        if not unicodedata.combining(c)
+    )
+    return " ".join(title.lower().split())
+
+
+def title_words(title):
+    """ Return the set of words of the normalized `title` """
+    return frozenset(_re_word.findall(normalize_title(title)))
+
+
+def bounded_levenshtein(s1, s2, max_distance):
+    """
+    Return the Levenshtein distance between s1 and s2 if it is at most max_distance,
+    and max_distance + 1 otherwise.
+    Only the band of width 2 * max_distance + 1 around the diagonal is computed.
+    """
+    if s1 == s2:
+        return 0
+    if len(s1) > len(s2):
+        s1, s2 = s2, s1
+    big = max_distance + 1
+    if len(s2) - len(s1) > max_distance:
+        return big
+
+    # common prefix and suffix do not change the distance
+    start = 0
+    while start < len(s1) and s1[start] == s2[start]:
+        start += 1
+    end1, end2 = len(s1), len(s2)
+    while end1 > start and s1[end1 - 1] == s2[end2 - 1]:
+        end1 -= 1
+        end2 -= 1
+    s1 = s1[start:end1]
+    s2 = s2[start:end2]
+    n1, n2 = len(s1), len(s2)
+    if n1 == 0:
+        return n2 if n2 <= max_distance else big
+
+    prev = [j if j <= max_distance else big for j in range(n2 + 1)]
+    for i in range(1, n1 + 1):
+        c1 = s1[i - 1]
+        lo = max(1, i - max_distance)
+        hi = min(n2, i + max_distance)
+        cur = [big] * (n2 + 1)
+        cur[0] = i if i <= max_distance else big
+        row_min = cur[lo - 1]
+        for j in range(lo, hi + 1):
+            d = prev[j - 1] if c1 == s2[j - 1] else prev[j - 1] + 1
+            if prev[j] + 1 < d:
+                d = prev[j] + 1
+            if cur[j - 1] + 1 < d:
+                d = cur[j - 1] + 1
+            if d > big:
+                d = big
+            cur[j] = d
+            if d < row_min:
+                row_min = d
+        if row_min > max_distance:
+            return big
+        prev = cur
+    return prev[n2] if prev[n2] <= max_distance else big
+
+
+class TitleMatcher(object):
+    """ Score one title against many candidate titles """
+
+    def __init__(self, title, max_distance=default_max_distance):
+        self.title = normalize_title(title)
+        self.max_distance = max_distance
+
+    def distance(self, candidate):
+        """ Return the bounded distance (at most max_distance + 1) between the title and `candidate` """
+        return bounded_levenshtein(self.title, normalize_title(candidate), self.max_distance)
+
+    def distances(self, candidates):
+        """ Return the list of the bounded distances between the title and each of `candidates` """
+        return [self.distance(candidate) for candidate in candidates]
+
+    def best_distance(self, candidates):
+        """ Return the smallest bounded distance between the title and `candidates` (max_distance + 1 if none match) """
+        best = self.max_distance + 1
+        for candidate in candidates:
+            d = self.distance(candidate)
+            if d < best:
+                best = d
+                if best == 0:
+                    break
+        return best
+
+    def matches(self, candidates):
+        """ Return True if one of `candidates` is within max_distance of the title """
+        return self.best_distance(candidates) <= self.max_distance
@@ -25,165 +25,148 @@ sys.path.append(os.path.join(scriptdir, "..", "lib"))
 sys.path.append(os.path.join(scriptdir, "..", "db"))
 sys.path.append(os.path.join(scriptdir, "..", "web2py"))
 
-from mybibtex import tools
-import mybibtex.parser
-import mybibtex.generator
-from confs_years import *
-import config
-from config import *
-
-mybibtex.generator.config = config
-
+import argparse
 import logging
-import re
-import datetime
-
-logging.basicConfig(level=logging.DEBUG)
 
-os.chdir("web2py")
-import gluon.shell
-from gluon.storage import Storage
-
-_re_date = re.compile(r"^\s*(\d\d\d\d)-(\d\d)-(\d\d)\s*$")
+import confs_index
+import db_cache
+import export_webapp_sqlite
+import profiling
+import webapp_sync
+from webapp_rows import get_changes_rows, get_confs_rows, get_entries_rows
 
 
 def update_changes(db):
     """
     Store changes in the table "changes" of storage.sql
-
-    changes.txt has to be of the form:
-
-    * yyyy-mm-dd
-    description of change at ...
-
-    * yyyy-mm-dd
-    ...
+    (see webapp_rows.get_changes_rows for the format of changes.txt)
     """
-
-    changes = []
-
-    fin = open("../db/changes.txt")
-    lineno = 1
-    for line in fin:
-        if lineno == 1 and line[0] != "*":
-            logging.error("Error: the first line has to start by '*'")
-            sys.exit(1)
-        if line[0] == "*":
-            r = _re_date.match(line[1:])
-            if r == None:
-                logging.error("Error: invalid date on line {}. Date format is yyyy-mm-dd".format(lineno))
-                sys.exit(1)
-            (yy,mm,dd) = r.groups()
-            changes.append((datetime.date(int(yy),int(mm),int(dd)),""))
-        else:
-            (date_c, desc_c) = changes[-1]
-            desc_c = desc_c + line
-            changes[-1] = (date_c, desc_c)
-
-        lineno += 1
-    fin.close()
-
-    changes_bulk = [
-        {"date": date_c.strftime("%Y-%m-%d"), "desc": desc_c} 
-        for (date_c, desc_c) in changes
-    ]
+    changes_bulk = [row for (row_key, row) in get_changes_rows("../db/changes.txt")]
 
     db.change.truncate()
     db.change.bulk_insert(changes_bulk)
+    webapp_sync.reset_state(db, "change")
     db.commit()
 
 
 def update_confs(db, confs_years):
-    confs = [
-        {
-            "type":       conf["type"],
-            "key":        confkey,
-            "name":       conf["name"],
-            "full_name":  conf["full_name"],
-            "start_year": confs_years[confkey][0],
-            "end_year":   confs_years[confkey][1]
-        }
-        for (confkey, conf) in sorted(
-                iter(config.confs.items()),
-                key = lambda k_x: ("a-" if k_x[1]["type"] == "conf" else "b-") + k_x[1]["name"]
-        )
-    ]
+    confs = [row for (row_key, row) in get_confs_rows(confs_years)]
     db.conf.truncate()
     db.conf.bulk_insert(confs)
+    webapp_sync.reset_state(db, "conf")
     db.commit()
 
 
-def update_entries(db, cryptodb):
-    db.entry.truncate()
-
-    def aux(cryptodb, entries):
-        for key, entry in entries:
-            fields_orig = mybibtex.generator.bibtex_entry_format_fields(db, key, entry, expand_crossrefs=False)
-            fields = {k: v.to_bib(expand=False) for (k,v) in fields_orig.items()}
-
-            fields["type"] = entry.type.lower()
-            
-            fields["key_conf"] = key.confkey
-            fields["key_year"] = tools.short_to_full_year(key.year)
-            fields["key_auth"] = key.auth
-            fields["key_dis"]  = key.dis
-
-            start_page = None
-            end_page = None
-            if "pages" in fields:
-                pages = fields["pages"]
-                if pages.isdigit():
-                    start_page = pages
-                else:
-                    a = pages[1:-1].split("--")
-                    if len(a) == 1 or len(a) == 2:
-                        start_page = a[0]
-                    if len(a) == 2:
-                        end_page = a[1]
-
-            fields["start_page"] = start_page
-            fields["end_page"]   = end_page
-
-            if "years" in fields:
-                fields["years"] = int(fields["years"])
-
-            if "pages" in fields:
-                del fields["pages"]
-
-            if "crossref" in fields:
-                fields["crossref_expanded"] = fields_orig["crossref"].to_bib(expand=True)[1:-1] # expand and remove quotes
-
-            db.entry.insert(**fields)
-        db.commit()
-    
-    entries = dict(mybibtex.generator.FilterPaper().filter(cryptodb.entries))
-    aux(cryptodb, mybibtex.generator.SortConfYearPage().sort(iter(entries.items())))
-
-    crossrefs = dict()
-    for k, e in entries.items():
-        if "crossref" in e.fields:
-            crossref = mybibtex.generator.EntryKey.from_string(e.fields["crossref"].expand())
-            if crossref not in crossrefs:
-                crossrefs[crossref] = cryptodb.entries[crossref]
-    aux(cryptodb, mybibtex.generator.SortConfYearPage().sort(iter(crossrefs.items())))
+class BulkWriter(object):
+    """
+    Buffer rows and insert them in a table with bulk_insert, by batches of `batch_size` rows.
+    Nothing is committed: the caller commits once all the rows are written.
+    """
+
+    def __init__(self, table, batch_size=1000):
+        self.table = table
+        self.batch_size = batch_size
+        self.rows = []
+        self.nb_rows = 0
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.table.bulk_insert(self.rows)
+            self.nb_rows += len(self.rows)
+            self.rows = []
+
+
+def drop_indexes(db, tablename):
+    """
+    Drop the indexes of the table `tablename` and return the SQL statements to recreate them.
+    Only supported for SQLite: for other backends, nothing is done and [] is returned.
+    """
+    if db._dbname != "sqlite":
+        return []
+    return export_webapp_sqlite.drop_indexes(lambda sql, params: db.executesql(sql, placeholders=params), tablename)
+
+
+def update_entries(db, cryptodb, batch_size=1000):
+    """
+    Refill the table "entry" with bulk inserts of `batch_size` rows, in a single transaction
+    so that the web server never sees a partially filled table.
+    Indexes are dropped during the load and recreated afterwards (SQLite only).
+    """
+    # the dangling crossrefs are reported here, before the table is truncated
+    rows = get_entries_rows(cryptodb)
+    try:
+        db.entry.truncate()
+        indexes = drop_indexes(db, "entry")
+
+        writer = BulkWriter(db.entry, batch_size)
+        with profiling.phase("rows_and_inserts") as p:
+            for (row_key, row) in rows:
+                writer.write(row)
+            writer.flush()
+            p["entries"] = writer.nb_rows
+
+        for sql in indexes:
+            db.executesql(sql)
+        webapp_sync.reset_state(db, "entry")
+    except:
+        db.rollback()
+        raise
+    db.commit()
+    print("  {} entries written".format(writer.nb_rows))
 
 
 def main():
-    app = Storage(gluon.shell.env("cryptobib", import_models = True))
+    parser = argparse.ArgumentParser("Update the database of the web server")
+    parser.add_argument("--batch-size", type=int, default=1000, help="number of rows per bulk insert (default: 1000)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only write the rows that changed since the last incremental update")
+    parser.add_argument("--full", action="store_true",
+                        help="with --incremental, force a full rebuild of the tables and of the sync state")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.setup(args, "update_webapp_db.py")
+
+    logging.basicConfig(level=logging.DEBUG)
+    import config
+    import mybibtex.generator
+    mybibtex.generator.config = config
+
+    with profiling.phase("web2py_startup"):
+        os.chdir("web2py")
+        import gluon.shell
+        from gluon.storage import Storage
+        app = Storage(gluon.shell.env("cryptobib", import_models = True))
 
     print("* read crypto_db.bib")
-    parser = mybibtex.parser.Parser()
-    parser.parse_file("../db/abbrev0.bib")
-    parser.parse_file("../db/crypto_db.bib")
-    cryptodb = parser.parse_file("../db/crypto_conf_list.bib")
-    confs_years = get_confs_years_inter(cryptodb, confs_missing_years)
+    cryptodb = db_cache.load_db(abbrev_level=0, db_dir="../db")
+    confs_years = confs_index.get_index(cryptodb, db_dir="../db").get_confs_years(cryptodb)
+
+    if args.incremental:
+        print("* sync changes table")
+        with profiling.phase("db_changes"):
+            print("  {}".format(webapp_sync.sync_table(app.db, "change", get_changes_rows("../db/changes.txt"), args.full)))
+        print("* sync confs table")
+        with profiling.phase("db_confs"):
+            print("  {}".format(webapp_sync.sync_table(app.db, "conf", get_confs_rows(confs_years), args.full)))
+        print("* sync entries table")
+        with profiling.phase("db_entries"):
+            print("  {}".format(webapp_sync.sync_table(app.db, "entry", get_entries_rows(cryptodb), args.full)))
+        return
 
     print("* update changes table")
-    update_changes(app.db)
+    with profiling.phase("db_changes"):
+        update_changes(app.db)
     print("* update confs table")
-    update_confs(app.db, confs_years)
+    with profiling.phase("db_confs"):
+        update_confs(app.db, confs_years)
     print("* update entries table")
-    update_entries(app.db, cryptodb)
+    with profiling.phase("db_entries"):
+        update_entries(app.db, cryptodb, args.batch_size)
 
 
 if __name__ == "__main__":
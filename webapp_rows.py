@@ -0,0 +1,150 @@
+"""
+Rows of the tables "change", "conf" and "entry" of the web server database.
+
+Each table is produced as a sequence of (row_key, row), where row is a dictionary field name -> value.
+This module does not depend on web2py: it is shared by update_webapp_db.py (web2py DAL)
+and export_webapp_sqlite.py (plain sqlite3).
+mybibtex and config are imported by the functions using them, and mybibtex.generator.config
+is set by the scripts.
+The scripts using this module are responsible for putting "lib" and "db" in sys.path
+before importing it.
+"""
+
+import datetime
+import logging
+import re
+import sys
+
+import crossref_index
+
+_re_date = re.compile(r"^\s*(\d\d\d\d)-(\d\d)-(\d\d)\s*$")
+
+
+def get_changes_rows(filename="db/changes.txt"):
+    """
+    Return the rows of the table "change", as a list of (row_key, row), from `filename` (db/changes.txt)
+
+    changes.txt has to be of the form:
+
+    * yyyy-mm-dd
+    description of change at ...
+
+    * yyyy-mm-dd
+    ...
+    """
+
+    changes = []
+
+    fin = open(filename)
+    lineno = 1
+    for line in fin:
+        if lineno == 1 and line[0] != "*":
+            logging.error("Error: the first line has to start by '*'")
+            sys.exit(1)
+        if line[0] == "*":
+            r = _re_date.match(line[1:])
+            if r == None:
+                logging.error("Error: invalid date on line {}. Date format is yyyy-mm-dd".format(lineno))
+                sys.exit(1)
+            (yy,mm,dd) = r.groups()
+            changes.append((datetime.date(int(yy),int(mm),int(dd)),""))
+        else:
+            (date_c, desc_c) = changes[-1]
+            desc_c = desc_c + line
+            changes[-1] = (date_c, desc_c)
+
+        lineno += 1
+    fin.close()
+
+    rows = []
+    nb_per_date = dict()
+    for (date_c, desc_c) in changes:
+        date_s = date_c.strftime("%Y-%m-%d")
+        nb_per_date[date_s] = nb_per_date.get(date_s, 0) + 1
+        rows.append(("{}#{}".format(date_s, nb_per_date[date_s]), {"date": date_s, "desc": desc_c}))
+    return rows
+
+
+def get_confs_rows(confs_years):
+    """ Return the rows of the table "conf", as a list of (row_key, row) """
+    import config
+
+    return [
+        (confkey, {
+            "type":       conf["type"],
+            "key":        confkey,
+            "name":       conf["name"],
+            "full_name":  conf["full_name"],
+            "start_year": confs_years[confkey][0],
+            "end_year":   confs_years[confkey][1]
+        })
+        for (confkey, conf) in sorted(
+                iter(config.confs.items()),
+                key = lambda k_x: ("a-" if k_x[1]["type"] == "conf" else "b-") + k_x[1]["name"]
+        )
+    ]
+
+
+def get_entry_row(cryptodb, key, entry):
+    """ Return the row of the table "entry" for `entry` """
+    from mybibtex import tools
+    import mybibtex.generator
+
+    fields_orig = mybibtex.generator.bibtex_entry_format_fields(cryptodb, key, entry, expand_crossrefs=False)
+    fields = {k: v.to_bib(expand=False) for (k,v) in fields_orig.items()}
+
+    fields["type"] = entry.type.lower()
+
+    fields["key_conf"] = key.confkey
+    fields["key_year"] = tools.short_to_full_year(key.year)
+    fields["key_auth"] = key.auth
+    fields["key_dis"]  = key.dis
+
+    start_page = None
+    end_page = None
+    if "pages" in fields:
+        pages = fields["pages"]
+        if pages.isdigit():
+            start_page = pages
+        else:
+            a = pages[1:-1].split("--")
+            if len(a) == 1 or len(a) == 2:
+                start_page = a[0]
+            if len(a) == 2:
+                end_page = a[1]
+
+    fields["start_page"] = start_page
+    fields["end_page"]   = end_page
+
+    if "years" in fields:
+        fields["years"] = int(fields["years"])
+
+    if "pages" in fields:
+        del fields["pages"]
+
+    if "crossref" in fields:
+        fields["crossref_expanded"] = fields_orig["crossref"].to_bib(expand=True)[1:-1] # expand and remove quotes
+
+    return fields
+
+
+def get_entries_rows(cryptodb):
+    """
+    Return an iterator over the rows of the table "entry", as (row_key, row): papers first, then the crossrefs they use,
+    both sorted. The dangling crossrefs are detected here, before any row is produced.
+    """
+    import mybibtex.generator
+
+    papers = list(mybibtex.generator.SortConfYearPage().sort(iter(mybibtex.generator.FilterPaper().filter(cryptodb.entries))))
+    index = crossref_index.CrossrefIndex(cryptodb, papers=papers)
+    for (key, crossref) in index.dangling:
+        logging.error("Error: entry {} has a dangling crossref {}".format(key, crossref))
+    if index.dangling:
+        sys.exit(1)
+
+    def rows():
+        for key, entry in papers:
+            yield str(key), get_entry_row(cryptodb, key, entry)
+        for key, entry in index.get_books():
+            yield str(key), get_entry_row(cryptodb, key, entry)
+    return rows()
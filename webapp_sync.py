@@ -0,0 +1,168 @@
+"""
+Incremental synchronization of the tables of the web server database.
+
+Each generated row has a key (e.g., the bibtex key of an entry) and a content hash.
+The hashes of the rows currently in the database are stored in the table "sync_row",
+so that only the rows that differ are inserted, updated or deleted.
+The table "sync_meta" stores, per synchronized table, the hash version and a hash of the table schema:
+if any of them changed, the table is fully rebuilt.
+
+`db` is a web2py DAL database.
+"""
+
+#: bump this when the way rows are hashed changes, to force a full rebuild
+HASH_VERSION = 1
+
+
+def define_sync_tables(db):
+    """ Define the tables storing the sync state, if not already defined """
+    from gluon.dal import Field
+
+    if "sync_meta" not in db.tables:
+        db.define_table(
+            "sync_meta",
+            Field("table_name", "string", unique=True),
+            Field("hash_version", "integer"),
+            Field("schema_hash", "string"),
+        )
+    if "sync_row" not in db.tables:
+        db.define_table(
+            "sync_row",
+            Field("table_name", "string"),
+            Field("row_key", "string"),
+            Field("row_id", "integer"),
+            Field("row_hash", "string"),
+        )
+
+
+def get_row_hash(row):
+    import hashlib
+    import json
+    return hashlib.sha256(json.dumps(row, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_schema_hash(table):
+    import hashlib
+    import json
+    return hashlib.sha256(json.dumps([(f, str(table[f].type)) for f in table.fields]).encode()).hexdigest()
+
+
+class SyncStats(object):
+    def __init__(self):
+        self.full = False
+        self.inserted = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+
+    def __str__(self):
+        if self.full:
+            return "full rebuild: {} rows inserted".format(self.inserted)
+        return "{} inserted, {} updated, {} deleted, {} unchanged".format(
+            self.inserted, self.updated, self.deleted, self.unchanged
+        )
+
+
+def is_state_valid(db, tablename):
+    """ Return True if the stored sync state of `tablename` can be used for an incremental sync """
+    meta = db(db.sync_meta.table_name == tablename).select().first()
+    return meta is not None and \
+        meta.hash_version == HASH_VERSION and \
+        meta.schema_hash == get_schema_hash(db[tablename])
+
+
+def full_sync(db, tablename, rows, stats, batch_size=1000):
+    table = db[tablename]
+    table.truncate()
+    db(db.sync_row.table_name == tablename).delete()
+
+    def flush(batch):
+        ids = table.bulk_insert([row for (row_key, row) in batch])
+        db.sync_row.bulk_insert([
+            {"table_name": tablename, "row_key": row_key, "row_id": row_id, "row_hash": get_row_hash(row)}
+            for ((row_key, row), row_id) in zip(batch, ids)
+        ])
+        stats.inserted += len(batch)
+
+    batch = []
+    for (row_key, row) in rows:
+        batch.append((row_key, row))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    db(db.sync_meta.table_name == tablename).delete()
+    db.sync_meta.insert(table_name=tablename, hash_version=HASH_VERSION, schema_hash=get_schema_hash(table))
+    stats.full = True
+
+
+def incremental_sync(db, tablename, rows, stats):
+    table = db[tablename]
+    # columns missing from a row must be reset when the row is updated
+    empty_row = {f: None for f in table.fields if f != "id"}
+
+    state = {
+        r.row_key: r
+        for r in db(db.sync_row.table_name == tablename).select(
+            db.sync_row.id, db.sync_row.row_key, db.sync_row.row_id, db.sync_row.row_hash
+        )
+    }
+
+    seen = set()
+    for (row_key, row) in rows:
+        if row_key in seen:
+            raise ValueError("duplicate row key {} in table {}".format(row_key, tablename))
+        seen.add(row_key)
+
+        row_hash = get_row_hash(row)
+        if row_key not in state:
+            row_id = table.insert(**row)
+            db.sync_row.insert(table_name=tablename, row_key=row_key, row_id=row_id, row_hash=row_hash)
+            stats.inserted += 1
+        elif state[row_key].row_hash != row_hash:
+            full_row = dict(empty_row)
+            full_row.update(row)
+            db(table.id == state[row_key].row_id).update(**full_row)
+            db(db.sync_row.id == state[row_key].id).update(row_hash=row_hash)
+            stats.updated += 1
+        else:
+            stats.unchanged += 1
+
+    for (row_key, r) in state.items():
+        if row_key not in seen:
+            db(table.id == r.row_id).delete()
+            db(db.sync_row.id == r.id).delete()
+            stats.deleted += 1
+
+
+def sync_table(db, tablename, rows, full=False):
+    """
+    Synchronize the table `tablename` with `rows`, an iterable of (row_key, row) where row is a dictionary.
+    Only the rows that differ are written, unless `full` is True or the stored sync state is not valid,
+    in which case the table is fully rebuilt.
+    Everything is done in one transaction. Return a SyncStats.
+    """
+    define_sync_tables(db)
+    stats = SyncStats()
+    try:
+        if full or not is_state_valid(db, tablename):
+            full_sync(db, tablename, rows, stats)
+        else:
+            incremental_sync(db, tablename, rows, stats)
+    except:
+        db.rollback()
+        raise
+    db.commit()
+    return stats
+
+
+def reset_state(db, tablename):
+    """
+    Forget the sync state of `tablename` (without committing),
+    to be called when the table is rewritten without sync_table
+    """
+    define_sync_tables(db)
+    db(db.sync_meta.table_name == tablename).delete()
+    db(db.sync_row.table_name == tablename).delete()